@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Authoritative-direct query mode
+Instead of asking the recursive resolver for every record, the zone's NS set and the
+addresses of its nameservers are resolved once (recursively, reusing the glue when the
+resolver sends it) and the remaining queries go straight to those authoritative servers,
+spread across all of them. Zone server sets and nameserver host addresses are cached
+for their TTL, so a bulk run over domains on the same DNS provider looks each nameserver
+host up only once.
+
+Queries that an authoritative server can't answer with authority (a referral to a
+delegated subzone, a CNAME leaving the zone, an unreachable server) fall back to the
+recursive resolver. NS queries always go through the recursive resolver, they are what
+the zone's servers are found from.
+"""
+import asyncio
+import copy
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import dns.asyncresolver
+import dns.flags
+import dns.rdatatype
+import dns.resolver
+
+from dns_cache import MAX_POSITIVE_TTL, answer_ttl
+from dns_transport import pooled_nameservers
+
+# Nameservers in a zone's set that get an address, the rest are rarely needed
+MAX_ZONE_SERVERS = 8
+MAX_ZONES = 10000
+# Keep a zone's server set at least this long even when its records have tiny TTLs
+MIN_ZONE_TTL = 60
+
+AUTHORITATIVE_DIRECT = os.environ.get('DNS_AUTHORITATIVE_DIRECT', '').lower() in ('1', 'true', 'yes')
+
+
+def zone_hint(qname):
+    """
+    Name to start zone discovery from: qname without its underscore labels and anything
+    below them, so _dmarc.example.com and google._domainkey.example.com share example.com
+    """
+    labels = str(qname).lower().rstrip('.').split('.')
+    underscored = [i for i, label in enumerate(labels) if label.startswith('_')]
+    if underscored:
+        labels = labels[underscored[-1] + 1:]
+    return '.'.join(labels)
+
+
+def soa_owner(error):
+    """Zone apex named by the SOA in the authority section of an NXDOMAIN/NoAnswer, or None"""
+    if isinstance(error, dns.resolver.NXDOMAIN):
+        responses = list(error.responses().values())
+    else:
+        responses = [error.response()]
+    for response in responses:
+        if response is None:
+            continue
+        for rrset in response.authority:
+            if rrset.rdtype == dns.rdatatype.SOA:
+                return rrset.name.to_text().lower().rstrip('.')
+    return None
+
+
+def is_authoritative(error):
+    """Whether a negative answer from a zone server is final: AA set and no CNAME left to follow"""
+    if isinstance(error, dns.resolver.NXDOMAIN):
+        responses = [response for response in error.responses().values() if response is not None]
+    else:
+        responses = [error.response()] if error.response() is not None else []
+    if not responses:
+        return False
+    for response in responses:
+        if not response.flags & dns.flags.AA:
+            return False
+        if any(rrset.rdtype == dns.rdatatype.CNAME for rrset in response.answer):
+            return False
+    return True
+
+
+def glue_addresses(response):
+    """{host: [addresses]} from the additional section of an NS response"""
+    glue = {}
+    for rrset in getattr(response, 'additional', []):
+        if rrset.rdtype in (dns.rdatatype.A, dns.rdatatype.AAAA):
+            host = rrset.name.to_text().lower().rstrip('.')
+            glue.setdefault(host, []).extend(rdata.address for rdata in rrset)
+    return glue
+
+
+class ZoneServers:
+    """Authoritative server addresses of one zone and the resolver that queries them"""
+
+    def __init__(self, zone, addresses, expires, port=53):
+        self.zone = zone
+        self.addresses = addresses
+        self.expires = expires
+        resolver = dns.asyncresolver.Resolver(configure=False)
+        # One UDP socket per server: a bulk run meets thousands of them
+        resolver.nameservers = pooled_nameservers(addresses, port, udp_sockets=1)
+        resolver.port = port
+        # Authoritative servers don't recurse; rotating spreads the zone's queries over all of them
+        resolver.flags = 0
+        resolver.rotate = True
+        self.resolver = resolver
+
+    def resolver_with(self, timeout, template=None):
+        """The zone's resolver with timeout, and the EDNS options (the DO bit) of template if given"""
+        resolver = copy.copy(self.resolver)
+        resolver.timeout = timeout
+        resolver.lifetime = timeout
+        if template is not None:
+            resolver.use_edns(template.edns, template.ednsflags, template.payload)
+        return resolver
+
+
+class AuthoritativeDirectory:
+    """Process-wide cache of zone server sets and nameserver host addresses, both kept for their TTL"""
+
+    def __init__(self, port=53, max_zones=MAX_ZONES):
+        self.port = port
+        self.max_zones = max_zones
+        self._lock = threading.Lock()
+        self._zones = OrderedDict()
+        self._hosts = {}
+        self._discovering = {}
+        self.zone_hits = 0
+        self.discoveries = 0
+        self.host_hits = 0
+        self.host_lookups = 0
+        self.direct_queries = 0
+        self.fallbacks = 0
+
+    def cached_zone(self, name):
+        """Fresh ZoneServers of the closest cached zone enclosing name, or None"""
+        labels = name.split('.')
+        now = time.time()
+        with self._lock:
+            for i in range(len(labels) - 1):
+                candidate = '.'.join(labels[i:])
+                servers = self._zones.get(candidate)
+                if servers is None:
+                    continue
+                if servers.expires <= now:
+                    del self._zones[candidate]
+                    continue
+                self._zones.move_to_end(candidate)
+                return servers
+        return None
+
+    def _store_zone(self, servers):
+        with self._lock:
+            self._zones[servers.zone] = servers
+            self._zones.move_to_end(servers.zone)
+            while len(self._zones) > self.max_zones:
+                self._zones.popitem(last=False)
+
+    async def servers_for(self, session, qname):
+        """ZoneServers for the zone qname lives in, discovering them once; None when they can't be found"""
+        hint = zone_hint(qname)
+        if not hint:
+            return None
+        servers = self.cached_zone(hint)
+        if servers is not None:
+            self.zone_hits += 1
+            return servers
+        # Every analyzer of a domain asks at once, one discovery answers them all
+        future = self._discovering.get(hint)
+        if future is None or future.get_loop() is not asyncio.get_running_loop():
+            future = asyncio.ensure_future(self._discover(session, hint))
+            self._discovering[hint] = future
+            future.add_done_callback(lambda _future: self._discovering.pop(hint, None))
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            return None
+
+    async def _discover(self, session, name):
+        self.discoveries += 1
+        zone = name
+        try:
+            ns_answer = await session.resolve(name, 'NS', direct=False)
+        except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer) as e:
+            zone = soa_owner(e)
+            if not zone:
+                return None
+            servers = self.cached_zone(zone)
+            if servers is not None:
+                return servers
+            ns_answer = await session.resolve(zone, 'NS', direct=False)
+        hosts = sorted({str(rdata.target).lower().rstrip('.') for rdata in ns_answer})[:MAX_ZONE_SERVERS]
+        glue = glue_addresses(ns_answer.response)
+        lookups = await asyncio.gather(
+            *(self.host_addresses(session, host, glue.get(host)) for host in hosts), return_exceptions=True
+        )
+        addresses = []
+        ttl = answer_ttl(ns_answer) or MIN_ZONE_TTL
+        for lookup in lookups:
+            if isinstance(lookup, BaseException):
+                continue
+            host_addresses, host_ttl = lookup
+            addresses.extend(address for address in host_addresses if address not in addresses)
+            ttl = min(ttl, host_ttl)
+        if not addresses:
+            return None
+        servers = ZoneServers(zone, addresses, time.time() + min(max(ttl, MIN_ZONE_TTL), MAX_POSITIVE_TTL), self.port)
+        self._store_zone(servers)
+        return servers
+
+    async def host_addresses(self, session, host, glue=None):
+        """(addresses, ttl) of a nameserver host: cached, from glue, or resolved recursively (A, then AAAA)"""
+        now = time.time()
+        with self._lock:
+            cached = self._hosts.get(host)
+        if cached is not None and cached[1] > now:
+            self.host_hits += 1
+            return cached[0], cached[1] - now
+        if glue:
+            addresses, ttl = glue, MIN_ZONE_TTL
+        else:
+            self.host_lookups += 1
+            try:
+                answer = await session.resolve(host, 'A', direct=False)
+            except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+                answer = await session.resolve(host, 'AAAA', direct=False)
+            addresses = [rdata.address for rdata in answer]
+            ttl = answer_ttl(answer) or MIN_ZONE_TTL
+        with self._lock:
+            self._hosts[host] = (addresses, now + ttl)
+            if len(self._hosts) > self.max_zones:
+                self._hosts.pop(next(iter(self._hosts)))
+        return addresses, ttl
+
+    async def resolve(self, session, qname, rdtype, timeout):
+        """
+        Answer from the zone's authoritative servers. Returns (handled, answer); handled is False
+        when the query must go to the recursive resolver instead. Final negative answers raise.
+        """
+        servers = await self.servers_for(session, qname)
+        if servers is None:
+            self.fallbacks += 1
+            return False, None
+        self.direct_queries += 1
+        try:
+            return True, await servers.resolver_with(timeout, session.resolver).resolve(qname, rdtype)
+        except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer) as e:
+            if is_authoritative(e):
+                raise
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            pass
+        self.fallbacks += 1
+        return False, None
+
+    def stats(self) -> dict:
+        with self._lock:
+            zones, hosts = len(self._zones), len(self._hosts)
+        return {
+            "zones": zones,
+            "hosts": hosts,
+            "zone_hits": self.zone_hits,
+            "discoveries": self.discoveries,
+            "host_hits": self.host_hits,
+            "host_lookups": self.host_lookups,
+            "direct_queries": self.direct_queries,
+            "fallbacks": self.fallbacks
+        }
+
+
+_directory = AuthoritativeDirectory() if AUTHORITATIVE_DIRECT else None
+
+
+def authoritative_directory():
+    """Process-wide AuthoritativeDirectory, or None when queries go through the recursive resolver"""
+    return _directory
+
+
+def configure_authoritative(enabled=True, port=53):
+    """Send queries straight to each zone's authoritative servers (on port), enabled=False restores recursion"""
+    global _directory
+    _directory = AuthoritativeDirectory(port) if enabled else None
+    return _directory
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Benchmark harness for dns_individual.py
+Starts fake_dns_server on localhost with synthetic zones, points the query layer at it
+and measures per-analyzer and end-to-end latency percentiles, queries per domain and
+domains/second in single-domain and bulk mode. Results are written as JSON so runs
+can be compared, optionally against a baseline run.
+
+Usage:
+  python3 dns_benchmark.py --domains 500 --latency 20 --jitter 10 --loss 0.01 -o run.json
+  python3 dns_benchmark.py --domains 500 --latency 20 --jitter 10 --loss 0.01 --baseline run.json --max-regression 10
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+
+import dns.version
+
+import dns_individual
+from dns_authoritative import authoritative_directory, configure_authoritative
+from dns_bulk import percentile, run_batch
+from dns_cache import answer_cache, configure_answer_cache
+from dns_query import DNSQuerySession, configure_nameservers, run_sync
+from dns_transport import PROTOCOLS, configure_query_strategy, configure_transport, transport_stats
+from fake_dns_server import FakeDNSServer, synthetic_zone
+
+# Metrics compared against a baseline: (path in the results, True when higher is better)
+COMPARED_METRICS = [
+    (("single", "end_to_end_ms", "p50"), False),
+    (("single", "end_to_end_ms", "p99"), False),
+    (("single", "upstream_queries_per_domain"), False),
+    (("bulk", "domains_per_second"), True),
+    (("bulk", "latency_ms", "p99"), False),
+]
+
+
+def latency_summary(latencies) -> dict:
+    """Count, mean and percentiles in milliseconds of a list of latencies in seconds"""
+    values = sorted(latencies)
+    if not values:
+        return {"count": 0}
+
+    def ms(value):
+        return round(value * 1000, 2)
+
+    return {
+        "count": len(values),
+        "mean": ms(sum(values) / len(values)),
+        "p50": ms(percentile(values, 0.50)),
+        "p90": ms(percentile(values, 0.90)),
+        "p99": ms(percentile(values, 0.99)),
+        "max": ms(values[-1])
+    }
+
+
+async def bench_single(domains, timeout, deadline) -> dict:
+    """
+    One domain at a time: every analyzer on its own, then the comprehensive analysis.
+    Analyzers get a fresh session each so their latency includes all of their own queries.
+    """
+    per_analyzer = {record_type: [] for record_type in dns_individual.ANALYZERS}
+    end_to_end = []
+    upstream_queries = 0
+    saved_queries = 0
+    failed = 0
+    for domain in domains:
+        for record_type, analyzer in dns_individual.ANALYZERS.items():
+            started = time.perf_counter()
+            await analyzer(domain, timeout, DNSQuerySession(timeout))
+            per_analyzer[record_type].append(time.perf_counter() - started)
+        started = time.perf_counter()
+        result = await dns_individual.comprehensive_dns_analysis_async(domain, timeout, deadline)
+        end_to_end.append(time.perf_counter() - started)
+        upstream_queries += result["query_stats"]["upstream_queries"]
+        saved_queries += result["query_stats"]["saved_queries"]
+        failed += not result["success"]
+    count = max(1, len(domains))
+    return {
+        "domains": len(domains),
+        "failed": failed,
+        "end_to_end_ms": latency_summary(end_to_end),
+        "per_analyzer_ms": {record_type: latency_summary(values) for record_type, values in per_analyzer.items()},
+        "upstream_queries_per_domain": round(upstream_queries / count, 2),
+        "saved_queries_per_domain": round(saved_queries / count, 2)
+    }
+
+
+async def bench_bulk(domains, timeout, deadline, concurrency) -> dict:
+    """All domains through dns_bulk.run_batch with the given concurrency"""
+    summary = await run_batch(
+        domains,
+        lambda domain: dns_individual.comprehensive_dns_analysis_async(domain, timeout, deadline),
+        concurrency=concurrency
+    )
+    count = max(1, summary["domains"])
+    summary["upstream_queries_per_domain"] = round(summary["upstream_queries"] / count, 2)
+    summary["saved_queries_per_domain"] = round(summary["saved_queries"] / count, 2)
+    return summary
+
+
+def merged_server_stats(servers) -> dict:
+    """Server counters summed over every fake upstream"""
+    merged = {}
+    for server in servers:
+        for key, value in server.stats().items():
+            if isinstance(value, dict):
+                by_type = merged.setdefault(key, {})
+                for name, count in value.items():
+                    by_type[name] = by_type.get(name, 0) + count
+            else:
+                merged[key] = merged.get(key, 0) + value
+    return merged
+
+
+def run_phase(servers, name, coroutine, transport='udp') -> dict:
+    """Run one benchmark phase on a cold cache and fresh upstream counters, attach what the servers saw"""
+    cache = answer_cache()
+    if cache is not None:
+        cache.clear()
+    configure_transport(transport)
+    for server in servers:
+        server.reset_stats()
+    result = run_sync(coroutine)
+    result["upstreams"] = transport_stats()
+    directory = authoritative_directory()
+    if directory is not None:
+        result["authoritative"] = directory.stats()
+    result["server"] = merged_server_stats(servers)
+    domains = max(1, result.get("domains", 0))
+    result["server_queries_per_domain"] = round(result["server"]["queries"] / domains, 2)
+    print(f"{name}: done", file=sys.stderr)
+    return result
+
+
+def lookup(results, path):
+    for key in path:
+        if not isinstance(results, dict) or key not in results:
+            return None
+        results = results[key]
+    return results
+
+
+def compare(results, baseline) -> list:
+    """Relative change of COMPARED_METRICS against baseline; positive regression means worse"""
+    rows = []
+    for path, higher_is_better in COMPARED_METRICS:
+        current, previous = lookup(results, path), lookup(baseline, path)
+        if not isinstance(current, (int, float)) or not isinstance(previous, (int, float)) or previous == 0:
+            continue
+        change = (current - previous) / previous * 100
+        rows.append({
+            "metric": '.'.join(path),
+            "baseline": previous,
+            "current": current,
+            "change_percent": round(change, 1),
+            "regression_percent": round(-change if higher_is_better else change, 1)
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark DNS analysis against a local fake DNS server')
+    parser.add_argument('--domains', type=int, default=200, help='Synthetic domains in the bulk run')
+    parser.add_argument('--single-domains', type=int, default=50, help='Domains analyzed one at a time in the single run')
+    parser.add_argument('--concurrency', type=int, default=64, help='Domains in flight in the bulk run')
+    parser.add_argument('--latency', type=float, default=5.0, help='Base server latency in milliseconds')
+    parser.add_argument('--jitter', type=float, default=5.0, help='Extra uniform random latency in milliseconds')
+    parser.add_argument('--loss', type=float, default=0.0, help='Fraction of queries dropped at random')
+    parser.add_argument('--nxdomain', type=float, default=0.05, help='Fraction of domains that do not exist')
+    parser.add_argument('--timeouts', type=float, default=0.02, help='Fraction of domains with one never-answered qname')
+    parser.add_argument('--timeout', type=float, default=1.0, help='Per-query timeout in seconds')
+    parser.add_argument('--deadline', type=float, default=None, help='Comprehensive analysis deadline in seconds')
+    parser.add_argument('--cache', action='store_true',
+                       help='Keep the answer cache on within each phase (cleared between phases)')
+    parser.add_argument('--transport', choices=PROTOCOLS[:2], default='udp', help='Upstream transport to benchmark')
+    parser.add_argument('--upstreams', type=int, default=1,
+                       help='Fake upstreams serving the same zone (127.0.0.1, 127.0.0.2, ...), hedged copies go to the others')
+    parser.add_argument('--authoritative', action='store_true',
+                       help='Query the fake servers as the zones\' authoritative servers after NS discovery')
+    parser.add_argument('--fixed-timeout', action='store_true', help='Disable the adaptive per-attempt timeout')
+    parser.add_argument('--no-hedge', action='store_true', help='Disable hedged queries')
+    parser.add_argument('--mode', choices=['single', 'bulk', 'all'], default='all')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('-o', '--output', default=None, help='Write the JSON results here instead of stdout')
+    parser.add_argument('--baseline', default=None, metavar='FILE', help='Earlier results to compare against')
+    parser.add_argument('--max-regression', type=float, default=None, metavar='PERCENT',
+                       help='With --baseline, exit 1 when any compared metric regresses by more than PERCENT')
+    args = parser.parse_args()
+
+    hosts = [f'127.0.0.{i + 1}' for i in range(max(1, args.upstreams))]
+    zone, domains = synthetic_zone(args.domains, args.nxdomain, args.timeouts, args.seed,
+                                   ns_addresses=hosts if args.authoritative else None)
+    servers = []
+    port = 0
+    for i, host in enumerate(hosts):
+        # Every upstream listens on the same port of its own loopback address
+        server = FakeDNSServer(zone, host, port, args.latency / 1000, args.jitter / 1000, args.loss, args.seed + i)
+        port = server.start()
+        servers.append(server)
+    configure_nameservers([server.host for server in servers], port)
+    configure_answer_cache(enabled=args.cache)
+    configure_query_strategy(adaptive_timeout=not args.fixed_timeout, hedge=not args.no_hedge)
+    configure_authoritative(args.authoritative, port)
+
+    results = {
+        "benchmark": "dns_individual",
+        "started_at": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        "environment": {
+            "python": platform.python_version(),
+            "dnspython": dns.version.version,
+            "platform": platform.platform()
+        },
+        "config": {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+        "zone": {"domains": len(domains), "timeout_qnames": len(zone.timeouts)}
+    }
+    try:
+        if args.mode in ('single', 'all'):
+            results["single"] = run_phase(
+                servers, 'single', bench_single(domains[:args.single_domains], args.timeout, args.deadline),
+                args.transport
+            )
+        if args.mode in ('bulk', 'all'):
+            results["bulk"] = run_phase(
+                servers, 'bulk', bench_bulk(domains, args.timeout, args.deadline, args.concurrency),
+                args.transport
+            )
+    finally:
+        for server in servers:
+            server.stop()
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            results["comparison"] = compare(results, json.load(f))
+        for row in results["comparison"]:
+            print(f"{row['metric']}: {row['baseline']} -> {row['current']} ({row['change_percent']:+}%)", file=sys.stderr)
+            if args.max_regression is not None and row["regression_percent"] > args.max_regression:
+                exit_code = 1
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Bulk domain analysis for dns_individual.py
+Runs an analysis over every domain read from a file or stdin with bounded concurrency
+on a single event loop, streams one JSON result per line as each domain finishes and
+ends with a summary line
+"""
+import asyncio
+import json
+import math
+import sys
+import time
+
+from dns_query import run_sync
+
+
+def read_domains(source):
+    """Yield normalized domains from an iterable of lines, skipping blanks and # comments"""
+    for line in source:
+        domain = line.split('#', 1)[0].strip().lower().rstrip('.')
+        if domain:
+            yield domain
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values), max(1, math.ceil(fraction * len(sorted_values)))) - 1
+    return sorted_values[index]
+
+
+class BatchStats:
+    """Throughput, latency and query counters collected over one batch"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.latencies = []
+        self.succeeded = 0
+        self.failed = 0
+        self.upstream_queries = 0
+        self.saved_queries = 0
+        self.cache_hits = 0
+        self.coalesced_queries = 0
+
+    def record(self, result, latency):
+        query_stats = result.get("query_stats") or {}
+        self.count(bool(result.get("success")), latency, query_stats.get("upstream_queries", 0),
+                   query_stats.get("saved_queries", 0), query_stats.get("cache_hits", 0),
+                   query_stats.get("coalesced_queries", 0))
+
+    def count(self, success, latency, upstream_queries=0, saved_queries=0, cache_hits=0, coalesced_queries=0):
+        """record() from the counters alone, for results that arrive already encoded"""
+        self.latencies.append(latency)
+        if success:
+            self.succeeded += 1
+        else:
+            self.failed += 1
+        self.upstream_queries += upstream_queries
+        self.saved_queries += saved_queries
+        self.cache_hits += cache_hits
+        self.coalesced_queries += coalesced_queries
+
+    def summary(self) -> dict:
+        elapsed = time.monotonic() - self.started
+        latencies = sorted(self.latencies)
+        count = len(latencies)
+
+        def ms(value):
+            return round(value * 1000, 1) if value is not None else None
+
+        return {
+            "domains": count,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "elapsed_seconds": round(elapsed, 3),
+            "domains_per_second": round(count / elapsed, 2) if elapsed > 0 else None,
+            "latency_ms": {
+                "p50": ms(percentile(latencies, 0.50)),
+                "p90": ms(percentile(latencies, 0.90)),
+                "p99": ms(percentile(latencies, 0.99)),
+                "max": ms(latencies[-1] if latencies else None)
+            },
+            "upstream_queries": self.upstream_queries,
+            "saved_queries": self.saved_queries,
+            "cache_hits": self.cache_hits,
+            "coalesced_queries": self.coalesced_queries
+        }
+
+
+async def run_batch(domains, analyze, concurrency=256, write=None):
+    """
+    Await analyze(domain) for every domain with at most concurrency in flight.
+    Each result is passed to write as it finishes; returns the batch summary.
+    """
+    stats = BatchStats()
+    limit = asyncio.Semaphore(concurrency)
+    pending = set()
+
+    async def run(domain):
+        started = time.monotonic()
+        try:
+            result = await analyze(domain)
+        except Exception as e:
+            result = {"domain": domain, "success": False, "error": str(e)}
+        finally:
+            limit.release()
+        stats.record(result, time.monotonic() - started)
+        if write is not None:
+            write(result)
+
+    # Acquire before creating the task, so a 100k-domain input is never materialized at once.
+    # The source may be stdin or a file: read it in a thread, like dns_worker, so a slow
+    # producer never blocks the loop while queries are in flight
+    loop = asyncio.get_running_loop()
+    source = iter(domains)
+    while True:
+        domain = await loop.run_in_executor(None, next, source, None)
+        if domain is None:
+            break
+        await limit.acquire()
+        task = asyncio.ensure_future(run(domain))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+    if pending:
+        await asyncio.wait(pending)
+    return stats.summary()
+
+
+def write_json_line(result, stream=None):
+    """Write one result as a compact JSON line and flush it"""
+    stream = stream or sys.stdout
+    stream.write(json.dumps(result, separators=(',', ':')) + '\n')
+    stream.flush()
+
+
+def run_batch_file(path, analyze, concurrency=256, stats=None, write=None, write_summary=None):
+    """
+    Analyze domains from path ('-' for stdin), streaming NDJSON to stdout with a final summary line.
+    stats() may return extra counters to merge into the summary; write/write_summary replace
+    the default JSON-lines output for each result and for the summary.
+    """
+    write = write or write_json_line
+    source = sys.stdin if path == '-' else open(path, encoding='utf-8')
+    try:
+        summary = run_sync(run_batch(read_domains(source), analyze, concurrency, write=write))
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    if stats is not None:
+        summary.update(stats())
+    if write_summary is not None:
+        write_summary(summary)
+    else:
+        write_json_line({"summary": summary})
+    return summary
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+TTL-aware DNS answer cache shared by every DNSQuerySession in the process
+Positive answers live for their record TTL, NXDOMAIN/NoAnswer for the SOA-derived
+negative TTL (RFC 2308), and entries are evicted least-recently-used once the
+entry or byte budget is exceeded
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import dns.rdatatype
+import dns.resolver
+
+# RFC 2308 section 5: negative answers should not be cached for more than a few hours
+MAX_NEGATIVE_TTL = 3 * 3600
+MAX_POSITIVE_TTL = 24 * 3600
+# Rough per-entry bookkeeping overhead used for the byte budget
+ENTRY_OVERHEAD = 128
+
+
+def negative_ttl(error):
+    """
+    Negative caching TTL for NXDOMAIN/NoAnswer: min(SOA TTL, SOA MINIMUM) from the authority
+    section. Returns None when the response carries no SOA, such answers must not be cached.
+    """
+    if isinstance(error, dns.resolver.NXDOMAIN):
+        responses = list(error.responses().values())
+    elif isinstance(error, dns.resolver.NoAnswer):
+        responses = [error.response()]
+    else:
+        return None
+    for response in responses:
+        if response is None:
+            continue
+        for rrset in response.authority:
+            if rrset.rdtype == dns.rdatatype.SOA and len(rrset):
+                return min(rrset.ttl, rrset[0].minimum, MAX_NEGATIVE_TTL)
+    return None
+
+
+def answer_ttl(answer):
+    """Remaining TTL of a positive answer"""
+    if answer.rrset is None:
+        return None
+    return min(max(0, answer.expiration - time.time()), MAX_POSITIVE_TTL)
+
+
+def answer_size(key, value):
+    """Approximate memory footprint of a cache entry in bytes"""
+    size = ENTRY_OVERHEAD + len(key[0]) + len(key[1])
+    rrset = getattr(value, 'rrset', None)
+    if rrset is not None:
+        size += sum(len(rdata.to_text()) for rdata in rrset)
+    return size
+
+
+class DNSAnswerCache:
+    """Thread-safe LRU cache of answers and negative answers keyed on (qname, rdtype)"""
+
+    def __init__(self, max_entries=10000, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """
+        Return (True, value, is_negative) for a live entry, (False, None, False) otherwise.
+        A negative value is the NXDOMAIN/NoAnswer exception to re-raise.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return False, None, False
+            self._entries.move_to_end(key)
+            self.hits += 1
+            if entry[2]:
+                self.negative_hits += 1
+            return True, entry[1], entry[2]
+
+    def put_answer(self, key, answer):
+        """Cache a positive answer for its TTL"""
+        ttl = answer_ttl(answer)
+        if ttl:
+            self._put(key, answer, ttl, False)
+
+    def put_error(self, key, error):
+        """Cache NXDOMAIN/NoAnswer per RFC 2308, other errors (timeouts, SERVFAIL) are never cached"""
+        ttl = negative_ttl(error)
+        if ttl:
+            self._put(key, error, ttl, True)
+
+    def _put(self, key, value, ttl, negative):
+        size = answer_size(key, value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + ttl, value, negative, size)
+            self.bytes += size
+            while self._entries and (
+                len(self._entries) > self.max_entries
+                or (self.max_bytes is not None and self.bytes > self.max_bytes)
+            ):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self.bytes -= entry[3]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
+
+
+_answer_cache = DNSAnswerCache()
+
+
+def answer_cache():
+    """Process-wide answer cache, or None when caching is disabled"""
+    return _answer_cache
+
+
+def configure_answer_cache(max_entries=10000, max_bytes=None, enabled=True):
+    """Replace the process-wide answer cache with one using the given budget"""
+    global _answer_cache
+    _answer_cache = DNSAnswerCache(max_entries, max_bytes) if enabled else None
+    return _answer_cache
@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+"""
+DNSSEC validation of comprehensive analysis answers
+With validation on, queries carry the DO bit so answers come back with their RRSIGs. Each
+record type's answer is then checked against the chain of trust from the root anchors:
+  secure         signatures verify with a key chained to the root through DS records
+  insecure       the zone (or an ancestor) is provably unsigned: its parent denies a DS
+  bogus          a signature is missing, expired or does not verify, or a key has no DS
+  indeterminate  the answer or part of the chain could not be obtained (timeout, SERVFAIL)
+Negative answers are secure when the NSEC/NSEC3 records in their authority section carry
+valid signatures; whether they cover the name is not checked.
+
+Each zone's DS and DNSKEY are validated once and kept in a process-wide trust cache until
+the shortest TTL involved expires, so a bulk run over .com domains checks the root and com
+once and only each domain's own DS/DNSKEY afterwards. The signatures of one analysis are
+handed to the executor in a single call, so the event loop is crossed once per analysis;
+each signature is still checked on its own, there is no batch verification.
+
+Requires the cryptography package (pip install cryptography).
+"""
+import asyncio
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import dns.name
+import dns.rdata
+import dns.rdataclass
+import dns.rdatatype
+import dns.resolver
+import dns.rrset
+
+from dns_cache import MAX_POSITIVE_TTL, answer_ttl, negative_ttl
+
+SECURE = 'secure'
+INSECURE = 'insecure'
+BOGUS = 'bogus'
+INDETERMINATE = 'indeterminate'
+# Worst first: a record type spanning several names reports the worst of them
+SEVERITY = (BOGUS, INDETERMINATE, INSECURE, SECURE)
+
+# IANA root zone trust anchors: KSK-2017 and KSK-2024
+ROOT_ANCHORS = (
+    '20326 8 2 E06D44B80B8F1D39A95C0B0D7C65D08458E880409BBC683457104237C7F8EC8D',
+    '38696 8 2 683D2D0ACB8C9B712A1948B27F741219298D0A450D612C483AF444A4C0FB2B16',
+)
+MAX_ZONES = 10000
+# Bogus and indeterminate chains are retried after this, a broken zone may be fixed meanwhile
+FAILURE_TTL = 60
+DENIAL_TYPES = (dns.rdatatype.NSEC, dns.rdatatype.NSEC3)
+DKIM_SELECTOR = re.compile(r'selector: ([^)]+)\)')
+
+
+def load_dnssec():
+    try:
+        import cryptography  # noqa: F401 - dnspython verifies signatures with it
+    except ImportError:
+        raise RuntimeError("DNSSEC validation requires the cryptography package (pip install cryptography)")
+    import dns.dnssec
+    return dns.dnssec
+
+
+def algorithm_supported(algorithm) -> bool:
+    import dns.dnssecalgs
+    try:
+        dns.dnssecalgs.get_algorithm_cls(algorithm)
+        return True
+    except Exception:
+        return False
+
+
+def worst(statuses):
+    statuses = list(statuses)
+    for status in SEVERITY:
+        if status in statuses:
+            return status
+    return None
+
+
+def parent_name(name):
+    return name.parent() if name != dns.name.root else None
+
+
+def signatures(response, section, rrset):
+    """RRSIG set covering rrset in section of response, or None"""
+    return response.get_rrset(section, rrset.name, dns.rdataclass.IN, dns.rdatatype.RRSIG, rrset.rdtype)
+
+
+def signer(rrsigs):
+    return next(iter(rrsigs)).signer
+
+
+def rrsig_ttl(rrsigs, now):
+    """Seconds until the first signature of rrsigs expires"""
+    return min(rrsig.expiration for rrsig in rrsigs) - now
+
+
+def negative_responses(error):
+    if isinstance(error, dns.resolver.NXDOMAIN):
+        return [response for response in error.responses().values() if response is not None]
+    response = error.response()
+    return [response] if response is not None else []
+
+
+class ZoneTrust:
+    """Validation state of one name's zone: its apex, status and, when secure, the apex's DNSKEY set"""
+
+    def __init__(self, zone, status, keys=None, expires=0.0, reason=None):
+        self.zone = zone
+        self.status = status
+        self.keys = keys
+        self.expires = expires
+        self.reason = reason
+
+
+class TrustCache:
+    """Process-wide cache of validated zone keys and DS denials, each kept for its TTL"""
+
+    def __init__(self, anchors=ROOT_ANCHORS, max_zones=MAX_ZONES):
+        self.dnssec = load_dnssec()
+        self.anchors = [dns.rdata.from_text('IN', 'DS', anchor) for anchor in anchors]
+        self.max_zones = max_zones
+        self._lock = threading.Lock()
+        self._zones = OrderedDict()
+        self._establishing = {}
+        self.hits = 0
+        self.zone_validations = 0
+        self.signatures_verified = 0
+        self.executor_calls = 0
+
+    def verify(self, rrset, rrsigs, keys):
+        """None when rrsigs validate rrset with keys, otherwise the reason they don't"""
+        self.signatures_verified += 1
+        try:
+            self.dnssec.validate(rrset, rrsigs, {keys.name: keys})
+            return None
+        except self.dnssec.ValidationFailure as e:
+            return str(e) or 'signature does not verify'
+        except Exception as e:
+            return str(e) or type(e).__name__
+
+    def verify_all(self, jobs) -> list:
+        """verify() for every (rrset, rrsigs, keys) of jobs, one after another"""
+        return [self.verify(*job) for job in jobs]
+
+    def cached(self, name):
+        now = time.time()
+        with self._lock:
+            trust = self._zones.get(name)
+            if trust is None:
+                return None
+            if trust.expires <= now:
+                del self._zones[name]
+                return None
+            self._zones.move_to_end(name)
+            return trust
+
+    def _store(self, name, trust):
+        with self._lock:
+            self._zones[name] = trust
+            self._zones.move_to_end(name)
+            while len(self._zones) > self.max_zones:
+                self._zones.popitem(last=False)
+
+    async def zone(self, session, name) -> ZoneTrust:
+        """ZoneTrust of the zone name belongs to, validated once per TTL and shared by concurrent callers"""
+        trust = self.cached(name)
+        if trust is not None:
+            self.hits += 1
+            return trust
+        future = self._establishing.get(name)
+        if future is None or future.get_loop() is not asyncio.get_running_loop():
+            future = asyncio.ensure_future(self._establish(session, name))
+            self._establishing[name] = future
+            future.add_done_callback(lambda _future: self._establishing.pop(name, None))
+        return await asyncio.shield(future)
+
+    async def _establish(self, session, name) -> ZoneTrust:
+        self.zone_validations += 1
+        try:
+            if name == dns.name.root:
+                trust = await self._root(session)
+            else:
+                trust = await self._delegation(session, name)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            trust = ZoneTrust(name, INDETERMINATE, reason=f"{name}: {e or type(e).__name__}")
+        if trust.status in (BOGUS, INDETERMINATE):
+            trust.expires = time.time() + FAILURE_TTL
+        self._store(name, trust)
+        return trust
+
+    async def _root(self, session) -> ZoneTrust:
+        answer = await session.resolve(dns.name.root, 'DNSKEY', direct=False)
+        keys = answer.rrset
+        rrsigs = signatures(answer.response, answer.response.answer, keys)
+        now = time.time()
+        if rrsigs is None:
+            return ZoneTrust(dns.name.root, BOGUS, reason='root DNSKEY is unsigned')
+        anchored = [key for key in keys if self.matches(key, self.anchors, dns.name.root)]
+        if not anchored:
+            return ZoneTrust(dns.name.root, BOGUS, reason='no root DNSKEY matches a trust anchor')
+        error = self.verify(keys, rrsigs, self.key_set(dns.name.root, keys, anchored))
+        if error is not None:
+            return ZoneTrust(dns.name.root, BOGUS, reason=f"root DNSKEY: {error}")
+        ttl = min(answer_ttl(answer) or MAX_POSITIVE_TTL, rrsig_ttl(rrsigs, now), MAX_POSITIVE_TTL)
+        return ZoneTrust(dns.name.root, SECURE, keys, now + ttl)
+
+    def matches(self, key, ds_set, owner) -> bool:
+        """Whether DNSKEY key is the one a DS of ds_set digests"""
+        for ds in ds_set:
+            if ds.key_tag != self.dnssec.key_id(key) or ds.algorithm != key.algorithm:
+                continue
+            try:
+                if self.dnssec.make_ds(owner, key, ds.digest_type) == ds:
+                    return True
+            except Exception:
+                continue
+        return False
+
+    @staticmethod
+    def key_set(owner, keys, chosen):
+        key_set = dns.rrset.RRset(owner, dns.rdataclass.IN, dns.rdatatype.DNSKEY)
+        key_set.update_ttl(keys.ttl)
+        for key in chosen:
+            key_set.add(key)
+        return key_set
+
+    async def _delegation(self, session, name) -> ZoneTrust:
+        parent = await self.zone(session, parent_name(name))
+        if parent.status != SECURE:
+            # Nothing below an insecure or failed zone can be secure, and it costs no queries
+            return ZoneTrust(parent.zone, parent.status, parent.keys, parent.expires, parent.reason)
+        now = time.time()
+        try:
+            ds_answer = await session.resolve(name, 'DS', direct=False)
+        except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer) as denial:
+            return await self._no_ds(session, name, parent, denial)
+        ds_set = ds_answer.rrset
+        ds_sigs = signatures(ds_answer.response, ds_answer.response.answer, ds_set)
+        if ds_sigs is None or signer(ds_sigs) != parent.zone:
+            return ZoneTrust(name, BOGUS, reason=f"{name} DS is not signed by {parent.zone}")
+        error = self.verify(ds_set, ds_sigs, parent.keys)
+        if error is not None:
+            return ZoneTrust(name, BOGUS, reason=f"{name} DS: {error}")
+        try:
+            key_answer = await session.resolve(name, 'DNSKEY', direct=False)
+        except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+            return ZoneTrust(name, BOGUS, reason=f"{name} has a DS but no DNSKEY")
+        keys = key_answer.rrset
+        key_sigs = signatures(key_answer.response, key_answer.response.answer, keys)
+        if key_sigs is None:
+            return ZoneTrust(name, BOGUS, reason=f"{name} DNSKEY is unsigned")
+        supported = [ds for ds in ds_set if algorithm_supported(ds.algorithm)]
+        if not supported:
+            # RFC 4035 5.2: a DS set with only unknown algorithms makes the zone insecure
+            return ZoneTrust(name, INSECURE, expires=now + min(answer_ttl(ds_answer) or FAILURE_TTL, MAX_POSITIVE_TTL))
+        chained = [key for key in keys if self.matches(key, supported, name)]
+        if not chained:
+            return ZoneTrust(name, BOGUS, reason=f"no {name} DNSKEY matches its DS")
+        error = self.verify(keys, key_sigs, self.key_set(name, keys, chained))
+        if error is not None:
+            return ZoneTrust(name, BOGUS, reason=f"{name} DNSKEY: {error}")
+        ttl = min(answer_ttl(ds_answer) or MAX_POSITIVE_TTL, answer_ttl(key_answer) or MAX_POSITIVE_TTL,
+                  rrsig_ttl(ds_sigs, now), rrsig_ttl(key_sigs, now), parent.expires - now, MAX_POSITIVE_TTL)
+        return ZoneTrust(name, SECURE, keys, now + ttl)
+
+    async def _no_ds(self, session, name, parent, denial) -> ZoneTrust:
+        """name has no DS: either it is not a zone cut (same zone as parent) or a provably unsigned delegation"""
+        try:
+            # Only a zone apex owns an SOA; an unsigned zone has no DNSKEY to tell it by
+            soa = await session.resolve(name, 'SOA', direct=False)
+            apex = soa.rrset.name == name
+        except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+            apex = False
+        if not apex:
+            return ZoneTrust(parent.zone, SECURE, parent.keys, parent.expires)
+        jobs = self.denial_jobs(negative_responses(denial), parent)
+        if not jobs:
+            return ZoneTrust(name, BOGUS, reason=f"{name} is delegated without a DS and the denial is unsigned")
+        errors = [error for error in self.verify_all(jobs) if error is not None]
+        if errors:
+            return ZoneTrust(name, BOGUS, reason=f"{name} DS denial: {errors[0]}")
+        expires = min(parent.expires, time.time() + (negative_ttl(denial) or FAILURE_TTL))
+        return ZoneTrust(name, INSECURE, expires=expires)
+
+    @staticmethod
+    def denial_jobs(responses, trust) -> list:
+        """(rrset, rrsigs, keys) of the signed NSEC/NSEC3 records of responses that trust's zone can check"""
+        jobs = []
+        for response in responses:
+            for rrset in response.authority:
+                if rrset.rdtype not in DENIAL_TYPES:
+                    continue
+                rrsigs = signatures(response, response.authority, rrset)
+                if rrsigs is None or signer(rrsigs) != trust.zone:
+                    return []
+                jobs.append((rrset, rrsigs, trust.keys))
+        return jobs
+
+    def stats(self) -> dict:
+        with self._lock:
+            zones = len(self._zones)
+        return {
+            "zones": zones,
+            "hits": self.hits,
+            "zone_validations": self.zone_validations,
+            "signatures_verified": self.signatures_verified,
+            "executor_calls": self.executor_calls
+        }
+
+
+def record_queries(domain, record_type, case) -> list:
+    """(qname, rdtype) pairs whose answers make up one record type's use_case"""
+    if record_type == 'SPF':
+        return [(domain, 'TXT')]
+    if record_type == 'DMARC':
+        return [(f"_dmarc.{domain}", 'TXT')]
+    if record_type == 'DKIM':
+        return [(f"{selector}._domainkey.{domain}", 'TXT')
+                for record in case.get("records") or [] for selector in DKIM_SELECTOR.findall(record)]
+    return [(domain, record_type)]
+
+
+class DNSSECValidator:
+    """Annotates the use_cases of an analysis with the DNSSEC status of the answers behind them"""
+
+    def __init__(self, trust):
+        self.trust = trust
+
+    async def _plan(self, session, outcome):
+        """
+        ([jobs], status, reason) for one answer or negative answer: the signatures to verify and
+        the status they make when all verify, or a final status with no jobs
+        """
+        answer, error = outcome
+        if answer is None:
+            if not isinstance(error, (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer)):
+                return [], INDETERMINATE, str(error) or type(error).__name__
+            responses = negative_responses(error)
+            if not responses:
+                return [], INDETERMINATE, 'negative answer without its response'
+            denials = [signatures(response, response.authority, rrset) for response in responses
+                       for rrset in response.authority if rrset.rdtype in DENIAL_TYPES]
+            # The zone that signed the denial, or the one the name would be in when nothing is signed
+            signed_by = signer(denials[0]) if denials and denials[0] is not None else None
+            trust = await self.trust.zone(session, signed_by or responses[0].question[0].name)
+            if trust.status != SECURE:
+                return [], trust.status, trust.reason
+            jobs = self.trust.denial_jobs(responses, trust)
+            if not jobs:
+                return [], BOGUS, 'negative answer without a signed denial'
+            return jobs, SECURE, None
+        jobs = []
+        response = answer.response
+        for rrset in response.answer:
+            if rrset.rdtype == dns.rdatatype.RRSIG:
+                continue
+            rrsigs = signatures(response, response.answer, rrset)
+            if rrsigs is None:
+                trust = await self.trust.zone(session, rrset.name)
+                if trust.status == SECURE:
+                    return [], BOGUS, f"{rrset.name} {dns.rdatatype.to_text(rrset.rdtype)} is unsigned in a signed zone"
+                return [], trust.status, trust.reason
+            zone = signer(rrsigs)
+            if not rrset.name.is_subdomain(zone):
+                return [], BOGUS, f"{rrset.name} is signed by {zone}, which does not contain it"
+            trust = await self.trust.zone(session, zone)
+            if trust.status != SECURE:
+                return [], trust.status, trust.reason
+            if trust.zone != zone:
+                return [], BOGUS, f"{zone} signs {rrset.name} but is not a zone apex"
+            jobs.append((rrset, rrsigs, trust.keys))
+        return jobs, SECURE, None
+
+    async def annotate(self, session, domain, results, timeout=None):
+        """
+        Set use_case["dnssec"] = {"status", "reason"?} on the use_cases of results ({record_type: result});
+        what is not validated within timeout seconds is reported indeterminate
+        """
+        loop = asyncio.get_running_loop()
+        expires = loop.time() + timeout if timeout is not None else None
+        outcomes = {}
+        for record_type, result in results.items():
+            case = result["use_cases"].get(record_type)
+            if case is None:
+                continue
+            for qname, rdtype in record_queries(domain, record_type, case):
+                outcome = session.answered(qname, rdtype)
+                if outcome is not None:
+                    outcomes[(qname, rdtype)] = outcome
+        try:
+            planned = await asyncio.wait_for(asyncio.gather(
+                *(self._plan(session, outcome) for outcome in outcomes.values()), return_exceptions=True
+            ), timeout)
+        except asyncio.TimeoutError:
+            planned = [asyncio.TimeoutError('chain of trust not validated in time')] * len(outcomes)
+        plans = dict(zip(outcomes, planned))
+        # Every signature of the analysis in one executor call
+        jobs = [(key, job) for key, plan in plans.items() if not isinstance(plan, BaseException) for job in plan[0]]
+        errors = {}
+        if jobs:
+            self.trust.executor_calls += 1
+            try:
+                verified = await asyncio.wait_for(
+                    loop.run_in_executor(None, self.trust.verify_all, [job for _key, job in jobs]),
+                    max(0.0, expires - loop.time()) if expires is not None else None
+                )
+            except asyncio.TimeoutError:
+                late = asyncio.TimeoutError('signatures not verified in time')
+                plans.update((key, late) for key, _job in jobs)
+                verified = []
+            for (key, _job), error in zip(jobs, verified):
+                if error is not None:
+                    errors.setdefault(key, error)
+        statuses = {}
+        for key, plan in plans.items():
+            if isinstance(plan, BaseException):
+                statuses[key] = (INDETERMINATE, str(plan) or type(plan).__name__)
+            elif key in errors:
+                statuses[key] = (BOGUS, errors[key])
+            else:
+                statuses[key] = (plan[1], plan[2])
+        for record_type, result in results.items():
+            case = result["use_cases"].get(record_type)
+            if case is None:
+                continue
+            found = [statuses[key] for key in record_queries(domain, record_type, case) if key in statuses]
+            if not found:
+                continue
+            status = worst(status for status, _reason in found)
+            case["dnssec"] = {"status": status}
+            reason = next((reason for found_status, reason in found if found_status == status and reason), None)
+            if reason and status != SECURE:
+                case["dnssec"]["reason"] = reason
+
+
+_validator = None
+
+
+def dnssec_validator():
+    """Process-wide DNSSECValidator, or None when validation is off"""
+    return _validator
+
+
+def configure_dnssec_validation(enabled=True, anchors=ROOT_ANCHORS, max_zones=MAX_ZONES):
+    """
+    Validate comprehensive analysis answers against anchors (DS records of the root, as text);
+    raises RuntimeError when the cryptography package is missing
+    """
+    from dns_query import request_dnssec_records
+
+    global _validator
+    _validator = DNSSECValidator(TrustCache(anchors, max_zones)) if enabled else None
+    request_dnssec_records(enabled)
+    return _validator
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Shared-infrastructure enrichment for bulk runs
+The MX, NS and CNAME records of a portfolio point at a handful of hosts
+(aspmx.l.google.com, *.mail.protection.outlook.com, a DNS provider's nameservers).
+Every target is resolved to its A/AAAA addresses once per batch and the result is
+joined onto each use_case that names it as "targets", so the work grows with the
+number of unique hosts rather than with the number of domains.
+
+  "MX": {"Status": "Valid", "records": ["aspmx.l.google.com"],
+         "targets": {"aspmx.l.google.com": {"status": "Resolved", "ipv4": [...], "ipv6": [...]}}}
+"""
+import asyncio
+
+import dns.resolver
+
+from dns_query import DNSQuerySession
+
+ENRICHED_TYPES = ('MX', 'NS', 'CNAME')
+
+
+def target_hosts(case) -> list:
+    """Distinct hostnames a MX/NS/CNAME use_case points at; a null MX ('.') names none"""
+    hosts = []
+    for record in case.get("records") or []:
+        host = str(record).strip().rstrip('.').lower()
+        if host and host not in hosts:
+            hosts.append(host)
+    return hosts
+
+
+class TargetResolver:
+    """Addresses of every MX/NS/CNAME target seen in a batch, each host resolved once"""
+
+    def __init__(self, timeout=10):
+        self.timeout = timeout
+        self._targets = {}
+        self.lookups = 0
+        self.joins = 0
+
+    async def _resolve(self, host) -> dict:
+        session = DNSQuerySession(self.timeout)
+        self.lookups += 1
+
+        async def addresses(rdtype):
+            try:
+                return [rdata.address for rdata in await session.resolve(host, rdtype)], None
+            except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+                return [], None
+            except Exception as e:
+                return [], e
+
+        (ipv4, ipv4_error), (ipv6, ipv6_error) = await asyncio.gather(addresses('A'), addresses('AAAA'))
+        target = {"status": "Resolved" if ipv4 or ipv6 else "No address", "ipv4": ipv4, "ipv6": ipv6}
+        error = ipv4_error or ipv6_error
+        if error is not None and not (ipv4 or ipv6):
+            target["status"] = "Error"
+            target["error"] = str(error) or type(error).__name__
+        return target
+
+    async def resolve(self, host) -> dict:
+        """Addresses of host, shared with every other domain in the batch that points at it"""
+        self.joins += 1
+        future = self._targets.get(host)
+        if future is None or future.get_loop() is not asyncio.get_running_loop():
+            future = asyncio.ensure_future(self._resolve(host))
+            self._targets[host] = future
+        return await asyncio.shield(future)
+
+    async def enrich(self, result) -> dict:
+        """Join target addresses onto the MX/NS/CNAME use_cases of result, in place"""
+        use_cases = result.get("use_cases") or {}
+        cases = [(use_cases[record_type], target_hosts(use_cases[record_type]))
+                 for record_type in ENRICHED_TYPES if record_type in use_cases]
+        hosts = list(dict.fromkeys(host for _case, case_hosts in cases for host in case_hosts))
+        resolved = dict(zip(hosts, await asyncio.gather(*(self.resolve(host) for host in hosts))))
+        for case, case_hosts in cases:
+            if case_hosts:
+                case["targets"] = {host: resolved[host] for host in case_hosts}
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "unique_targets": len(self._targets),
+            "target_lookups": self.lookups,
+            "target_references": self.joins
+        }
@@ -1,17 +1,33 @@
 #!/usr/bin/env python3
 """
 Individual DNS record type analysis functions
-Each function returns the same structure but only with the requested record type populated
+Each function returns the same structure but only with the requested record type populated.
+Every analyzer is implemented as an asyncio coroutine (analyze_*_record_async) on top of
+dns.asyncresolver; the synchronous analyze_*_record functions are thin wrappers around them.
 """
+import asyncio
 import json
 import argparse
-import dns.resolver
-import socket
+import os
+import sys
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
 
+from dns_authoritative import authoritative_directory, configure_authoritative
+from dns_cache import answer_cache, configure_answer_cache
+from dns_dnssec import configure_dnssec_validation, dnssec_validator
+from dns_output import FORMATS, ResultWriter, full_size
+from dns_query import (DNSQuerySession, SingleFlight, configure_nameservers, configure_query_coalescing,
+                       configure_rate_limiter, query_flights, run_sync)
+from dns_spf import MAX_CACHED_RECORDS, configure_spf_evaluation, evaluate_spf, include_cache, spf_evaluation_enabled
+from dns_store import configure_result_store, result_store
+from dns_trace import ChromeTraceWriter, active_span, configure_metrics, finish_span, metrics, start_span, tracing
+from dns_transport import (CIRCUIT_THRESHOLD, PROTOCOLS, RETRY_BUDGET, configure_query_strategy, configure_resilience,
+                           configure_transport, retry_budget_stats, transport_stats)
+from provider_index import HOSTING_SITE_TOKEN, PRIVATE, provider_index
+from use_cases import metadata_table, strip_event, strip_metadata, use_case
 
-def analyze_a_record(domain, timeout=10) -> dict:
+
+async def analyze_a_record_async(domain, timeout=10, session=None) -> dict:
     """Analyze only A records"""
     result = {
         "domain": domain,
@@ -23,19 +39,10 @@ def analyze_a_record(domain, timeout=10) -> dict:
         "spf_record_published": False,
         "success": True
     }
-    a_case = {
-        "Goal": "Email deliverability",
-        "Purpose": "Maps domain → IPv4 address",
-        "Expected": "Ensure points to correct web server IP",
-        "Notes": "A record is required for email deliverability",
-        "Status": "Not present",
-        "records": []
-    }
-    resolver = dns.resolver.Resolver()
-    resolver.timeout = timeout
-    resolver.lifetime = timeout
+    a_case = use_case("A")
+    session = session or DNSQuerySession(timeout)
     try:
-        a_answers = resolver.resolve(domain, 'A')
+        a_answers = await session.resolve(domain, 'A')
         a_records = [str(answer) for answer in a_answers]
         a_case["Status"] = "Valid" if a_records else "Not present"
         a_case["records"] = a_records
@@ -48,7 +55,12 @@ def analyze_a_record(domain, timeout=10) -> dict:
     return result
 
 
-def analyze_aaaa_record(domain, timeout=10) -> dict:
+def analyze_a_record(domain, timeout=10) -> dict:
+    """Analyze only A records"""
+    return run_sync(analyze_a_record_async(domain, timeout))
+
+
+async def analyze_aaaa_record_async(domain, timeout=10, session=None) -> dict:
     """Analyze only AAAA records"""
     result = {
         "domain": domain,
@@ -60,23 +72,15 @@ def analyze_aaaa_record(domain, timeout=10) -> dict:
         "spf_record_published": False,
         "success": True
     }
-    aaaa_case = {
-        "Goal": "IPv6 support",
-        "Purpose": "Maps domain → IPv6 address",
-        "Expected": "IPv6 address for modern connectivity",
-        "Notes": "Optional but recommended for future-proofing",
-        "Status": "Not present",
-        "records": []
-    }
-    resolver = dns.resolver.Resolver()
-    resolver.timeout = timeout
-    resolver.lifetime = timeout
+    aaaa_case = use_case("AAAA")
+    session = session or DNSQuerySession(timeout)
     try:
-        aaaa_answers = resolver.resolve(domain, 'AAAA')
+        aaaa_answers = await session.resolve(domain, 'AAAA')
         aaaa_records = [str(answer) for answer in aaaa_answers]
         aaaa_case["Status"] = "Valid" if aaaa_records else "Not present"
         aaaa_case["records"] = aaaa_records
         result["dns_record_published"] = bool(aaaa_records)
+        result["hosting_provider"] = detect_hosting_provider(aaaa_records, [], [])
     except Exception as e:
         aaaa_case["Error"] = str(e)
         result["success"] = False
@@ -84,7 +88,12 @@ def analyze_aaaa_record(domain, timeout=10) -> dict:
     return result
 
 
-def analyze_cname_record(domain, timeout=10) -> dict:
+def analyze_aaaa_record(domain, timeout=10) -> dict:
+    """Analyze only AAAA records"""
+    return run_sync(analyze_aaaa_record_async(domain, timeout))
+
+
+async def analyze_cname_record_async(domain, timeout=10, session=None) -> dict:
     """Analyze only CNAME records"""
     result = {
         "domain": domain,
@@ -96,19 +105,10 @@ def analyze_cname_record(domain, timeout=10) -> dict:
         "spf_record_published": False,
         "success": True
     }
-    cname_case = {
-        "Goal": "Domain aliasing",
-        "Purpose": "Maps domain → another domain",
-        "Expected": "Points to target domain for redirection",
-        "Notes": "Cannot coexist with A record for same domain",
-        "Status": "Not present",
-        "records": []
-    }
-    resolver = dns.resolver.Resolver()
-    resolver.timeout = timeout
-    resolver.lifetime = timeout
+    cname_case = use_case("CNAME")
+    session = session or DNSQuerySession(timeout)
     try:
-        cname_answers = resolver.resolve(domain, 'CNAME')
+        cname_answers = await session.resolve(domain, 'CNAME')
         cname_records = [str(answer).rstrip('.') for answer in cname_answers]
         cname_case["Status"] = "Valid" if cname_records else "Not present"
         cname_case["records"] = cname_records
@@ -121,7 +121,12 @@ def analyze_cname_record(domain, timeout=10) -> dict:
     return result
 
 
-def analyze_mx_record(domain, timeout=10) -> dict:
+def analyze_cname_record(domain, timeout=10) -> dict:
+    """Analyze only CNAME records"""
+    return run_sync(analyze_cname_record_async(domain, timeout))
+
+
+async def analyze_mx_record_async(domain, timeout=10, session=None) -> dict:
     """Analyze only MX records"""
     result = {
         "domain": domain,
@@ -133,19 +138,10 @@ def analyze_mx_record(domain, timeout=10) -> dict:
         "spf_record_published": False,
         "success": True
     }
-    mx_case = {
-        "Goal": "Email routing",
-        "Purpose": "Maps domain → mail servers",
-        "Expected": "List of mail servers in priority order",
-        "Notes": "Essential for email delivery",
-        "Status": "Not present",
-        "records": []
-    }
-    resolver = dns.resolver.Resolver()
-    resolver.timeout = timeout
-    resolver.lifetime = timeout
+    mx_case = use_case("MX")
+    session = session or DNSQuerySession(timeout)
     try:
-        mx_answers = resolver.resolve(domain, 'MX')
+        mx_answers = await session.resolve(domain, 'MX')
         mx_records = [str(answer.exchange).rstrip('.') for answer in mx_answers]
         mx_case["Status"] = "Valid" if mx_records else "Not present"
         mx_case["records"] = mx_records
@@ -156,7 +152,12 @@ def analyze_mx_record(domain, timeout=10) -> dict:
     return result
 
 
-def analyze_ns_record(domain, timeout=10) -> dict:
+def analyze_mx_record(domain, timeout=10) -> dict:
+    """Analyze only MX records"""
+    return run_sync(analyze_mx_record_async(domain, timeout))
+
+
+async def analyze_ns_record_async(domain, timeout=10, session=None) -> dict:
     """Analyze only NS records"""
     result = {
         "domain": domain,
@@ -168,19 +169,10 @@ def analyze_ns_record(domain, timeout=10) -> dict:
         "spf_record_published": False,
         "success": True
     }
-    ns_case = {
-        "Goal": "DNS delegation",
-        "Purpose": "Maps domain → authoritative name servers",
-        "Expected": "List of authoritative DNS servers",
-        "Notes": "Required for domain to function",
-        "Status": "Not present",
-        "records": []
-    }
-    resolver = dns.resolver.Resolver()
-    resolver.timeout = timeout
-    resolver.lifetime = timeout
+    ns_case = use_case("NS")
+    session = session or DNSQuerySession(timeout)
     try:
-        ns_answers = resolver.resolve(domain, 'NS')
+        ns_answers = await session.resolve(domain, 'NS')
         ns_records = [str(answer).rstrip('.') for answer in ns_answers]
         ns_case["Status"] = "Valid" if ns_records else "Not present"
         ns_case["records"] = ns_records
@@ -192,7 +184,12 @@ def analyze_ns_record(domain, timeout=10) -> dict:
     return result
 
 
-def analyze_soa_record(domain, timeout=10) -> dict:
+def analyze_ns_record(domain, timeout=10) -> dict:
+    """Analyze only NS records"""
+    return run_sync(analyze_ns_record_async(domain, timeout))
+
+
+async def analyze_soa_record_async(domain, timeout=10, session=None) -> dict:
     """Analyze only SOA records"""
     result = {
         "domain": domain,
@@ -204,19 +201,10 @@ def analyze_soa_record(domain, timeout=10) -> dict:
         "spf_record_published": False,
         "success": True
     }
-    soa_case = {
-        "Goal": "Zone authority",
-        "Purpose": "Defines zone parameters and authority",
-        "Expected": "Zone start of authority information",
-        "Notes": "Required for DNS zone management",
-        "Status": "Not present",
-        "records": []
-    }
-    resolver = dns.resolver.Resolver()
-    resolver.timeout = timeout
-    resolver.lifetime = timeout
+    soa_case = use_case("SOA")
+    session = session or DNSQuerySession(timeout)
     try:
-        soa_answers = resolver.resolve(domain, 'SOA')
+        soa_answers = await session.resolve(domain, 'SOA')
         if soa_answers:
             soa = soa_answers[0]
             soa_data = {
@@ -237,7 +225,12 @@ def analyze_soa_record(domain, timeout=10) -> dict:
     return result
 
 
-def analyze_caa_record(domain, timeout=10) -> dict:
+def analyze_soa_record(domain, timeout=10) -> dict:
+    """Analyze only SOA records"""
+    return run_sync(analyze_soa_record_async(domain, timeout))
+
+
+async def analyze_caa_record_async(domain, timeout=10, session=None) -> dict:
     """Analyze only CAA records"""
     result = {
         "domain": domain,
@@ -250,37 +243,26 @@ def analyze_caa_record(domain, timeout=10) -> dict:
         "success": True
     }
     
-    resolver = dns.resolver.Resolver()
-    resolver.timeout = timeout
-    resolver.lifetime = timeout
+    session = session or DNSQuerySession(timeout)
     
     try:
-        caa_answers = resolver.resolve(domain, 'CAA')
+        caa_answers = await session.resolve(domain, 'CAA')
         caa_records = [str(answer) for answer in caa_answers]
-        result["use_cases"]["CAA"] = {
-            "Goal": "Certificate authority authorization",
-            "Purpose": "Specifies allowed CAs for SSL certificates",
-            "Expected": "List of authorized certificate authorities",
-            "Notes": "Security measure for SSL certificate issuance",
-            "Status": "Valid" if caa_records else "Not present",
-            "records": caa_records
-        }
+        result["use_cases"]["CAA"] = use_case("CAA", "Valid" if caa_records else "Not present", caa_records)
     except Exception as e:
-        result["use_cases"]["CAA"] = {
-            "Goal": "Certificate authority authorization",
-            "Purpose": "Specifies allowed CAs for SSL certificates",
-            "Expected": "List of authorized certificate authorities",
-            "Notes": "Security measure for SSL certificate issuance",
-            "Status": "Not present",
-            "records": [],
-            "Error": str(e)
-        }
+        result["use_cases"]["CAA"] = use_case("CAA")
+        result["use_cases"]["CAA"]["Error"] = str(e)
         result["success"] = False
     
     return result
 
 
-def analyze_txt_record(domain, timeout=10) -> dict:
+def analyze_caa_record(domain, timeout=10) -> dict:
+    """Analyze only CAA records"""
+    return run_sync(analyze_caa_record_async(domain, timeout))
+
+
+async def analyze_txt_record_async(domain, timeout=10, session=None) -> dict:
     """Analyze only TXT records"""
     result = {
         "domain": domain,
@@ -293,38 +275,26 @@ def analyze_txt_record(domain, timeout=10) -> dict:
         "success": True
     }
     
-    resolver = dns.resolver.Resolver()
-    resolver.timeout = timeout
-    resolver.lifetime = timeout
+    session = session or DNSQuerySession(timeout)
     
     try:
-        txt_answers = resolver.resolve(domain, 'TXT')
-        txt_records = [str(answer).strip('"') for answer in txt_answers]
-        result["use_cases"]["TXT"] = {
-            "Goal": "Text information",
-            "Purpose": "Stores text-based information",
-            "Expected": "Various text records for verification and configuration",
-            "Notes": "Used for SPF, DMARC, verification codes, etc.",
-            "Status": "Valid" if txt_records else "Not present",
-            "records": txt_records
-        }
+        txt_records = await session.txt_records(domain)
+        result["use_cases"]["TXT"] = use_case("TXT", "Valid" if txt_records else "Not present", txt_records)
         result["hosting_provider"] = detect_hosting_provider([], [], txt_records)
     except Exception as e:
-        result["use_cases"]["TXT"] = {
-            "Goal": "Text information",
-            "Purpose": "Stores text-based information",
-            "Expected": "Various text records for verification and configuration",
-            "Notes": "Used for SPF, DMARC, verification codes, etc.",
-            "Status": "Not present",
-            "records": [],
-            "Error": str(e)
-        }
+        result["use_cases"]["TXT"] = use_case("TXT")
+        result["use_cases"]["TXT"]["Error"] = str(e)
         result["success"] = False
     
     return result
 
 
-def analyze_spf_record(domain, timeout=10) -> dict:
+def analyze_txt_record(domain, timeout=10) -> dict:
+    """Analyze only TXT records"""
+    return run_sync(analyze_txt_record_async(domain, timeout))
+
+
+async def analyze_spf_record_async(domain, timeout=10, session=None) -> dict:
     """Analyze only SPF records"""
     result = {
         "domain": domain,
@@ -337,13 +307,10 @@ def analyze_spf_record(domain, timeout=10) -> dict:
         "success": True
     }
     
-    resolver = dns.resolver.Resolver()
-    resolver.timeout = timeout
-    resolver.lifetime = timeout
+    session = session or DNSQuerySession(timeout)
     
     try:
-        txt_answers = resolver.resolve(domain, 'TXT')
-        txt_records = [str(answer).strip('"') for answer in txt_answers]
+        txt_records = await session.txt_records(domain)
         
         # Extract SPF record
         spf_record = None
@@ -352,31 +319,25 @@ def analyze_spf_record(domain, timeout=10) -> dict:
                 spf_record = txt
                 break
         
-        result["use_cases"]["SPF"] = {
-            "Goal": "Email authentication",
-            "Purpose": "Prevents email spoofing",
-            "Expected": "v=spf1 directive with authorized servers",
-            "Notes": "Essential for email deliverability",
-            "Status": "Valid" if spf_record else "Not present",
-            "records": [spf_record] if spf_record else []
-        }
+        result["use_cases"]["SPF"] = use_case("SPF", "Valid" if spf_record else "Not present", [spf_record] if spf_record else [])
         result["spf_record_published"] = bool(spf_record)
+        if spf_record and spf_evaluation_enabled():
+            # Include tree, lookup counts against the RFC 7208 limits and the flattened ranges
+            result["use_cases"]["SPF"]["evaluation"] = await evaluate_spf(session, domain)
     except Exception as e:
-        result["use_cases"]["SPF"] = {
-            "Goal": "Email authentication",
-            "Purpose": "Prevents email spoofing",
-            "Expected": "v=spf1 directive with authorized servers",
-            "Notes": "Essential for email deliverability",
-            "Status": "Not present",
-            "records": [],
-            "Error": str(e)
-        }
+        result["use_cases"]["SPF"] = use_case("SPF")
+        result["use_cases"]["SPF"]["Error"] = str(e)
         result["success"] = False
     
     return result
 
 
-def analyze_dmarc_record(domain, timeout=10) -> dict:
+def analyze_spf_record(domain, timeout=10) -> dict:
+    """Analyze only SPF records"""
+    return run_sync(analyze_spf_record_async(domain, timeout))
+
+
+async def analyze_dmarc_record_async(domain, timeout=10, session=None) -> dict:
     """Analyze only DMARC records"""
     result = {
         "domain": domain,
@@ -389,46 +350,97 @@ def analyze_dmarc_record(domain, timeout=10) -> dict:
         "success": True
     }
     
-    resolver = dns.resolver.Resolver()
-    resolver.timeout = timeout
-    resolver.lifetime = timeout
+    session = session or DNSQuerySession(timeout)
     
     try:
         dmarc_domain = f"_dmarc.{domain}"
-        dmarc_answers = resolver.resolve(dmarc_domain, 'TXT')
         dmarc_record = None
         
-        for answer in dmarc_answers:
-            txt = str(answer).strip('"')
+        for txt in await session.txt_records(dmarc_domain):
             if txt.startswith('v=DMARC1'):
                 dmarc_record = txt
                 break
         
-        result["use_cases"]["DMARC"] = {
-            "Goal": "Email authentication policy",
-            "Purpose": "Defines email authentication policy",
-            "Expected": "v=DMARC1 directive with policy settings",
-            "Notes": "Advanced email security and reporting",
-            "Status": "Valid" if dmarc_record else "Not present",
-            "records": [dmarc_record] if dmarc_record else []
-        }
+        result["use_cases"]["DMARC"] = use_case("DMARC", "Valid" if dmarc_record else "Not present", [dmarc_record] if dmarc_record else [])
         result["dmarc_record_published"] = bool(dmarc_record)
     except Exception as e:
-        result["use_cases"]["DMARC"] = {
-            "Goal": "Email authentication policy",
-            "Purpose": "Defines email authentication policy",
-            "Expected": "v=DMARC1 directive with policy settings",
-            "Notes": "Advanced email security and reporting",
-            "Status": "Not present",
-            "records": [],
-            "Error": str(e)
-        }
+        result["use_cases"]["DMARC"] = use_case("DMARC")
+        result["use_cases"]["DMARC"]["Error"] = str(e)
         result["success"] = False
     
     return result
 
 
-def analyze_dkim_record(domain, timeout=10) -> dict:
+def analyze_dmarc_record(domain, timeout=10) -> dict:
+    """Analyze only DMARC records"""
+    return run_sync(analyze_dmarc_record_async(domain, timeout))
+
+
+# Common DKIM selectors probed by default, extend with --dkim-selectors
+DEFAULT_DKIM_SELECTORS = ['default', 'google', 'selector1', 'selector2', 'k1', 'mail']
+dkim_selectors = list(DEFAULT_DKIM_SELECTORS)
+dkim_find_all = False
+# Maximum selector probes in flight per domain
+DKIM_PROBE_WORKERS = 32
+
+
+def load_dkim_selectors(path) -> list:
+    """Read DKIM selectors from a file, one per line, # starts a comment"""
+    selectors = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            selector = line.split('#', 1)[0].strip()
+            if selector and selector not in selectors:
+                selectors.append(selector)
+    return selectors
+
+
+def configure_dkim_selectors(selectors=None, find_all=False):
+    """Set the selectors probed by analyze_dkim_record and whether every valid selector is reported"""
+    global dkim_selectors, dkim_find_all
+    dkim_selectors = list(selectors or DEFAULT_DKIM_SELECTORS)
+    dkim_find_all = find_all
+
+
+async def probe_dkim_selector(domain, selector, session) -> bool:
+    """True if selector._domainkey.domain publishes a v=DKIM1 record"""
+    try:
+        dkim_domain = f"{selector}._domainkey.{domain}"
+        return any(txt.startswith('v=DKIM1') for txt in await session.txt_records(dkim_domain))
+    except Exception:
+        return False
+
+
+async def find_dkim_selectors(domain, session, selectors, find_all=False) -> list:
+    """
+    Probe selectors concurrently. Returns the first selector that answers with v=DKIM1,
+    or with find_all every valid selector in selector order.
+    """
+    if not selectors:
+        return []
+    limit = asyncio.Semaphore(DKIM_PROBE_WORKERS)
+
+    async def probe(selector):
+        async with limit:
+            return selector if await probe_dkim_selector(domain, selector, session) else None
+
+    found = []
+    tasks = [asyncio.ensure_future(probe(selector)) for selector in selectors]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            selector = await next_done
+            if selector:
+                found.append(selector)
+                if not find_all:
+                    break
+    finally:
+        # Remaining probes are dropped once a hit is found
+        for task in tasks:
+            task.cancel()
+    return sorted(found, key=selectors.index)
+
+
+async def analyze_dkim_record_async(domain, timeout=10, session=None, selectors=None, find_all=None) -> dict:
     """Analyze only DKIM records"""
     result = {
         "domain": domain,
@@ -441,43 +453,188 @@ def analyze_dkim_record(domain, timeout=10) -> dict:
         "success": True
     }
     
-    resolver = dns.resolver.Resolver()
-    resolver.timeout = timeout
-    resolver.lifetime = timeout
+    session = session or DNSQuerySession(timeout)
     
-    # Try common DKIM selectors
-    dkim_selectors = ['default', 'google', 'selector1', 'selector2', 'k1', 'mail']
-    dkim_record = None
+    # Probe the configured DKIM selectors in parallel
+    found = await find_dkim_selectors(domain, session, selectors or dkim_selectors,
+                                      dkim_find_all if find_all is None else find_all)
+    dkim_records = [f"Valid (selector: {selector})" for selector in found]
     
-    for selector in dkim_selectors:
-        try:
-            dkim_domain = f"{selector}._domainkey.{domain}"
-            dkim_answers = resolver.resolve(dkim_domain, 'TXT')
-            for answer in dkim_answers:
-                txt = str(answer).strip('"')
-                if txt.startswith('v=DKIM1'):
-                    dkim_record = f"Valid (selector: {selector})"
-                    break
-            if dkim_record:
-                break
-        except Exception:
-            continue
+    result["use_cases"]["DKIM"] = use_case("DKIM", "Valid" if dkim_records else "Not present", dkim_records)
     
-    result["use_cases"]["DKIM"] = {
-        "Goal": "Email authentication",
-        "Purpose": "Digital signature for email verification",
-        "Expected": "v=DKIM1 directive with public key",
-        "Notes": "Advanced email authentication method",
-        "Status": "Valid" if dkim_record else "Not present",
-        "records": [dkim_record] if dkim_record else []
+    return result
+
+
+def analyze_dkim_record(domain, timeout=10, selectors=None, find_all=None) -> dict:
+    """Analyze only DKIM records"""
+    return run_sync(analyze_dkim_record_async(domain, timeout, selectors=selectors, find_all=find_all))
+
+
+# Record type -> async analyzer, in the order use_cases are merged
+ANALYZERS = {
+    "A": analyze_a_record_async,
+    "AAAA": analyze_aaaa_record_async,
+    "CNAME": analyze_cname_record_async,
+    "MX": analyze_mx_record_async,
+    "NS": analyze_ns_record_async,
+    "SOA": analyze_soa_record_async,
+    "CAA": analyze_caa_record_async,
+    "TXT": analyze_txt_record_async,
+    "SPF": analyze_spf_record_async,
+    "DMARC": analyze_dmarc_record_async,
+    "DKIM": analyze_dkim_record_async,
+}
+
+
+def timed_out_result(domain, record_type, deadline) -> dict:
+    """Result for an analyzer that did not finish before the overall deadline"""
+    case = use_case(record_type)
+    case["Error"] = f"Analysis did not complete within the {deadline}s deadline"
+    return {
+        "domain": domain,
+        "dns_provider": None,
+        "hosting_provider": None,
+        "use_cases": {record_type: case},
+        "dns_record_published": False,
+        "dmarc_record_published": False,
+        "spf_record_published": False,
+        "success": False
     }
-    
+
+
+async def traced_analyzer(record_type, coroutine) -> dict:
+    """Await one analyzer inside an 'analyzer' span that its DNS queries nest under"""
+    span = start_span('analyzer', record_type, record_type=record_type)
+    if span is None:
+        return await coroutine
+    with active_span(span):
+        try:
+            result = await coroutine
+        except asyncio.CancelledError:
+            finish_span(span, outcome='CANCELLED')
+            raise
+        except Exception as e:
+            finish_span(span, error=e)
+            raise
+    use_case_result = result["use_cases"].get(record_type, {})
+    status = use_case_result.get("Status", "Not present")
+    finish_span(span, outcome=status.upper().replace(' ', '_'), error=use_case_result.get("Error"))
     return result
 
 
-def comprehensive_dns_analysis(domain, timeout=10) -> dict:
+async def run_analyzers_async(domain, timeout=10, deadline=None, concurrent=True, session=None,
+                              record_types=None, ttls=None, on_result=None) -> dict:
+    """
+    Run the analyzers for record_types (all of ANALYZERS by default) and return {record_type: result}.
+    In concurrent mode all lookups are fanned out at once and the whole run is
+    bounded by a single deadline; analyzers still pending then get a timeout result.
+    All analyzers share one DNSQuerySession so each (qname, rdtype) is queried once.
+    When ttls is a dict it receives, per completed analyzer, how long its answers stay valid.
+    on_result(record_type, result) is called as each analyzer finishes, in completion order.
+    """
+    if deadline is None:
+        deadline = timeout
+    analyzers = {record_type: ANALYZERS[record_type] for record_type in (record_types or ANALYZERS)}
+    if not concurrent:
+        session = session or DNSQuerySession(timeout)
+        results = {}
+        for record_type, analyzer in analyzers.items():
+            view = session.view()
+            results[record_type] = await traced_analyzer(record_type, analyzer(domain, timeout, view))
+            if ttls is not None:
+                ttls[record_type] = view.ttl
+            if on_result is not None:
+                on_result(record_type, results[record_type])
+        return results
+
+    # No analyzer may outlive the overall deadline
+    query_timeout = min(timeout, deadline)
+    session = session or DNSQuerySession(query_timeout)
+    views = {record_type: session.view() for record_type in analyzers}
+    tasks = {
+        record_type: asyncio.ensure_future(
+            traced_analyzer(record_type, analyzer(domain, query_timeout, views[record_type]))
+        )
+        for record_type, analyzer in analyzers.items()
+    }
+
+    def task_result(record_type, task):
+        if not task.done():
+            task.cancel()
+            return timed_out_result(domain, record_type, deadline)
+        if task.exception() is not None:
+            result = timed_out_result(domain, record_type, deadline)
+            result["use_cases"][record_type]["Error"] = str(task.exception())
+            return result
+        if ttls is not None:
+            ttls[record_type] = views[record_type].ttl
+        return task.result()
+
+    if on_result is None:
+        await asyncio.wait(tasks.values(), timeout=deadline)
+        return {record_type: task_result(record_type, task) for record_type, task in tasks.items()}
+
+    # Hand each result over the moment its analyzer finishes
+    loop = asyncio.get_running_loop()
+    expires = loop.time() + deadline
+    record_type_of = {task: record_type for record_type, task in tasks.items()}
+    results = {}
+    pending = set(tasks.values())
+    while pending:
+        remaining = expires - loop.time()
+        if remaining <= 0:
+            break
+        done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            record_type = record_type_of[task]
+            results[record_type] = task_result(record_type, task)
+            on_result(record_type, results[record_type])
+    for task in pending:
+        record_type = record_type_of[task]
+        results[record_type] = task_result(record_type, task)
+        on_result(record_type, results[record_type])
+    return {record_type: results[record_type] for record_type in tasks}
+
+
+async def run_stored_analyzers_async(domain, timeout=10, deadline=None, concurrent=True, session=None,
+                                     record_types=None, store=None, refresh=False, on_result=None):
+    """
+    run_analyzers_async backed by the result store: record types whose stored result is still
+    within its TTL are reused, only the rest are queried and then saved.
+    Stored results are passed to on_result first, before any query is sent.
+    Returns ({record_type: result}, [record types served from the store]).
+    """
+    record_types = list(record_types or ANALYZERS)
+    store = result_store() if store is None else (store or None)
+    stored = store.load(domain, record_types) if store is not None and not refresh else {}
+    if on_result is not None:
+        for record_type, result in stored.items():
+            on_result(record_type, result)
+    missing = [record_type for record_type in record_types if record_type not in stored]
+    results = {}
+    if missing:
+        loop = asyncio.get_running_loop()
+        expires = loop.time() + (timeout if deadline is None else deadline)
+        ttls = {}
+        results = await run_analyzers_async(domain, timeout, deadline, concurrent, session, missing, ttls, on_result)
+        # Validation shares the analysis deadline, whatever the analyzers left of it
+        remaining = expires - loop.time()
+        if session is not None and dnssec_validator() is not None and remaining > 0:
+            await dnssec_validator().annotate(session, domain, results, remaining)
+        if store is not None:
+            store.save(domain, {record_type: (results[record_type], ttl) for record_type, ttl in ttls.items()})
+    results.update(stored)
+    return results, [record_type for record_type in record_types if record_type in stored]
+
+
+async def comprehensive_dns_analysis_async(domain, timeout=10, deadline=None, concurrent=True,
+                                           store=None, refresh=False, on_result=None) -> dict:
     """
-    Perform comprehensive DNS analysis with provider detection by calling individual analyze_*_record functions
+    Perform comprehensive DNS analysis with provider detection by calling individual analyze_*_record functions.
+    Lookups run concurrently and the whole analysis is bounded by deadline (defaults to timeout);
+    pass concurrent=False to run the analyzers one after another.
+    Record types still fresh in the result store are not queried again, refresh=True re-queries everything.
+    on_result(record_type, result) sees each analyzer's result before the merged one is returned.
     """
     result = {
         "domain": domain,
@@ -490,17 +647,23 @@ def comprehensive_dns_analysis(domain, timeout=10) -> dict:
         "success": True
     }
     # Call each analyze_*_record function and merge their results
-    a = analyze_a_record(domain, timeout)
-    aaaa = analyze_aaaa_record(domain, timeout)
-    cname = analyze_cname_record(domain, timeout)
-    mx = analyze_mx_record(domain, timeout)
-    ns = analyze_ns_record(domain, timeout)
-    soa = analyze_soa_record(domain, timeout)
-    caa = analyze_caa_record(domain, timeout)
-    txt = analyze_txt_record(domain, timeout)
-    spf = analyze_spf_record(domain, timeout)
-    dmarc = analyze_dmarc_record(domain, timeout)
-    dkim = analyze_dkim_record(domain, timeout)
+    if deadline is None:
+        deadline = timeout
+    session = DNSQuerySession(timeout if not concurrent else min(timeout, deadline))
+    results, served_from_store = await run_stored_analyzers_async(
+        domain, timeout, deadline, concurrent, session, store=store, refresh=refresh, on_result=on_result
+    )
+    a = results["A"]
+    aaaa = results["AAAA"]
+    cname = results["CNAME"]
+    mx = results["MX"]
+    ns = results["NS"]
+    soa = results["SOA"]
+    caa = results["CAA"]
+    txt = results["TXT"]
+    spf = results["SPF"]
+    dmarc = results["DMARC"]
+    dkim = results["DKIM"]
 
     # Merge use_cases
     result["use_cases"].update(a["use_cases"])
@@ -516,7 +679,7 @@ def comprehensive_dns_analysis(domain, timeout=10) -> dict:
     result["use_cases"].update(dkim["use_cases"])
 
     # Merge provider and published fields (prefer first valid)
-    for r in [ns, a, cname, txt]:
+    for r in [ns, a, aaaa, cname, txt]:
         if not result["dns_provider"] and r.get("dns_provider"):
             result["dns_provider"] = r["dns_provider"]
         if not result["hosting_provider"] and r.get("hosting_provider"):
@@ -538,6 +701,8 @@ def comprehensive_dns_analysis(domain, timeout=10) -> dict:
         
         if "A" in result["use_cases"] and result["use_cases"]["A"].get("records"):
             all_a_records = result["use_cases"]["A"]["records"]
+        if "AAAA" in result["use_cases"] and result["use_cases"]["AAAA"].get("records"):
+            all_a_records = all_a_records + result["use_cases"]["AAAA"]["records"]
         if "CNAME" in result["use_cases"] and result["use_cases"]["CNAME"].get("records"):
             all_cname_records = result["use_cases"]["CNAME"]["records"]
         if "TXT" in result["use_cases"] and result["use_cases"]["TXT"].get("records"):
@@ -564,211 +729,484 @@ def comprehensive_dns_analysis(domain, timeout=10) -> dict:
     for r in [a, aaaa, cname, mx, ns, soa, caa, txt, spf, dmarc, dkim]:
         if not r.get("success", True):
             result["success"] = False
+    # Upstream queries sent vs. duplicates answered from the shared session
+    result["query_stats"] = session.stats()
+    # Use cases reused from the result store instead of being queried again
+    result["served_from_store"] = served_from_store
     return result
 
 
+def comprehensive_dns_analysis(domain, timeout=10, deadline=None, concurrent=True, store=None, refresh=False) -> dict:
+    """Perform comprehensive DNS analysis, see comprehensive_dns_analysis_async"""
+    return run_sync(comprehensive_dns_analysis_async(domain, timeout, deadline, concurrent, store, refresh))
+
+
+async def stream_dns_analysis_async(domain, timeout=10, deadline=None, concurrent=True, store=None, refresh=False,
+                                    trace=False):
+    """
+    comprehensive_dns_analysis_async as a stream of events: a {"event": "use_case"} per record type
+    as soon as its analyzer finishes (stored results first), then one {"event": "summary"} with the
+    providers, published flags and everything else of the merged result except its use_cases.
+    """
+    events = asyncio.Queue()
+    started = time.perf_counter()
+
+    def on_result(record_type, result):
+        events.put_nowait({
+            "event": "use_case",
+            "domain": domain,
+            "record_type": record_type,
+            "use_case": result.get("use_cases", {}).get(record_type),
+            "success": result.get("success", True),
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)
+        })
+
+    with tracing(domain, trace) as collected:
+        analysis = asyncio.ensure_future(comprehensive_dns_analysis_async(
+            domain, timeout, deadline, concurrent, store, refresh, on_result=on_result
+        ))
+    analysis.add_done_callback(lambda _analysis: events.put_nowait(None))
+    try:
+        while True:
+            event = await events.get()
+            if event is None:
+                break
+            yield event
+        result = analysis.result()
+    finally:
+        # The consumer went away mid-stream
+        analysis.cancel()
+    summary = {"event": "summary"}
+    summary.update((key, value) for key, value in result.items() if key != "use_cases")
+    summary["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    if collected is not None:
+        summary["trace"] = collected.to_dict()
+    yield summary
+
+
 def detect_dns_provider(ns_records):
     """Detect DNS provider based on NS records"""
     if not ns_records:
         return "Unknown"
     
-    ns_lower = [ns.lower() for ns in ns_records]
+    provider = provider_index().dns_provider(ns_records)
+    if provider:
+        return provider
     
-    if any('cloudflare' in ns for ns in ns_lower):
-        return "Cloudflare"
-    elif any('awsdns' in ns for ns in ns_lower) or any('route53' in ns for ns in ns_lower):
-        return "Amazon Route 53"
-    elif any('google' in ns for ns in ns_lower):
-        return "Google Cloud DNS"
-    elif any('azure' in ns for ns in ns_lower):
-        return "Microsoft Azure DNS"
-    elif any('godaddy' in ns for ns in ns_lower):
-        return "GoDaddy"
-    elif any('namecheap' in ns for ns in ns_lower):
-        return "Namecheap"
-    elif any('tucows' in ns for ns in ns_lower):
-        return "Tucows Inc."
-    elif any('dnsimple' in ns for ns in ns_lower):
-        return "DNSimple"
-    elif any('dyn' in ns for ns in ns_lower):
-        return "Dyn"
-    elif any('ns1.com' in ns for ns in ns_lower):
-        return "NS1"
-    elif any('systemdns' in ns for ns in ns_lower):
-        return "SystemDNS"
-    elif any('name.com' in ns for ns in ns_lower):
-        return "Name.com"
-    elif any('hover' in ns for ns in ns_lower):
-        return "Hover"
-    elif any('porkbun' in ns for ns in ns_lower):
-        return "Porkbun"
-    elif any('namesilo' in ns for ns in ns_lower):
-        return "NameSilo"
-    elif any('ionos' in ns for ns in ns_lower):
-        return "IONOS"
-    elif any('hostinger' in ns for ns in ns_lower):
-        return "Hostinger"
-    elif any('bluehost' in ns for ns in ns_lower):
-        return "Bluehost"
-    elif any('hostgator' in ns for ns in ns_lower):
-        return "HostGator"
-    elif any('dreamhost' in ns for ns in ns_lower):
-        return "DreamHost"
-    elif any('inmotion' in ns for ns in ns_lower):
-        return "InMotion Hosting"
-    elif any('a2hosting' in ns for ns in ns_lower):
-        return "A2 Hosting"
-    elif any('siteground' in ns for ns in ns_lower):
-        return "SiteGround"
-    elif any('wpengine' in ns for ns in ns_lower):
-        return "WP Engine"
-    elif any('kinsta' in ns for ns in ns_lower):
-        return "Kinsta"
-    elif any('digitalocean' in ns for ns in ns_lower):
-        return "DigitalOcean"
-    elif any('linode' in ns for ns in ns_lower):
-        return "Linode"
-    elif any('vultr' in ns for ns in ns_lower):
-        return "Vultr"
-    elif any('ovh' in ns for ns in ns_lower):
-        return "OVH"
-    elif any('hetzner' in ns for ns in ns_lower):
-        return "Hetzner"
-    else:
-        # Try to extract provider name from NS records
-        for ns in ns_lower:
-            if '.' in ns:
-                parts = ns.split('.')
-                if len(parts) >= 2:
-                    provider = parts[-2]  # Get the second-to-last part
-                    if provider not in ['ns', 'dns', 'name']:
-                        return provider.replace('-', ' ').title()
-        return "Unknown"
+    # Try to extract provider name from NS records
+    for ns in (ns.lower() for ns in ns_records):
+        if '.' in ns:
+            parts = ns.split('.')
+            if len(parts) >= 2:
+                provider = parts[-2]  # Get the second-to-last part
+                if provider not in ['ns', 'dns', 'name']:
+                    return provider.replace('-', ' ').title()
+    return "Unknown"
 
 
 def detect_hosting_provider(a_records, cname_records, txt_records):
-    """Detect hosting provider based on A records, CNAME, and TXT records"""
+    """Detect hosting provider based on A/AAAA records, CNAME, and TXT records"""
+    index = provider_index()
+    
     # Check TXT records for hosting indicators first (most reliable)
     for txt in txt_records or []:
-        txt_lower = txt.lower()
-        if 'hosting-site=' in txt_lower:
-            # Extract hosting provider from custom TXT record
+        match = index.txt_provider(txt)
+        if not match:
+            continue
+        rank, provider = match
+        if rank < 0:
+            # Extract hosting provider from custom hosting-site= TXT record
             try:
-                provider_part = txt.split('hosting-site=')[1].split()[0]
-                provider = provider_part.replace('-', ' ').replace('_', ' ').title()
-                return provider
-            except:
-                pass
-        elif 'vercel' in txt_lower:
-            return "Vercel"
-        elif 'netlify' in txt_lower:
-            return "Netlify"
-        elif 'heroku' in txt_lower:
-            return "Heroku"
-        elif 'github' in txt_lower:
-            return "GitHub Pages"
-        elif 'firebase' in txt_lower:
-            return "Firebase"
-        elif 'cloudflare' in txt_lower:
-            return "Cloudflare"
-        elif 'zoho' in txt_lower:
-            return "Zoho"
-        elif 'google' in txt_lower:
-            return "Google"
-        elif 'microsoft' in txt_lower:
-            return "Microsoft"
+                provider_part = txt.split(HOSTING_SITE_TOKEN)[1].split()[0]
+                return provider_part.replace('-', ' ').replace('_', ' ').title()
+            except IndexError:
+                continue
+        return provider
     
     # Check CNAME records
     for cname in cname_records or []:
-        cname_lower = cname.lower()
-        if 'vercel' in cname_lower:
-            return "Vercel"
-        elif 'netlify' in cname_lower:
-            return "Netlify"
-        elif 'heroku' in cname_lower:
-            return "Heroku"
-        elif 'github' in cname_lower:
-            return "GitHub Pages"
-        elif 'firebase' in cname_lower:
-            return "Firebase"
-        elif 'cloudflare' in cname_lower:
-            return "Cloudflare"
-        elif 'zoho' in cname_lower:
-            return "Zoho"
+        provider = index.cname_provider(cname)
+        if provider:
+            return provider
     
-    # Check A records for common hosting IP ranges (lowest priority)
+    # Check A/AAAA records against hosting IP ranges (lowest priority)
     for ip in a_records or []:
-        if ip.startswith('192.168.') or ip.startswith('10.') or ip.startswith('172.'):
-            continue  # Skip private IPs
-        
-        # AWS
-        if ip.startswith('3.') or ip.startswith('52.') or ip.startswith('54.'):
-            return "AWS"
-        # Google Cloud
-        elif ip.startswith('35.') or ip.startswith('34.'):
-            return "Google Cloud"
-        # Azure
-        elif ip.startswith('13.') or ip.startswith('20.'):
-            return "Microsoft Azure"
-        # Cloudflare
-        elif ip.startswith('104.') or ip.startswith('172.64.'):
-            return "Cloudflare"
-        # Vercel
-        elif ip.startswith('76.76.') or ip.startswith('76.223.'):
-            return "Vercel"
-        # Netlify
-        elif ip.startswith('75.2.') or ip.startswith('99.83.'):
-            return "Netlify"
-        # GitHub Pages
-        elif ip.startswith('185.199.'):
-            return "GitHub Pages"
-        # Heroku
-        elif ip.startswith('52.') and any('heroku' in str(cname).lower() for cname in cname_records or []):
-            return "Heroku"
-        # Zoho
-        elif ip.startswith('199.36.') or ip.startswith('199.37.'):
-            return "Zoho"
+        provider = index.ip_provider(ip)
+        if provider and provider != PRIVATE:
+            return provider
     
     return "Unknown"
 
 
+async def analyze_domain_async(domain, test_type=None, timeout=10, deadline=None, concurrent=True,
+                               refresh=False, trace=False) -> dict:
+    """
+    Run one record type analyzer, or comprehensive analysis when test_type is empty.
+    trace=True attaches the spans of every analyzer, DNS query and upstream attempt as "trace".
+    """
+    if test_type and test_type.strip() and test_type.strip().upper() not in ANALYZERS:
+        raise ValueError(f"Unsupported test type: {test_type}")
+    with tracing(domain, trace) as collected:
+        if not test_type or test_type.strip() == '':
+            result = await comprehensive_dns_analysis_async(domain, timeout=timeout, deadline=deadline,
+                                                            concurrent=concurrent, refresh=refresh)
+        elif result_store() is None:
+            record_type = test_type.strip().upper()
+            result = await traced_analyzer(record_type, ANALYZERS[record_type](domain, timeout=timeout))
+        else:
+            record_type = test_type.strip().upper()
+            results, served_from_store = await run_stored_analyzers_async(
+                domain, timeout, deadline, concurrent=False, record_types=[record_type], refresh=refresh
+            )
+            result = results[record_type]
+            result["served_from_store"] = served_from_store
+    if collected is not None:
+        result["trace"] = collected.to_dict()
+    return result
+
+
+def analyze_domain(domain, test_type=None, timeout=10, deadline=None, concurrent=True, refresh=False,
+                   trace=False) -> dict:
+    """Run one record type analyzer, or comprehensive analysis when test_type is empty"""
+    return run_sync(analyze_domain_async(domain, test_type, timeout, deadline, concurrent, refresh, trace))
+
+
+async def stream_worker_events(request):
+    """Events of a streamed comprehensive analysis in --serve mode, compacted on request"""
+    compact = request.get("format") == "compact"
+    try:
+        async for event in stream_dns_analysis_async(
+            request["domain"],
+            timeout=request.get("timeout", 10),
+            deadline=request.get("deadline"),
+            refresh=bool(request.get("refresh")),
+            trace=bool(request.get("trace"))
+        ):
+            yield strip_event(event) if compact else event
+    finally:
+        if metrics() is not None:
+            metrics().write(force=False)
+
+
+_analysis_flights = SingleFlight()
+
+
+def configure_coalescing(enabled=True):
+    """
+    Let concurrent identical worker requests share one analysis, and concurrent sessions share
+    in-flight lookups; enabled=False runs every request and session on its own
+    """
+    global _analysis_flights
+    _analysis_flights = SingleFlight() if enabled else None
+    configure_query_coalescing(enabled)
+
+
+def coalescing_stats() -> dict:
+    flights = query_flights()
+    return {
+        "analyses": _analysis_flights.stats() if _analysis_flights else None,
+        "queries": flights.stats() if flights else None
+    }
+
+
+async def handle_worker_request(request):
+    """
+    Handle one JSON request in --serve mode; "format": "compact" leaves out the use-case metadata
+    and "trace": true attaches the query trace. "stream": true returns the events of
+    stream_dns_analysis_async instead of one merged result.
+    """
+    if request.get("op") == "metadata":
+        return metadata_table()
+    if request.get("op") == "stats":
+        cache = answer_cache()
+        store = result_store()
+        directory = authoritative_directory()
+        return {
+            "answer_cache": cache.stats() if cache else None,
+            "result_store": store.stats() if store else None,
+            "authoritative": directory.stats() if directory else None,
+            "spf_includes": include_cache().stats() if include_cache() else None,
+            "coalescing": coalescing_stats(),
+            "dnssec": dnssec_validator().trust.stats() if dnssec_validator() else None,
+            "metrics": metrics().render() if metrics() else None,
+            "upstreams": transport_stats(),
+            "retry_budget": retry_budget_stats()
+        }
+    domain = request.get("domain")
+    if not domain:
+        raise ValueError("domain is required")
+    if request.get("stream"):
+        if request.get("test_type"):
+            raise ValueError("stream is only supported for comprehensive analysis")
+        return stream_worker_events(request)
+    test_type = request.get("test_type")
+    timeout = request.get("timeout", 10)
+    deadline = request.get("deadline")
+    refresh = bool(request.get("refresh"))
+    trace = bool(request.get("trace"))
+    if _analysis_flights is None or trace:
+        # A trace describes the run it was requested for, never share it
+        result = await analyze_domain_async(domain, test_type, timeout=timeout, deadline=deadline, refresh=refresh,
+                                            trace=trace)
+    else:
+        # Duplicate clicks and many users adding the same domain share the analysis already running
+        key = (domain.lower().rstrip('.'), (test_type or '').strip().upper(), timeout, deadline, refresh)
+        result = await _analysis_flights.run(
+            key, lambda: analyze_domain_async(domain, test_type, timeout=timeout, deadline=deadline, refresh=refresh)
+        )
+    if metrics() is not None:
+        metrics().write(force=False)
+    return strip_metadata(result) if request.get("format") == "compact" else result
+
+
+def configure_from_args(args):
+    """Apply the query, cache and analyzer options of the command line to this process"""
+    configure_answer_cache(args.cache_entries, args.cache_bytes, enabled=not args.no_cache)
+    if args.store:
+        configure_result_store(args.store)
+    configure_transport(args.transport, args.tls_server_name)
+    if args.authoritative:
+        configure_authoritative(port=args.authoritative_port)
+    configure_query_strategy(adaptive_timeout=not args.fixed_timeout, hedge=not args.no_hedge)
+    configure_resilience(circuit_threshold=args.circuit_threshold, retry_budget=args.retry_budget)
+    configure_nameservers(args.nameserver, args.dns_port)
+    configure_rate_limiter(args.rate_limit)
+    configure_coalescing(not args.no_coalesce)
+    configure_spf_evaluation(not args.no_spf_eval, args.spf_cache_entries)
+    if args.dnssec:
+        configure_dnssec_validation()
+    configure_dkim_selectors(load_dkim_selectors(args.dkim_selectors) if args.dkim_selectors else None,
+                             find_all=args.dkim_all)
+    if args.metrics_file:
+        configure_metrics(args.metrics_file)
+
+
+def batch_analyzer(args):
+    """(analyze, stats) of a --batch run: the per-domain coroutine and the extra summary counters"""
+    trace = args.trace or bool(args.trace_file)
+    enricher = None
+    if args.enrich:
+        from dns_enrich import TargetResolver
+        enricher = TargetResolver(args.timeout)
+
+    async def analyze(domain):
+        result = await analyze_domain_async(domain, args.test_type, timeout=args.timeout, deadline=args.deadline,
+                                            concurrent=not args.sequential, refresh=args.refresh, trace=trace)
+        return await enricher.enrich(result) if enricher is not None else result
+
+    def stats():
+        return {
+            "upstreams": transport_stats(),
+            "retry_budget": retry_budget_stats(),
+            "authoritative": authoritative_directory().stats() if authoritative_directory() else None,
+            "spf_includes": include_cache().stats() if include_cache() else None,
+            "coalesced_lookups": query_flights().stats() if query_flights() else None,
+            "dnssec": dnssec_validator().trust.stats() if dnssec_validator() else None,
+            "infrastructure": enricher.stats() if enricher is not None else None
+        }
+
+    return analyze, stats
+
+
+def shard_setup(args):
+    """
+    Worker process side of --batch --processes: configure the process like main does and
+    return (analyze, encode, stats) for dns_shard. The rate limit is split across the workers.
+    """
+    args = argparse.Namespace(**vars(args))
+    processes = args.processes or os.cpu_count() or 1
+    if args.rate_limit:
+        args.rate_limit /= processes
+    configure_from_args(args)
+    writer = ResultWriter(args.format, report=args.size_report)
+    analyze, stats = batch_analyzer(args)
+
+    def encode(result):
+        data = writer.encode_result(result)
+        return data, full_size(result) if args.size_report else 0
+
+    return analyze, encode, stats
+
+
 def main():
     parser = argparse.ArgumentParser(description='Individual DNS record type analysis')
-    parser.add_argument('domain', help='Domain to test')
-    parser.add_argument('--test-type', choices=['A', 'AAAA', 'CNAME', 'MX', 'NS', 'SOA', 'CAA', 'TXT', 'SPF', 'DMARC', 'DKIM'], 
+    parser.add_argument('domain', nargs='?', help='Domain to test')
+    parser.add_argument('--test-type', choices=list(ANALYZERS), 
                        nargs='?', default=None, help='Type of DNS record to analyze (if not specified, runs comprehensive analysis)')
     parser.add_argument('--timeout', type=int, default=10, help='Timeout for operations in seconds')
+    parser.add_argument('--deadline', type=float, default=None,
+                       help='Overall deadline for comprehensive analysis in seconds (defaults to --timeout)')
+    parser.add_argument('--sequential', action='store_true',
+                       help='Run comprehensive analysis lookups one after another instead of concurrently')
+    parser.add_argument('--serve', action='store_true',
+                       help='Run as a long-lived worker: JSON-lines requests on stdin, JSON-lines results on stdout')
+    parser.add_argument('--socket', default=None,
+                       help='With --serve, listen on this Unix socket path instead of stdin/stdout')
+    parser.add_argument('--workers', type=int, default=256, help='Requests handled concurrently in --serve mode')
+    parser.add_argument('--dkim-selectors', default=None, metavar='FILE',
+                       help='File of DKIM selectors to probe, one per line (defaults to a small built-in list)')
+    parser.add_argument('--dkim-all', action='store_true',
+                       help='Report every valid DKIM selector instead of stopping at the first')
+    parser.add_argument('--batch', default=None, metavar='FILE',
+                       help="Analyze every domain listed in FILE ('-' for stdin), streaming one JSON result per line")
+    parser.add_argument('--concurrency', type=int, default=256, help='Domains analyzed concurrently in --batch mode')
+    parser.add_argument('--processes', type=int, default=1,
+                       help='Shard --batch across this many worker processes, each with its own event loop and a share '
+                            'of --concurrency (0 for one per CPU)')
+    parser.add_argument('--ordered', action='store_true',
+                       help='With --processes, write results in input order instead of as they finish')
+    parser.add_argument('--enrich', action='store_true',
+                       help='In --batch mode, resolve every unique MX/NS/CNAME target once and attach its addresses '
+                            'to each use_case as "targets"')
+    parser.add_argument('--nameserver', action='append', default=None, metavar='IP',
+                       help='Query this nameserver instead of the system resolvers (repeatable)')
+    parser.add_argument('--dns-port', type=int, default=53, help='Port of the --nameserver servers')
+    parser.add_argument('--transport', choices=PROTOCOLS, default='udp',
+                       help='udp (pooled TCP after truncation), tcp, or tls (DNS-over-TLS, port 853 by default)')
+    parser.add_argument('--tls-server-name', default=None,
+                       help='Name to authenticate the DNS-over-TLS server as (unauthenticated when omitted)')
+    parser.add_argument('--authoritative', action='store_true',
+                       help='Resolve each zone\'s NS set once and send the other queries straight to its authoritative '
+                            'servers instead of the recursive resolver (default $DNS_AUTHORITATIVE_DIRECT)')
+    parser.add_argument('--authoritative-port', type=int, default=53, help='Port the authoritative servers are queried on')
+    parser.add_argument('--fixed-timeout', action='store_true',
+                       help='Wait the full --timeout on every query attempt instead of the upstream\'s adaptive RTO')
+    parser.add_argument('--no-hedge', action='store_true',
+                       help='Never send a hedged copy of a query that is slower than the upstream\'s p95 RTT')
+    parser.add_argument('--circuit-threshold', type=int, default=CIRCUIT_THRESHOLD,
+                       help='Consecutive timeouts or errors after which a nameserver is skipped until a probe query '
+                            'succeeds again (0 disables the circuit breakers)')
+    parser.add_argument('--retry-budget', type=float, default=RETRY_BUDGET,
+                       help='Retries of failed queries allowed per first attempt across all nameservers '
+                            '(0 disables the budget)')
+    parser.add_argument('--no-spf-eval', action='store_true',
+                       help='Only report the SPF record instead of expanding its includes and counting its lookups')
+    parser.add_argument('--spf-cache-entries', type=int, default=MAX_CACHED_RECORDS,
+                       help='Evaluated SPF includes memoized across domains until their TTL expires (0 disables)')
+    parser.add_argument('--rate-limit', type=float, default=None,
+                       help='Maximum upstream queries per second per nameserver')
+    parser.add_argument('--dnssec', action='store_true',
+                       help='Validate the comprehensive analysis answers up to the root trust anchors and report '
+                            'secure/insecure/bogus per record type as use_case "dnssec" (needs cryptography)')
+    parser.add_argument('--no-coalesce', action='store_true',
+                       help='Never let concurrent analyses share an in-flight lookup (or, with --serve, a whole analysis)')
+    parser.add_argument('--cache-entries', type=int, default=10000, help='Maximum entries in the DNS answer cache')
+    parser.add_argument('--cache-bytes', type=int, default=None, help='Approximate memory budget of the DNS answer cache')
+    parser.add_argument('--no-cache', action='store_true', help='Disable the DNS answer cache')
+    parser.add_argument('--format', choices=FORMATS, default='json',
+                       help='Output encoding; compact, ndjson and msgpack leave the static use-case metadata out')
+    parser.add_argument('--metadata', action='store_true',
+                       help='Print the versioned use-case metadata table the compact formats refer to and exit')
+    parser.add_argument('--size-report', action='store_true',
+                       help='Report payload bytes per domain against the full JSON output (stderr, or the batch summary)')
+    parser.add_argument('--store', default=None, metavar='FILE',
+                       help='SQLite file keeping per-record-type results until their TTL expires (default $DNS_RESULT_STORE)')
+    parser.add_argument('--refresh', action='store_true', help='Re-query every record type even if stored results are fresh')
+    parser.add_argument('--stream', action='store_true',
+                       help='Write each record type\'s use case as an NDJSON event as soon as its lookup completes, '
+                            'followed by a summary event')
+    parser.add_argument('--trace', action='store_true',
+                       help='Attach a span per analyzer, DNS query and upstream attempt to each result as "trace"')
+    parser.add_argument('--trace-file', default=None, metavar='FILE',
+                       help='Write the traces as Chrome trace-event JSON (chrome://tracing, Perfetto)')
+    parser.add_argument('--metrics-file', default=None, metavar='FILE',
+                       help='Prometheus textfile of query latency histograms, written on exit and periodically '
+                            'with --serve (default $DNS_METRICS_FILE)')
     
     args = parser.parse_args()
-    
-    # If test_type is None, empty, or not provided, run comprehensive analysis
-    if not args.test_type or args.test_type.strip() == '':
-        result = comprehensive_dns_analysis(args.domain, timeout=args.timeout)
-    elif args.test_type == 'A':
-        result = analyze_a_record(args.domain, timeout=args.timeout)
-    elif args.test_type == 'AAAA':
-        result = analyze_aaaa_record(args.domain, timeout=args.timeout)
-    elif args.test_type == 'CNAME':
-        result = analyze_cname_record(args.domain, timeout=args.timeout)
-    elif args.test_type == 'MX':
-        result = analyze_mx_record(args.domain, timeout=args.timeout)
-    elif args.test_type == 'NS':
-        result = analyze_ns_record(args.domain, timeout=args.timeout)
-    elif args.test_type == 'SOA':
-        result = analyze_soa_record(args.domain, timeout=args.timeout)
-    elif args.test_type == 'CAA':
-        result = analyze_caa_record(args.domain, timeout=args.timeout)
-    elif args.test_type == 'TXT':
-        result = analyze_txt_record(args.domain, timeout=args.timeout)
-    elif args.test_type == 'SPF':
-        result = analyze_spf_record(args.domain, timeout=args.timeout)
-    elif args.test_type == 'DMARC':
-        result = analyze_dmarc_record(args.domain, timeout=args.timeout)
-    elif args.test_type == 'DKIM':
-        result = analyze_dkim_record(args.domain, timeout=args.timeout)
-    
-    print(json.dumps(result, indent=2))
+    if args.metadata:
+        print(json.dumps(metadata_table(), indent=2))
+        return
+    try:
+        writer = ResultWriter(args.format, pretty=args.format == 'json' and not args.batch, report=args.size_report)
+    except RuntimeError as e:
+        parser.error(str(e))
+    if args.authoritative and args.transport == 'tls':
+        parser.error('--authoritative cannot be combined with --transport tls, authoritative servers do not speak DoT')
+    if args.processes != 1 and not args.batch:
+        parser.error('--processes applies to --batch')
+    if args.processes != 1 and (args.trace_file or args.metrics_file):
+        parser.error('--trace-file and --metrics-file are written by a single process, drop --processes')
+    try:
+        configure_from_args(args)
+    except RuntimeError as e:
+        parser.error(str(e))
+
+    if args.serve:
+        import dns_worker
+        try:
+            if args.socket:
+                dns_worker.serve_unix_socket(handle_worker_request, args.socket, workers=args.workers)
+            else:
+                dns_worker.serve_stdio(handle_worker_request, workers=args.workers)
+        finally:
+            if metrics() is not None:
+                metrics().write()
+        return
+    if not args.batch and not args.domain:
+        parser.error('domain is required unless --serve or --batch is given')
+    if args.stream and (args.batch or args.test_type):
+        parser.error('--stream applies to the comprehensive analysis of a single domain')
+
+    trace = args.trace or bool(args.trace_file)
+    trace_writer = ChromeTraceWriter(args.trace_file) if args.trace_file else None
+
+    def write(result):
+        if trace_writer is not None and "trace" in result:
+            trace_writer.write(result["trace"] if args.trace else result.pop("trace"))
+        writer.write(result)
+
+    async def write_events(events):
+        async for event in events:
+            if trace_writer is not None and "trace" in event:
+                trace_writer.write(event["trace"] if args.trace else event.pop("trace"))
+            writer.write_event(event)
+
+    try:
+        if args.batch:
+            import dns_bulk
+            processes = args.processes or os.cpu_count() or 1
+            if processes > 1:
+                from dns_shard import run_sharded_batch
+                source = sys.stdin if args.batch == '-' else open(args.batch, encoding='utf-8')
+                try:
+                    summary = run_sharded_batch(
+                        dns_bulk.read_domains(source), shard_setup, args, processes, args.concurrency,
+                        write=writer.write_encoded, encode=lambda result: (writer.encode_result(result), 0),
+                        ordered=args.ordered
+                    )
+                finally:
+                    if source is not sys.stdin:
+                        source.close()
+                writer.write_summary(summary)
+            else:
+                analyze, stats = batch_analyzer(args)
+                dns_bulk.run_batch_file(
+                    args.batch,
+                    analyze,
+                    concurrency=args.concurrency,
+                    stats=stats,
+                    write=write,
+                    write_summary=writer.write_summary
+                )
+        elif args.stream:
+            run_sync(write_events(
+                stream_dns_analysis_async(args.domain, timeout=args.timeout, deadline=args.deadline,
+                                          concurrent=not args.sequential, refresh=args.refresh, trace=trace)
+            ))
+        else:
+            # If test_type is None, empty, or not provided, run comprehensive analysis
+            result = analyze_domain(args.domain, args.test_type, timeout=args.timeout, deadline=args.deadline,
+                                    concurrent=not args.sequential, refresh=args.refresh, trace=trace)
+            write(result)
+            if writer.report is not None:
+                print(json.dumps({"payload": writer.report.summary()}), file=sys.stderr)
+    finally:
+        if trace_writer is not None:
+            trace_writer.close()
+        if metrics() is not None:
+            metrics().write()
 
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main() 
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Scheduled monitoring of watched domains with change detection
+Every watched (domain, record type) pair sits in a priority queue ordered by when it is
+next due. A record type is re-checked only once the answers it was built from have
+expired: its interval is the smallest TTL among them, capped by the zone's SOA refresh
+(and --max-interval) and stretched by a little jitter so domains watched together drift
+apart instead of coming due in bursts. Due checks of the same domain run together on
+one query session, with bounded concurrency across domains.
+
+Only differences are reported, one JSON line each:
+  {"event": "change", "domain": "example.com", "record_type": "MX",
+   "added": [...], "removed": [...], "status": {"from": "Valid", "to": "Not present"},
+   "published": {"from": true, "to": false}, "checked_at": ..., "next_check_in": ...}
+"status" and "published" (SPF and DMARC only) are present when they flipped. The first
+check of a pair only records its baseline. Checks that fail without a definitive answer
+(timeouts, SERVFAIL) are retried with backoff and never reported as removals.
+"""
+import argparse
+import asyncio
+import heapq
+import itertools
+import json
+import random
+import sys
+import time
+
+from dns_authoritative import configure_authoritative
+from dns_bulk import read_domains
+from dns_cache import MAX_POSITIVE_TTL
+from dns_individual import ANALYZERS, run_analyzers_async
+from dns_query import configure_nameservers, configure_rate_limiter
+from dns_store import configure_result_store, result_store
+
+MIN_INTERVAL = 60
+MAX_INTERVAL = MAX_POSITIVE_TTL
+# First retry of a failed check, doubled per consecutive failure up to the record's cap
+RETRY_INTERVAL = 30
+# Checks are pushed back by up to this fraction of their interval, never brought forward
+JITTER = 0.1
+PUBLISHED_FLAGS = {"SPF": "spf_record_published", "DMARC": "dmarc_record_published"}
+
+
+def record_key(record):
+    """Hashable, order-independent form of one use_case record (strings, or dicts for SOA)"""
+    return record if isinstance(record, str) else json.dumps(record, sort_keys=True)
+
+
+def diff_check(record_type, previous, current) -> dict:
+    """
+    Differences between two checks of one record type, each {"case": use_case, "published": bool};
+    empty when nothing changed
+    """
+    before = {record_key(record): record for record in previous["case"].get("records") or []}
+    after = {record_key(record): record for record in current["case"].get("records") or []}
+    change = {}
+    added = [record for key, record in after.items() if key not in before]
+    removed = [record for key, record in before.items() if key not in after]
+    if added:
+        change["added"] = added
+    if removed:
+        change["removed"] = removed
+    if previous["case"].get("Status") != current["case"].get("Status"):
+        change["status"] = {"from": previous["case"].get("Status"), "to": current["case"].get("Status")}
+    if record_type in PUBLISHED_FLAGS and previous["published"] != current["published"]:
+        change["published"] = {"from": previous["published"], "to": current["published"]}
+    return change
+
+
+class Monitor:
+    """Priority queue of watched (domain, record type) pairs, checked as they come due"""
+
+    def __init__(self, concurrency=64, timeout=10, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL,
+                 on_change=None, store=None):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.on_change = on_change or (lambda change: None)
+        self.store = store
+        self._queue = []
+        self._sequence = itertools.count()
+        # (domain, record_type) -> due time of its live queue entry; older entries are skipped
+        self._due = {}
+        self._state = {}
+        self._failures = {}
+        self._refresh = {}
+        self._in_flight = set()
+        self._wakeup = None
+        self.checks = 0
+        self.failed_checks = 0
+        self.changes = 0
+
+    def _schedule(self, domain, record_type, due):
+        self._due[(domain, record_type)] = due
+        heapq.heappush(self._queue, (due, next(self._sequence), domain, record_type))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def watch(self, domain, record_types=None, spread=0.0):
+        """Start monitoring domain; its first checks are spread at random over the next spread seconds"""
+        now = time.time()
+        for record_type in record_types or ANALYZERS:
+            if record_type not in ANALYZERS:
+                raise ValueError(f"Unsupported record type: {record_type}")
+            if (domain, record_type) not in self._due:
+                self._schedule(domain, record_type, now + random.uniform(0, spread))
+
+    def unwatch(self, domain):
+        """Stop monitoring domain and forget its baseline"""
+        for key in [key for key in self._due if key[0] == domain]:
+            del self._due[key]
+            self._state.pop(key, None)
+            self._failures.pop(key, None)
+        self._refresh.pop(domain, None)
+
+    def interval(self, domain, record_type, ttl) -> float:
+        """Seconds until record_type of domain is next due, from the TTL of its answers or its failures"""
+        refresh = self._refresh.get(domain)
+        cap = min(self.max_interval, max(self.min_interval, refresh)) if refresh else self.max_interval
+        failures = self._failures.get((domain, record_type), 0)
+        if failures:
+            interval = min(RETRY_INTERVAL * 2 ** (failures - 1), cap)
+        else:
+            interval = min(max(ttl, self.min_interval), cap)
+        return interval * (1 + random.uniform(0, JITTER))
+
+    async def check(self, domain, record_types):
+        """Check the due record types of one domain, report differences and schedule their next check"""
+        ttls = {}
+        results = await run_analyzers_async(domain, self.timeout, record_types=record_types, ttls=ttls)
+        now = time.time()
+        stored = {}
+        for record_type in record_types:
+            key = (domain, record_type)
+            if self._due.get(key) is None:
+                # Unwatched while the check was running
+                continue
+            self.checks += 1
+            result = results[record_type]
+            ttl = ttls.get(record_type)
+            if ttl is None:
+                # No definitive answer: keep the baseline and try again soon
+                self.failed_checks += 1
+                self._failures[key] = self._failures.get(key, 0) + 1
+                self._schedule(domain, record_type, now + self.interval(domain, record_type, None))
+                continue
+            self._failures.pop(key, None)
+            case = result["use_cases"].get(record_type) or {}
+            if record_type == 'SOA' and case.get("records"):
+                self._refresh[domain] = case["records"][0].get("refresh")
+            current = {"case": case, "published": bool(result.get(PUBLISHED_FLAGS.get(record_type, ''), False))}
+            interval = self.interval(domain, record_type, ttl)
+            self._schedule(domain, record_type, now + interval)
+            previous = self._state.get(key)
+            self._state[key] = current
+            stored[record_type] = (result, ttl)
+            if previous is None:
+                continue
+            change = diff_check(record_type, previous, current)
+            if change:
+                self.changes += 1
+                self.on_change({
+                    "event": "change",
+                    "domain": domain,
+                    "record_type": record_type,
+                    **change,
+                    "checked_at": round(now, 3),
+                    "next_check_in": round(interval, 1)
+                })
+        if self.store is not None and stored:
+            # Fresh results are also what the dashboard would have fetched, keep them
+            self.store.save(domain, stored)
+
+    async def _run_check(self, domain, record_types, limit):
+        try:
+            await self.check(domain, record_types)
+        except Exception as e:
+            print(f"Check of {domain} failed: {e}", file=sys.stderr)
+            now = time.time()
+            for record_type in record_types:
+                if self._due.get((domain, record_type)) is not None:
+                    self._failures[(domain, record_type)] = self._failures.get((domain, record_type), 0) + 1
+                    self._schedule(domain, record_type, now + self.interval(domain, record_type, None))
+        finally:
+            self._in_flight.difference_update((domain, record_type) for record_type in record_types)
+            limit.release()
+
+    def _pop_due(self, now) -> dict:
+        """{domain: [record types]} of the queue entries due by now"""
+        due = {}
+        while self._queue and self._queue[0][0] <= now:
+            at, _, domain, record_type = heapq.heappop(self._queue)
+            key = (domain, record_type)
+            if self._due.get(key) != at or key in self._in_flight:
+                continue
+            self._in_flight.add(key)
+            due.setdefault(domain, []).append(record_type)
+        return due
+
+    async def run(self, duration=None):
+        """Check due record types until nothing is watched, or for duration seconds"""
+        self._wakeup = asyncio.Event()
+        limit = asyncio.Semaphore(self.concurrency)
+        tasks = set()
+        stop_at = time.time() + duration if duration is not None else None
+        try:
+            while self._due:
+                now = time.time()
+                if stop_at is not None and now >= stop_at:
+                    break
+                for domain, record_types in self._pop_due(now).items():
+                    await limit.acquire()
+                    task = asyncio.ensure_future(self._run_check(domain, record_types, limit))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                self._wakeup.clear()
+                wait = self._queue[0][0] - time.time() if self._queue else None
+                if stop_at is not None:
+                    wait = stop_at - time.time() if wait is None else min(wait, stop_at - time.time())
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=max(0.0, wait) if wait is not None else None)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                await asyncio.wait(tasks)
+            self._wakeup = None
+
+    def stats(self) -> dict:
+        return {
+            "watched": len(self._due),
+            "checks": self.checks,
+            "failed_checks": self.failed_checks,
+            "changes": self.changes,
+            "next_due_in": round(self._queue[0][0] - time.time(), 1) if self._queue else None
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Monitor domains on a TTL-driven schedule and report DNS changes')
+    parser.add_argument('domains', nargs='*', help='Domains to watch')
+    parser.add_argument('--watch', default=None, metavar='FILE',
+                       help="File of domains to watch, one per line ('-' for stdin)")
+    parser.add_argument('--test-type', action='append', choices=list(ANALYZERS), default=None,
+                       help='Record type to monitor (repeatable, defaults to all)')
+    parser.add_argument('--timeout', type=int, default=10, help='Timeout of one check in seconds')
+    parser.add_argument('--concurrency', type=int, default=64, help='Domains checked concurrently')
+    parser.add_argument('--min-interval', type=float, default=MIN_INTERVAL,
+                       help='Never re-check a record type sooner than this, however short its TTL')
+    parser.add_argument('--max-interval', type=float, default=MAX_INTERVAL,
+                       help='Re-check every record type at least this often, however long its TTL')
+    parser.add_argument('--spread', type=float, default=None,
+                       help='Seconds over which the first checks are spread (defaults to --min-interval)')
+    parser.add_argument('--duration', type=float, default=None, help='Stop after this many seconds')
+    parser.add_argument('--nameserver', action='append', default=None, metavar='IP',
+                       help='Query this nameserver instead of the system resolvers (repeatable)')
+    parser.add_argument('--dns-port', type=int, default=53, help='Port of the --nameserver servers')
+    parser.add_argument('--authoritative', action='store_true',
+                       help='Send queries straight to each zone\'s authoritative servers')
+    parser.add_argument('--rate-limit', type=float, default=None,
+                       help='Maximum upstream queries per second per nameserver')
+    parser.add_argument('--store', default=None, metavar='FILE',
+                       help='SQLite result store to keep up to date with every check (default $DNS_RESULT_STORE)')
+
+    args = parser.parse_args()
+    domains = list(read_domains(args.domains))
+    if args.watch:
+        if args.watch == '-':
+            domains.extend(read_domains(sys.stdin))
+        else:
+            with open(args.watch, encoding='utf-8') as f:
+                domains.extend(read_domains(f))
+    if not domains:
+        parser.error('no domains to watch')
+    if args.store:
+        configure_result_store(args.store)
+    configure_nameservers(args.nameserver, args.dns_port)
+    configure_rate_limiter(args.rate_limit)
+    if args.authoritative:
+        configure_authoritative()
+
+    def write(change):
+        sys.stdout.write(json.dumps(change, separators=(',', ':')) + '\n')
+        sys.stdout.flush()
+
+    monitor = Monitor(args.concurrency, args.timeout, args.min_interval, args.max_interval,
+                      on_change=write, store=result_store())
+    spread = args.min_interval if args.spread is None else args.spread
+    for domain in dict.fromkeys(domains):
+        monitor.watch(domain, args.test_type, spread)
+    try:
+        asyncio.run(monitor.run(args.duration))
+    except KeyboardInterrupt:
+        pass
+    print(json.dumps({"summary": monitor.stats()}), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
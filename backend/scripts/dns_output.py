@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Output encodings for dns_individual.py results
+  json     full results, use-case metadata inline (indented for a single domain)
+  compact  one compact JSON document per result, metadata stripped
+  ndjson   compact JSON lines, preceded by one {"metadata": ...} line
+  msgpack  MessagePack objects, preceded by one {"metadata": ...} object
+The stripped Goal/Purpose/Expected/Notes text is the versioned table from use_cases,
+emitted once per stream or fetched separately with --metadata.
+Streamed analysis events (--stream) are always written one per line, never indented.
+"""
+import json
+import sys
+
+from use_cases import metadata_table, strip_event, strip_metadata
+
+FORMATS = ('json', 'compact', 'ndjson', 'msgpack')
+
+
+def load_msgpack():
+    try:
+        import msgpack
+    except ImportError:
+        raise RuntimeError("--format msgpack requires the msgpack package (pip install msgpack)")
+    return msgpack
+
+
+def full_size(result) -> int:
+    """Bytes of result in the original indented JSON output"""
+    return len(json.dumps(result, indent=2).encode('utf-8')) + 1
+
+
+class PayloadReport:
+    """Bytes per domain of the chosen encoding against the original indented JSON"""
+
+    def __init__(self, output_format):
+        self.output_format = output_format
+        self.domains = 0
+        self.full_bytes = 0
+        self.encoded_bytes = 0
+        self.header_bytes = 0
+
+    def record(self, result, encoded_size):
+        self.record_size(full_size(result), encoded_size)
+
+    def record_size(self, full_bytes, encoded_size):
+        self.domains += 1
+        self.full_bytes += full_bytes
+        self.encoded_bytes += encoded_size
+
+    def summary(self) -> dict:
+        count = max(1, self.domains)
+        full = self.full_bytes / count
+        # The one-off metadata header is amortized over the stream
+        encoded = (self.encoded_bytes + self.header_bytes) / count
+        return {
+            "format": self.output_format,
+            "domains": self.domains,
+            "full_json_bytes_per_domain": round(full, 1),
+            "encoded_bytes_per_domain": round(encoded, 1),
+            "saved_bytes_per_domain": round(full - encoded, 1),
+            "reduction_percent": round((full - encoded) / full * 100, 1) if full else None,
+            "metadata_header_bytes": self.header_bytes
+        }
+
+
+class ResultWriter:
+    """Encode results to a binary stream in one of FORMATS, optionally measuring the payload saved"""
+
+    def __init__(self, output_format='json', stream=None, pretty=False, report=False):
+        if output_format not in FORMATS:
+            raise ValueError(f"Unsupported output format: {output_format}")
+        self.output_format = output_format
+        self.stream = stream or sys.stdout.buffer
+        self.pretty = pretty
+        self.report = PayloadReport(output_format) if report else None
+        self._msgpack = load_msgpack() if output_format == 'msgpack' else None
+        self._header_written = False
+
+    def encode(self, document) -> bytes:
+        if self._msgpack is not None:
+            return self._msgpack.packb(document, use_bin_type=True)
+        if self.pretty:
+            return (json.dumps(document, indent=2) + '\n').encode('utf-8')
+        return (json.dumps(document, separators=(',', ':')) + '\n').encode('utf-8')
+
+    def _emit(self, data):
+        self.stream.write(data)
+        self.stream.flush()
+
+    def _write_header(self):
+        if self.output_format in ('ndjson', 'msgpack') and not self._header_written:
+            header = self.encode({"metadata": metadata_table()})
+            self._emit(header)
+            self._header_written = True
+            if self.report is not None:
+                self.report.header_bytes = len(header)
+
+    def encode_result(self, result) -> bytes:
+        """One analysis result in this writer's format, without the stream header"""
+        return self.encode(result if self.output_format == 'json' else strip_metadata(result))
+
+    def write(self, result):
+        """Write one analysis result"""
+        self._write_header()
+        data = self.encode_result(result)
+        if self.report is not None:
+            self.report.record(result, len(data))
+        self._emit(data)
+
+    def write_encoded(self, data, full_bytes=0):
+        """Write one result already encoded by encode_result (in another process); full_bytes feeds the report"""
+        self._write_header()
+        if self.report is not None:
+            self.report.record_size(full_bytes, len(data))
+        self._emit(data)
+
+    def write_event(self, event):
+        """Write one streamed analysis event"""
+        self._write_header()
+        if self._msgpack is not None:
+            self._emit(self._msgpack.packb(strip_event(event), use_bin_type=True))
+            return
+        event = event if self.output_format == 'json' else strip_event(event)
+        self._emit((json.dumps(event, separators=(',', ':')) + '\n').encode('utf-8'))
+
+    def write_summary(self, summary):
+        """Write the trailing batch summary line in the same encoding"""
+        if self.report is not None:
+            summary = {**summary, "payload": self.report.summary()}
+        self._emit(self.encode({"summary": summary}))
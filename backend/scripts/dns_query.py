@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+"""
+DNS query layer shared by the analyze_*_record functions
+A DNSQuerySession sends each (qname, rdtype) pair upstream once and shares the answer
+across every analyzer that asks for it during one analysis, answers are also served
+from the process-wide TTL-aware cache in dns_cache. Queries go out through
+dns.asyncresolver, so one event loop can keep many analyses in flight. A lookup already
+in flight for another session (a second analysis of the same domain, MX hosts shared by
+a batch) is joined instead of sent again.
+"""
+import asyncio
+import copy
+import threading
+import time
+
+import dns.asyncresolver
+import dns.flags
+import dns.resolver
+
+from dns_authoritative import authoritative_directory
+from dns_cache import answer_cache, answer_ttl, negative_ttl
+from dns_trace import active_span, finish_span, start_span
+from dns_transport import close_transport, pooled_nameservers
+
+_system_resolver = None
+_system_resolver_lock = threading.Lock()
+
+
+def system_resolver():
+    """Async resolver built from /etc/resolv.conf, read once per process, querying through dns_transport"""
+    global _system_resolver
+    with _system_resolver_lock:
+        if _system_resolver is None:
+            resolver = dns.asyncresolver.Resolver()
+            resolver.nameservers = pooled_nameservers(resolver.nameservers, resolver.port, resolver.nameserver_ports)
+            _system_resolver = resolver
+        return _system_resolver
+
+
+def configure_nameservers(nameservers=None, port=53):
+    """Send every query to the given nameservers instead of those in /etc/resolv.conf, None restores them"""
+    global _system_resolver
+    with _system_resolver_lock:
+        if not nameservers:
+            _system_resolver = None
+            return None
+        resolver = dns.asyncresolver.Resolver(configure=False)
+        resolver.port = port
+        resolver.nameservers = pooled_nameservers(list(nameservers), port)
+        _system_resolver = resolver
+        return resolver
+
+
+_dnssec_records = False
+
+
+def request_dnssec_records(enabled=True):
+    """Set the DO bit on every query so answers carry their RRSIGs (for dns_dnssec), enabled=False clears it"""
+    global _dnssec_records
+    _dnssec_records = enabled
+
+
+def make_resolver(timeout=10):
+    """Create a resolver from the system configuration with the given timeout"""
+    resolver = copy.copy(system_resolver())
+    resolver.timeout = timeout
+    resolver.lifetime = timeout
+    if _dnssec_records:
+        resolver.use_edns(0, dns.flags.DO, 1232)
+    return resolver
+
+
+class NameserverRateLimiter:
+    """
+    Token bucket per upstream nameserver. acquire() waits until one of the given
+    nameservers has a token and returns it, spreading queries across all of them.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(1, rate))
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    async def acquire(self, nameservers):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                best, best_wait = None, None
+                for nameserver in nameservers:
+                    tokens, updated = self._buckets.get(nameserver, (self.burst, now))
+                    tokens = min(self.burst, tokens + (now - updated) * self.rate)
+                    self._buckets[nameserver] = (tokens, now)
+                    wait = 0 if tokens >= 1 else (1 - tokens) / self.rate
+                    if best_wait is None or wait < best_wait:
+                        best, best_wait = nameserver, wait
+                if best_wait == 0:
+                    tokens, updated = self._buckets[best]
+                    self._buckets[best] = (tokens - 1, updated)
+                    return best
+            await asyncio.sleep(best_wait)
+
+
+_rate_limiter = None
+
+
+def rate_limiter():
+    """Process-wide per-nameserver rate limiter, or None when unlimited"""
+    return _rate_limiter
+
+
+def configure_rate_limiter(rate=None, burst=None):
+    """Limit upstream queries to rate per second per nameserver, None removes the limit"""
+    global _rate_limiter
+    _rate_limiter = NameserverRateLimiter(rate, burst) if rate else None
+    return _rate_limiter
+
+
+class SingleFlight:
+    """
+    Concurrent callers of the same key share one in-flight computation: the first starts it,
+    the others await its result (or exception) until it completes and the key is free again
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def join(self, key):
+        """Future of the computation in flight for key on this event loop, or None"""
+        future = self._flights.get(key)
+        if future is None or future.done() or future.get_loop() is not asyncio.get_running_loop():
+            return None
+        self.coalesced += 1
+        return future
+
+    def lead(self, key, future):
+        """Register future as the computation for key until it completes"""
+        self.leaders += 1
+        self._flights[key] = future
+
+        def landed(done):
+            if self._flights.get(key) is done:
+                del self._flights[key]
+
+        future.add_done_callback(landed)
+        return future
+
+    async def run(self, key, factory):
+        """Await factory() once for every concurrent caller of key"""
+        future = self.join(key)
+        if future is None:
+            future = self.lead(key, asyncio.ensure_future(factory()))
+        # Shielded so one cancelled caller doesn't cancel the computation for the others
+        return await asyncio.shield(future)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._flights),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced
+        }
+
+
+_query_flights = SingleFlight()
+
+
+def query_flights():
+    """Process-wide SingleFlight of upstream lookups, or None when sessions don't share them"""
+    return _query_flights
+
+
+def configure_query_coalescing(enabled=True):
+    """Let concurrent sessions join each other's in-flight lookups, enabled=False keeps them apart"""
+    global _query_flights
+    _query_flights = SingleFlight() if enabled else None
+    return _query_flights
+
+
+def query_key(qname, rdtype):
+    """Normalized cache key for a (qname, rdtype) pair"""
+    return (str(qname).lower().rstrip('.'), str(rdtype).upper())
+
+
+def run_sync(coroutine):
+    """
+    asyncio.run for the sync entry points. Lookups still in flight when coroutine returns
+    (abandoned DKIM probes, analyzers past the deadline) are cancelled and drained first,
+    so the loop never shuts down with unretrieved DNS exceptions.
+    """
+    async def main():
+        try:
+            return await coroutine
+        finally:
+            current = asyncio.current_task()
+            pending = [task for task in asyncio.all_tasks() if task is not current]
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            # Only once nothing is left to use them, or the cancelled lookups fail on closed sockets first
+            close_transport()
+    return asyncio.run(main())
+
+
+def _consume_exception(future):
+    # Lookups whose callers were cancelled must not log "exception was never retrieved"
+    if not future.cancelled():
+        future.exception()
+
+
+class DNSQuerySession:
+    """
+    Per-analysis query layer. The first caller for a (qname, rdtype) pair starts the lookup,
+    concurrent and later callers await and reuse its answer (or its exception).
+    Sessions on the system resolvers also join lookups in flight for other sessions.
+    A session belongs to the event loop it is first used in.
+    """
+
+    def __init__(self, timeout=10, resolver=None, cache=None, limiter=None, authoritative=None):
+        # Only sessions asking the same upstreams can share a lookup
+        self.flights = query_flights() if resolver is None else None
+        self.resolver = resolver or make_resolver(timeout)
+        # None uses the process-wide cache/limiter/directory, False disables them for this session
+        self.cache = answer_cache() if cache is None else (cache or None)
+        self.limiter = rate_limiter() if limiter is None else (limiter or None)
+        self.authoritative = authoritative_directory() if authoritative is None else (authoritative or None)
+        self._answers = {}
+        self._parsed = {}
+        self.upstream_queries = 0
+        self.saved_queries = 0
+        self.cache_hits = 0
+        self.coalesced_queries = 0
+
+    async def resolve(self, qname, rdtype, direct=True):
+        """
+        Resolve qname/rdtype, issuing at most one upstream query per pair for this session.
+        In authoritative-direct mode direct=False still asks the recursive resolver.
+        """
+        key = query_key(qname, rdtype)
+        # NS sets are what the authoritative servers are found from, they always come from recursion
+        direct = direct and self.authoritative is not None and key[1] != 'NS'
+        session_key = key if direct or self.authoritative is None else key + ('recursive',)
+        future = self._answers.get(session_key)
+        if future is None:
+            future = self._cached(key)
+            cache = 'miss' if future is None else 'hit'
+            if future is None and self.flights is not None:
+                leader = self.flights.join(session_key)
+                if leader is not None:
+                    self.coalesced_queries += 1
+                    cache = 'coalesced'
+                    future = asyncio.ensure_future(self._joined(leader))
+            span = start_span('query', f"{key[1]} {key[0]}", qname=key[0], rdtype=key[1], cache=cache)
+            if future is None:
+                # The fetch task inherits the span, its upstream attempts are recorded under it
+                with active_span(span):
+                    future = asyncio.ensure_future(self._fetch(key, qname, rdtype, direct))
+                if self.flights is not None:
+                    self.flights.lead(session_key, future)
+            future.add_done_callback(_consume_exception)
+            self._answers[session_key] = future
+        else:
+            self.saved_queries += 1
+            span = start_span('query', f"{key[1]} {key[0]}", qname=key[0], rdtype=key[1], cache='session')
+        try:
+            # Shielded so a cancelled caller (deadline, DKIM hit) doesn't cancel the lookup for the others
+            answer = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            finish_span(span, outcome='CANCELLED')
+            raise
+        except Exception as e:
+            finish_span(span, error=e)
+            raise
+        finish_span(span, answer)
+        return answer
+
+    async def _joined(self, leader):
+        """
+        Result of another session's lookup, waited for no longer than this session's own lifetime:
+        the leader may have been started with a longer timeout
+        """
+        try:
+            return await asyncio.wait_for(asyncio.shield(leader), self.resolver.lifetime)
+        except asyncio.TimeoutError:
+            raise dns.resolver.LifetimeTimeout(timeout=self.resolver.lifetime, errors=[]) from None
+
+    def _cached(self, key):
+        """Completed future from the answer cache, or None on a miss"""
+        if self.cache is None:
+            return None
+        found, value, negative = self.cache.get(key)
+        if not found:
+            return None
+        self.cache_hits += 1
+        future = asyncio.get_running_loop().create_future()
+        if negative:
+            future.set_exception(value)
+        else:
+            future.set_result(value)
+        return future
+
+    async def _fetch(self, key, qname, rdtype, direct=False):
+        self.upstream_queries += 1
+        try:
+            answer = await self._query(qname, rdtype, direct)
+        except Exception as e:
+            if self.cache is not None:
+                self.cache.put_error(key, e)
+            raise
+        if self.cache is not None:
+            self.cache.put_answer(key, answer)
+        return answer
+
+    async def _query(self, qname, rdtype, direct=False):
+        if not direct:
+            resolver = await self._upstream_resolver()
+            return await resolver.resolve(qname, rdtype)
+        started = time.monotonic()
+        handled, answer = await self.authoritative.resolve(self, qname, rdtype, self.resolver.lifetime)
+        if handled:
+            return answer
+        # Falling back to recursion only gets what is left of the lifetime
+        resolver = await self._upstream_resolver()
+        return await resolver.resolve(qname, rdtype, lifetime=max(0.0, self.resolver.lifetime - (time.monotonic() - started)))
+
+    async def _upstream_resolver(self):
+        """Resolver for the next upstream query, led by a nameserver with rate budget left"""
+        if self.limiter is None:
+            return self.resolver
+        nameservers = list(self.resolver.nameservers)
+        chosen = await self.limiter.acquire(nameservers)
+        resolver = copy.copy(self.resolver)
+        resolver.nameservers = [chosen] + [ns for ns in nameservers if ns != chosen]
+        return resolver
+
+    async def txt_records(self, qname):
+        """TXT strings for qname with surrounding quotes stripped, parsed once per session"""
+        return self._txt_strings(qname, await self.resolve(qname, 'TXT'))
+
+    def _txt_strings(self, qname, answers):
+        key = query_key(qname, 'TXT')
+        parsed = self._parsed.get(key)
+        if parsed is None:
+            parsed = [str(answer).strip('"') for answer in answers]
+            self._parsed[key] = parsed
+        return list(parsed)
+
+    def answered(self, qname, rdtype):
+        """(answer, None) or (None, exception) of a lookup this session completed, None if it has not"""
+        key = query_key(qname, rdtype)
+        for session_key in (key, key + ('recursive',)):
+            future = self._answers.get(session_key)
+            if future is not None and future.done() and not future.cancelled():
+                error = future.exception()
+                return (None, error) if error is not None else (future.result(), None)
+        return None
+
+    def view(self):
+        """SessionView over this session for one analyzer"""
+        return SessionView(self)
+
+    def stats(self) -> dict:
+        """
+        Upstream queries sent, duplicates answered from this session, answers served from the
+        cache and lookups joined while in flight for another session
+        """
+        return {
+            "upstream_queries": self.upstream_queries,
+            "saved_queries": self.saved_queries,
+            "cache_hits": self.cache_hits,
+            "coalesced_queries": self.coalesced_queries
+        }
+
+
+class SessionView:
+    """
+    One analyzer's window onto a shared DNSQuerySession. Queries go through the session
+    unchanged, the view only tracks how long the answers it handed out stay valid.
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self._ttl = None
+        self.cacheable = True
+
+    @property
+    def ttl(self):
+        """Seconds until the first answer seen expires, None when something can't be cached"""
+        return self._ttl if self.cacheable else None
+
+    def observe(self, ttl):
+        """Account for an answer obtained elsewhere that stays valid for ttl seconds (None: not at all)"""
+        if ttl is None:
+            self.cacheable = False
+        elif self._ttl is None or ttl < self._ttl:
+            self._ttl = ttl
+
+    async def resolve(self, qname, rdtype):
+        try:
+            answer = await self.session.resolve(qname, rdtype)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # NXDOMAIN/NoAnswer last for the negative TTL, timeouts and SERVFAIL not at all
+            self.observe(negative_ttl(e))
+            raise
+        self.observe(answer_ttl(answer))
+        return answer
+
+    async def txt_records(self, qname):
+        return self.session._txt_strings(qname, await self.resolve(qname, 'TXT'))
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Multi-process sharded batch execution for dns_individual.py
+One process tops out on a single core: wire parsing, rdata formatting, the provider scans
+and JSON encoding all hold the GIL. The executor starts a pool of worker processes, each
+running its own event loop with a share of the concurrency, and hands them domains in
+small chunks as their in-flight count drops, so a slow shard never holds work a free one
+could do.
+
+Workers encode their results themselves and send the encoded bytes back over a pipe behind
+a fixed-size header carrying the counters the summary needs, so no result dict is pickled.
+The parent writes the bytes straight through, as they arrive or (ordered=True) in input
+order, and merges the batch summary. Domains outstanding on a worker that dies are reported
+as failed, and so is the rest of the input once no worker is left.
+"""
+import asyncio
+import json
+import multiprocessing
+import struct
+import time
+from itertools import islice
+from multiprocessing.connection import wait
+
+from dns_bulk import BatchStats
+
+CHUNK_SIZE = 32
+# index, latency, success, upstream queries, saved queries, cache hits, coalesced queries,
+# full JSON bytes (for --size-report)
+FRAME_HEADER = struct.Struct('<QdBIIIII')
+# Index of the frame a worker ends with: its stats() as JSON
+STATS_FRAME = 2 ** 64 - 1
+
+
+def pack_frame(index, latency, result, data, full_bytes=0) -> bytes:
+    query_stats = result.get("query_stats") or {}
+    return FRAME_HEADER.pack(
+        index, latency, bool(result.get("success")), query_stats.get("upstream_queries", 0),
+        query_stats.get("saved_queries", 0), query_stats.get("cache_hits", 0),
+        query_stats.get("coalesced_queries", 0), full_bytes
+    ) + data
+
+
+async def serve_shard(tasks, results, analyze, encode, concurrency):
+    """Analyze the (index, domain) chunks received on tasks until None, sending one frame per domain on results"""
+    loop = asyncio.get_running_loop()
+    limit = asyncio.Semaphore(concurrency)
+    pending = set()
+
+    async def run(index, domain):
+        started = time.monotonic()
+        try:
+            result = await analyze(domain)
+        except Exception as e:
+            result = {"domain": domain, "success": False, "error": str(e)}
+        finally:
+            limit.release()
+        data, full_bytes = encode(result)
+        results.send_bytes(pack_frame(index, time.monotonic() - started, result, data, full_bytes))
+
+    while True:
+        chunk = await loop.run_in_executor(None, tasks.recv)
+        if chunk is None:
+            break
+        for index, domain in chunk:
+            await limit.acquire()
+            task = asyncio.ensure_future(run(index, domain))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+    if pending:
+        await asyncio.wait(pending)
+
+
+def shard_main(setup, setup_args, tasks, results, concurrency):
+    """Worker process entry point; setup(setup_args) configures the process and returns (analyze, encode, stats)"""
+    from dns_query import run_sync
+
+    analyze, encode, stats = setup(setup_args)
+    try:
+        run_sync(serve_shard(tasks, results, analyze, encode, concurrency))
+        results.send_bytes(FRAME_HEADER.pack(STATS_FRAME, 0.0, 0, 0, 0, 0, 0, 0) + json.dumps(stats()).encode('utf-8'))
+    finally:
+        results.close()
+
+
+class Shard:
+    """Parent-side handle of one worker process and the domains it has not answered yet"""
+
+    def __init__(self, process, tasks, results):
+        self.process = process
+        self.tasks = tasks
+        self.results = results
+        self.outstanding = {}
+        self.stats = None
+        self.closed = False
+
+    def send(self, chunk):
+        self.outstanding.update(chunk)
+        try:
+            self.tasks.send(chunk)
+        except OSError:
+            # The worker is gone; its EOF reports the chunk as lost
+            pass
+
+    def finish(self):
+        if not self.closed:
+            self.closed = True
+            try:
+                self.tasks.send(None)
+            except OSError:
+                pass
+
+
+def run_sharded_batch(domains, setup, setup_args, processes, concurrency=256, write=None, encode=None,
+                      ordered=False, chunk_size=CHUNK_SIZE) -> dict:
+    """
+    Analyze domains across processes worker processes, concurrency domains in flight in total.
+    write(data, full_bytes) receives each encoded result, encode(result) -> (data, full_bytes)
+    encodes the failures of a worker that died. Returns the merged batch summary, with each
+    worker's stats() under "shards".
+    """
+    context = multiprocessing.get_context()
+    per_shard = max(1, -(-concurrency // processes))
+    shards = []
+    for _ in range(processes):
+        task_reader, task_writer = context.Pipe(duplex=False)
+        result_reader, result_writer = context.Pipe(duplex=False)
+        process = context.Process(target=shard_main, args=(setup, setup_args, task_reader, result_writer, per_shard),
+                                  daemon=True)
+        process.start()
+        task_reader.close()
+        result_writer.close()
+        shards.append(Shard(process, task_writer, result_reader))
+
+    stats = BatchStats()
+    numbered = enumerate(domains)
+    exhausted = False
+    # ordered=True: encoded results waiting for an earlier index, and the next index to write
+    held = {}
+    next_index = 0
+
+    def emit(index, data, full_bytes):
+        nonlocal next_index
+        if write is None:
+            return
+        if not ordered:
+            write(data, full_bytes)
+            return
+        held[index] = (data, full_bytes)
+        while next_index in held:
+            write(*held.pop(next_index))
+            next_index += 1
+
+    def finish_all():
+        nonlocal exhausted
+        exhausted = True
+        # Workers still drain what they hold before sending their stats
+        for other in shards:
+            other.finish()
+
+    def feed(shard):
+        while not exhausted and len(shard.outstanding) < per_shard:
+            chunk = list(islice(numbered, chunk_size))
+            if not chunk:
+                finish_all()
+                return
+            shard.send(chunk)
+
+    def fill():
+        # Split the first concurrency domains evenly, so a batch smaller than --concurrency still
+        # runs on every process instead of filling the first one
+        initial = list(islice(numbered, per_shard * processes))
+        share = max(1, -(-len(initial) // processes))
+        for position, shard in enumerate(shards):
+            part = initial[position * share:(position + 1) * share]
+            for start in range(0, len(part), chunk_size):
+                shard.send(part[start:start + chunk_size])
+        if len(initial) < per_shard * processes:
+            finish_all()
+
+    def failed(index, domain):
+        result = {"domain": domain, "success": False, "error": "analysis process exited"}
+        stats.record(result, 0.0)
+        data, full_bytes = encode(result) if encode is not None else (b'', 0)
+        emit(index, data, full_bytes)
+
+    def lost(shard):
+        for index, domain in sorted(shard.outstanding.items()):
+            failed(index, domain)
+        shard.outstanding.clear()
+
+    try:
+        fill()
+        live = {shard.results: shard for shard in shards}
+        while live:
+            for connection in wait(list(live)):
+                shard = live[connection]
+                try:
+                    frame = connection.recv_bytes()
+                except (EOFError, OSError):
+                    del live[connection]
+                    lost(shard)
+                    continue
+                index, latency, success, *counters, full_bytes = FRAME_HEADER.unpack_from(frame)
+                data = frame[FRAME_HEADER.size:]
+                if index == STATS_FRAME:
+                    shard.stats = json.loads(data)
+                    continue
+                shard.outstanding.pop(index, None)
+                stats.count(bool(success), latency, *counters)
+                emit(index, data, full_bytes)
+                feed(shard)
+        # Every worker died before the input ran out: report the rest rather than drop it
+        for index, domain in numbered:
+            failed(index, domain)
+    finally:
+        for shard in shards:
+            shard.finish()
+            shard.process.join(timeout=5)
+            if shard.process.is_alive():
+                shard.process.terminate()
+            shard.tasks.close()
+            shard.results.close()
+
+    summary = stats.summary()
+    summary["processes"] = processes
+    summary["shards"] = [shard.stats for shard in shards]
+    return summary
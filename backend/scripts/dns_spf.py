@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+"""
+SPF evaluation for analyze_spf_record (RFC 7208)
+Expands a domain's SPF record the way a receiving mail server would: include: and
+redirect= are followed recursively, a and mx are resolved to addresses, and every
+branch of the tree is resolved in parallel. The result counts the DNS lookups
+(limit 10, section 4.6.4) and void lookups (limit 2) the record costs, and flattens
+it into the IP ranges it authorizes with a pass result.
+
+Evaluated records are memoized process-wide until their shortest TTL runs out, so
+the include trees most domains share (_spf.google.com, spf.protection.outlook.com,
+...) are resolved once per bulk run instead of once per domain.
+"""
+import asyncio
+import ipaddress
+import threading
+import time
+from collections import OrderedDict
+
+import dns.resolver
+
+from dns_cache import answer_ttl, negative_ttl
+
+MAX_LOOKUPS = 10
+MAX_VOID_LOOKUPS = 2
+# Addresses looked up per mx mechanism, more is a permerror
+MAX_MX_HOSTS = 10
+# include/redirect nesting followed before giving up; the lookup limit is exceeded long before
+MAX_DEPTH = 10
+MAX_CACHED_RECORDS = 10000
+
+LOOKUP_MECHANISMS = ('include', 'a', 'mx', 'ptr', 'exists')
+MECHANISMS = LOOKUP_MECHANISMS + ('all', 'ip4', 'ip6')
+QUALIFIERS = '+-~?'
+
+PERMERROR = 'permerror'
+TEMPERROR = 'temperror'
+
+
+def spf_records(txt_answer):
+    """SPF records among the TXT rdatas of an answer, each rdata's strings joined as RFC 7208 3.3 requires"""
+    records = []
+    for rdata in txt_answer:
+        text = b''.join(rdata.strings).decode('utf-8', errors='replace')
+        if text == 'v=spf1' or text.startswith('v=spf1 '):
+            records.append(text)
+    return records
+
+
+def parse_record(record):
+    """([(qualifier, mechanism, argument)], {modifier: value}) of an SPF record; raises ValueError"""
+    terms = []
+    modifiers = {}
+    for token in record.split()[1:]:
+        name, separator, value = token.partition('=')
+        if separator and ':' not in name and '/' not in name:
+            modifiers[name.lower()] = value
+            continue
+        qualifier = '+'
+        if token[0] in QUALIFIERS:
+            qualifier, token = token[0], token[1:]
+        for delimiter in (':', '/'):
+            if delimiter in token:
+                mechanism, argument = token.split(delimiter, 1)
+                argument = argument if delimiter == ':' else '/' + argument
+                break
+        else:
+            mechanism, argument = token, ''
+        mechanism = mechanism.lower()
+        if mechanism not in MECHANISMS:
+            raise ValueError(f"unknown mechanism '{token}'")
+        terms.append((qualifier, mechanism, argument))
+    return terms, modifiers
+
+
+def split_cidr(argument):
+    """(domain-spec, ip4 prefix, ip6 prefix) of an a/mx argument such as 'example.com/24//64'"""
+    ip6_prefix = 128
+    if '//' in argument:
+        argument, ip6 = argument.split('//', 1)
+        ip6_prefix = int(ip6)
+    ip4_prefix = 32
+    if '/' in argument:
+        argument, ip4 = argument.rsplit('/', 1)
+        ip4_prefix = int(ip4)
+    return argument, ip4_prefix, ip6_prefix
+
+
+def target_domain(spec, domain):
+    """Domain a domain-spec names, or None when it depends on the sender (macros other than %{d})"""
+    if not spec:
+        return domain
+    spec = spec.replace('%{d}', domain).replace('%%', '%').replace('%_', ' ').replace('%-', '%20')
+    if '%' in spec:
+        return None
+    return spec.rstrip('.').lower()
+
+
+class SPFNode:
+    """One evaluated SPF record with everything below it"""
+
+    def __init__(self, domain):
+        self.domain = domain
+        self.record = None
+        self.lookups = 0
+        self.void_lookups = 0
+        self.ip4 = set()
+        self.ip6 = set()
+        self.children = []
+        self.unresolved = []
+        self.errors = []
+        self.has_all = False
+        # Seconds the evaluation stays valid, None when part of it failed and must not be reused
+        self.ttl = float('inf')
+        self.expires = None
+        self.loop = False
+
+    def observe(self, ttl):
+        self.ttl = None if ttl is None or self.ttl is None else min(self.ttl, ttl)
+
+    def remaining(self):
+        """Seconds this evaluation stays valid from now: what a cached node has left of its TTL"""
+        if self.expires is None or self.ttl is None:
+            return self.ttl
+        return max(0.0, self.expires - time.time())
+
+    def error(self, kind, message):
+        self.errors.append(f"{kind}: {message}")
+
+    def merge(self, child, authorize):
+        """Add a followed include/redirect: its costs always, its pass ranges when authorize"""
+        self.children.append(child)
+        self.lookups += child.lookups
+        self.void_lookups += child.void_lookups
+        self.unresolved.extend(child.unresolved)
+        self.errors.extend(child.errors)
+        self.observe(child.remaining())
+        self.loop = self.loop or child.loop
+        if authorize:
+            self.ip4.update(child.ip4)
+            self.ip6.update(child.ip6)
+
+    def tree(self) -> dict:
+        return {
+            "domain": self.domain,
+            "lookups": self.lookups,
+            "includes": [child.tree() for child in self.children]
+        }
+
+
+def loop_node(domain):
+    """Node standing in for an include/redirect that leads back to a record already being evaluated"""
+    node = SPFNode(domain)
+    node.error(PERMERROR, f"include loop through {domain}")
+    node.loop = True
+    return node
+
+
+async def lookup(session, node, qname, rdtype):
+    """Answer for qname/rdtype, or None for a void lookup; failures are recorded on node as temperrors"""
+    try:
+        answer = await session.resolve(qname, rdtype)
+    except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer) as e:
+        node.observe(negative_ttl(e))
+        return None
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        node.error(TEMPERROR, f"{qname} {rdtype}: {e}")
+        node.observe(None)
+        return None
+    node.observe(answer_ttl(answer))
+    return answer
+
+
+async def host_networks(session, node, host, ip4_prefix, ip6_prefix):
+    """Networks of host's A and AAAA records at the given prefixes; (ip4, ip6, void)"""
+    a, aaaa = await asyncio.gather(lookup(session, node, host, 'A'), lookup(session, node, host, 'AAAA'))
+    ip4 = {ipaddress.ip_network(f"{rdata.address}/{ip4_prefix}", strict=False) for rdata in a or []}
+    ip6 = {ipaddress.ip_network(f"{rdata.address}/{ip6_prefix}", strict=False) for rdata in aaaa or []}
+    return ip4, ip6, not ip4 and not ip6
+
+
+class SPFIncludeCache:
+    """Evaluated SPF records keyed by domain, kept until the shortest TTL in their tree expires"""
+
+    def __init__(self, max_entries=MAX_CACHED_RECORDS):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._evaluating = {}
+        # (loop, domain) of each in-flight evaluation -> (loop, domain) of the shared ones it awaits
+        self._waiting = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, domain):
+        now = time.time()
+        with self._lock:
+            node = self._entries.get(domain)
+            if node is None:
+                return None
+            if node.expires <= now:
+                del self._entries[domain]
+                return None
+            self._entries.move_to_end(domain)
+            return node
+
+    def put(self, node):
+        if not node.ttl or node.ttl == float('inf') or node.loop:
+            return
+        node.expires = time.time() + node.ttl
+        with self._lock:
+            self._entries[node.domain] = node
+            self._entries.move_to_end(node.domain)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def evaluate(self, session, domain, chain):
+        """Cached evaluation of domain's record; concurrent requests for the same domain share one"""
+        node = self.get(domain)
+        if node is not None:
+            self.hits += 1
+            return node
+        loop = asyncio.get_running_loop()
+        key = (loop, domain)
+        waiter = (loop, chain[-1]) if chain else None
+        future = self._evaluating.get(domain)
+        if future is not None and future.get_loop() is loop:
+            if waiter is not None and self._waits_for(key, waiter):
+                # domain's evaluation is itself waiting, through its includes, on the record including it:
+                # two domains of an include loop were started at once, joining would wait forever
+                return loop_node(domain)
+            self.hits += 1
+        else:
+            self.misses += 1
+            future = asyncio.ensure_future(self._evaluate(session, domain, chain))
+            self._evaluating[domain] = future
+            future.add_done_callback(lambda _future: self._evaluating.pop(domain, None))
+        if waiter is None:
+            return await asyncio.shield(future)
+        with self._lock:
+            self._waiting.setdefault(waiter, []).append(key)
+        try:
+            return await asyncio.shield(future)
+        finally:
+            with self._lock:
+                awaited = self._waiting[waiter]
+                awaited.remove(key)
+                if not awaited:
+                    del self._waiting[waiter]
+
+    def _waits_for(self, start, target) -> bool:
+        """Whether the evaluation start awaits target, directly or through the evaluations it awaits"""
+        with self._lock:
+            seen = {start}
+            stack = [start]
+            while stack:
+                for awaited in self._waiting.get(stack.pop(), ()):
+                    if awaited == target:
+                        return True
+                    if awaited not in seen:
+                        seen.add(awaited)
+                        stack.append(awaited)
+            return False
+
+    async def _evaluate(self, session, domain, chain):
+        node = await evaluate_record(session, domain, chain, self)
+        self.put(node)
+        return node
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = len(self._entries)
+        return {"entries": entries, "hits": self.hits, "misses": self.misses}
+
+
+async def follow(session, node, domain, chain, cache):
+    """Evaluate an include/redirect target, guarding against loops and runaway nesting"""
+    if domain in chain:
+        return loop_node(domain)
+    if len(chain) > MAX_DEPTH:
+        child = SPFNode(domain)
+        child.error(PERMERROR, f"include nesting deeper than {MAX_DEPTH} at {domain}")
+        child.observe(None)
+        return child
+    if cache is None:
+        return await evaluate_record(session, domain, chain, None)
+    return await cache.evaluate(session, domain, chain)
+
+
+async def evaluate_record(session, domain, chain=(), cache=None):
+    """SPFNode for domain's SPF record with every include and redirect below it expanded"""
+    node = SPFNode(domain)
+    chain = chain + (domain,)
+    answer = await lookup(session, node, domain, 'TXT')
+    records = spf_records(answer) if answer is not None else []
+    if not records:
+        if answer is None:
+            node.void_lookups += 1
+        return node
+    if len(records) > 1:
+        node.error(PERMERROR, f"{domain} publishes {len(records)} SPF records")
+        return node
+    node.record = records[0]
+    try:
+        terms, modifiers = parse_record(node.record)
+    except ValueError as e:
+        node.error(PERMERROR, f"{domain}: {e}")
+        return node
+
+    async def mechanism(qualifier, name, argument):
+        authorize = qualifier == '+'
+        if name in LOOKUP_MECHANISMS:
+            node.lookups += 1
+        if name == 'all':
+            node.has_all = True
+        elif name in ('ip4', 'ip6'):
+            try:
+                network = ipaddress.ip_network(argument, strict=False)
+            except ValueError:
+                node.error(PERMERROR, f"{domain}: invalid {name}:{argument}")
+                return
+            if authorize:
+                (node.ip4 if network.version == 4 else node.ip6).add(network)
+        elif name in ('ptr', 'exists'):
+            # Decided by the connecting client, nothing to flatten
+            node.unresolved.append(f"{qualifier if qualifier != '+' else ''}{name}{':' + argument if argument else ''}")
+            target = target_domain(argument, domain) if name == 'exists' else None
+            if target and await lookup(session, node, target, 'A') is None:
+                node.void_lookups += 1
+        elif name == 'include':
+            target = target_domain(argument, domain)
+            if target is None:
+                node.unresolved.append(f"include:{argument}")
+                return
+            child = await follow(session, node, target, chain, cache)
+            if child.record is None and not child.errors:
+                node.error(PERMERROR, f"include:{target} has no SPF record")
+            node.merge(child, authorize)
+        else:
+            try:
+                spec, ip4_prefix, ip6_prefix = split_cidr(argument)
+            except ValueError:
+                spec, ip4_prefix, ip6_prefix = None, -1, -1
+            if not 0 <= ip4_prefix <= 32 or not 0 <= ip6_prefix <= 128:
+                node.error(PERMERROR, f"{domain}: invalid prefix length in {name}{argument}")
+                return
+            target = target_domain(spec, domain)
+            if target is None:
+                node.unresolved.append(f"{name}:{argument}")
+                return
+            if name == 'a':
+                hosts = [target]
+            else:
+                mx = await lookup(session, node, target, 'MX')
+                if mx is None:
+                    node.void_lookups += 1
+                    return
+                hosts = sorted({str(rdata.exchange).rstrip('.').lower() for rdata in mx})
+                if len(hosts) > MAX_MX_HOSTS:
+                    node.error(PERMERROR, f"mx:{target} has {len(hosts)} hosts, more than {MAX_MX_HOSTS}")
+                    hosts = hosts[:MAX_MX_HOSTS]
+            resolved = await asyncio.gather(*(host_networks(session, node, host, ip4_prefix, ip6_prefix)
+                                              for host in hosts))
+            if name == 'a' and resolved[0][2]:
+                node.void_lookups += 1
+            if authorize:
+                for ip4, ip6, _void in resolved:
+                    node.ip4.update(ip4)
+                    node.ip6.update(ip6)
+
+    lookups = [term for term in terms if term[1] in LOOKUP_MECHANISMS]
+    if len(lookups) > MAX_LOOKUPS:
+        # Over the limit within one record, the rest would only be followed to be thrown away
+        node.error(PERMERROR, f"{domain} has {len(lookups)} lookup mechanisms")
+        terms = [term for term in terms if term[1] not in LOOKUP_MECHANISMS] + lookups[:MAX_LOOKUPS + 1]
+    await asyncio.gather(*(mechanism(*term) for term in terms))
+    redirect = modifiers.get('redirect')
+    if redirect and not node.has_all:
+        node.lookups += 1
+        target = target_domain(redirect, domain)
+        if target is None:
+            node.unresolved.append(f"redirect={redirect}")
+        else:
+            child = await follow(session, node, target, chain, cache)
+            if child.record is None and not child.errors:
+                node.error(PERMERROR, f"redirect={target} has no SPF record")
+            node.merge(child, True)
+    return node
+
+
+def collapse(networks):
+    return [str(network) for network in ipaddress.collapse_addresses(sorted(networks))]
+
+
+async def evaluate_spf(session, domain) -> dict:
+    """
+    Evaluation summary of domain's SPF record: status ("ok", "permerror" or "temperror"),
+    DNS and void lookups against their limits, the flattened ip4/ip6 ranges that pass,
+    the include tree, mechanisms that can't be flattened, and errors
+    """
+    cache = include_cache()
+    domain = domain.rstrip('.').lower()
+    node = await (cache.evaluate(session, domain, ()) if cache is not None else evaluate_record(session, domain))
+    if cache is not None and node.expires is not None and hasattr(session, 'observe'):
+        # Served from the cache: the analyzer's result is only valid as long as the cached tree
+        session.observe(max(0.0, node.expires - time.time()))
+    errors = list(node.errors)
+    if node.lookups > MAX_LOOKUPS:
+        errors.append(f"{PERMERROR}: {node.lookups} DNS lookups, the limit is {MAX_LOOKUPS}")
+    if node.void_lookups > MAX_VOID_LOOKUPS:
+        errors.append(f"{PERMERROR}: {node.void_lookups} void lookups, the limit is {MAX_VOID_LOOKUPS}")
+    if any(error.startswith(PERMERROR) for error in errors):
+        status = PERMERROR
+    elif errors:
+        status = TEMPERROR
+    else:
+        status = 'ok'
+    return {
+        "status": status,
+        "lookups": node.lookups,
+        "lookup_limit": MAX_LOOKUPS,
+        "void_lookups": node.void_lookups,
+        "void_lookup_limit": MAX_VOID_LOOKUPS,
+        "ip4": collapse(node.ip4),
+        "ip6": collapse(node.ip6),
+        "includes": [child.tree() for child in node.children],
+        "unresolved": list(dict.fromkeys(node.unresolved)),
+        "errors": errors
+    }
+
+
+_include_cache = SPFIncludeCache()
+_evaluation_enabled = True
+
+
+def include_cache():
+    """Process-wide SPFIncludeCache, or None when every evaluation resolves its whole tree"""
+    return _include_cache
+
+
+def spf_evaluation_enabled():
+    return _evaluation_enabled
+
+
+def configure_spf_evaluation(enabled=True, cache_entries=MAX_CACHED_RECORDS):
+    """Turn SPF evaluation on or off and size the include cache, cache_entries=0 disables memoization"""
+    global _include_cache, _evaluation_enabled
+    _evaluation_enabled = enabled
+    _include_cache = SPFIncludeCache(cache_entries) if cache_entries else None
+    return _include_cache
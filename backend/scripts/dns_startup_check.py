@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Cold-start budget check for dns_individual.py
+When the Node service runs without its worker pool every request starts a new
+interpreter, so startup is request latency. This starts fake_dns_server on localhost,
+runs a single-type analysis in fresh processes the way the service spawns them and
+exits non-zero when the wall time, the -X importtime total, the import time on top of
+dnspython itself, or an import that belongs to an optional feature goes over budget.
+
+Usage:
+  python3 dns_startup_check.py
+  python3 dns_startup_check.py --runs 20 --max-wall-ms 300 --max-overhead-ms 20 -o startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from fake_dns_server import FakeDNSServer, synthetic_zone
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+# What every analysis needs anyway; anything imported beyond it is this repo's own startup cost
+FLOOR_IMPORTS = 'import asyncio, json, argparse, dns.asyncresolver'
+# Only needed by options a single-type run doesn't use
+LAZY_MODULES = ('sqlite3', 'msgpack', 'dns_worker', 'dns_bulk', 'dns_monitor', 'dns_enrich', 'dns_shard', 'urllib.request', 'multiprocessing')
+
+MAX_WALL_MS = 400
+MAX_IMPORT_MS = 250
+MAX_OVERHEAD_MS = 25
+
+
+def import_times(args, cwd=SCRIPTS_DIR) -> dict:
+    """{module: self microseconds} of one python -X importtime run"""
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', *args], cwd=cwd, capture_output=True,
+                            text=True).stderr
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _cumulative, module = line[len('import time:'):].split('|')
+        times[module.strip()] = int(self_us)
+    return times
+
+
+def analysis_command(port, domain):
+    # -m as the service does, so the module's bytecode comes from __pycache__
+    return ['-m', 'dns_individual', domain, '--test-type', 'A', '--nameserver', '127.0.0.1', '--dns-port', str(port),
+            '--timeout', '2']
+
+
+def measure(port, domain, runs) -> dict:
+    command = analysis_command(port, domain)
+    # First run writes the bytecode caches a deployed service would already have
+    subprocess.run([sys.executable, *command], cwd=SCRIPTS_DIR, capture_output=True, check=True)
+    walls = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, *command], cwd=SCRIPTS_DIR, capture_output=True, check=True)
+        walls.append((time.perf_counter() - started) * 1000)
+    # Import timings are noisy: alternate the two and keep the fastest of each, the closest to the real cost
+    samples, floors = [], []
+    for _ in range(max(5, runs // 2)):
+        samples.append(import_times(command))
+        floors.append(sum(import_times(['-c', FLOOR_IMPORTS]).values()) / 1000)
+    totals = [sum(times.values()) / 1000 for times in samples]
+    modules = set().union(*samples)
+    return {
+        "python": sys.version.split()[0],
+        "runs": runs,
+        "wall_ms": {
+            "min": round(min(walls), 1),
+            "median": round(statistics.median(walls), 1),
+            "max": round(max(walls), 1)
+        },
+        "import_ms": round(min(totals), 1),
+        "floor_import_ms": round(min(floors), 1),
+        "overhead_import_ms": round(min(totals) - min(floors), 1),
+        "modules": len(modules),
+        "lazy_modules_imported": sorted(module for module in LAZY_MODULES if module in modules)
+    }
+
+
+def over_budget(report, args) -> list:
+    failures = []
+    if report["wall_ms"]["median"] > args.max_wall_ms:
+        failures.append(f"median cold start {report['wall_ms']['median']}ms > {args.max_wall_ms}ms")
+    if report["import_ms"] > args.max_import_ms:
+        failures.append(f"-X importtime total {report['import_ms']}ms > {args.max_import_ms}ms")
+    if report["overhead_import_ms"] > args.max_overhead_ms:
+        failures.append(f"imports beyond dnspython {report['overhead_import_ms']}ms > {args.max_overhead_ms}ms")
+    if report["lazy_modules_imported"]:
+        failures.append(f"optional modules imported at startup: {', '.join(report['lazy_modules_imported'])}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the cold-start time of dns_individual.py against a budget')
+    parser.add_argument('--runs', type=int, default=10, help='Cold starts timed')
+    parser.add_argument('--max-wall-ms', type=float, default=MAX_WALL_MS,
+                       help='Budget for the median wall time of one single-type run')
+    parser.add_argument('--max-import-ms', type=float, default=MAX_IMPORT_MS,
+                       help='Budget for the -X importtime total of one run')
+    parser.add_argument('--max-overhead-ms', type=float, default=MAX_OVERHEAD_MS,
+                       help='Budget for import time beyond asyncio and dnspython themselves')
+    parser.add_argument('-o', '--output', default=None, help='Write the measurements as JSON to this file')
+    args = parser.parse_args()
+
+    zone, domains = synthetic_zone(1)
+    server = FakeDNSServer(zone)
+    port = server.start()
+    try:
+        report = measure(port, domains[0], args.runs)
+    finally:
+        server.stop()
+    failures = over_budget(report, args)
+    report["failures"] = failures
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    if failures:
+        for failure in failures:
+            print(f"Over budget: {failure}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
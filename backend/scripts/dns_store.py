@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Persistent per-record-type result store for incremental re-analysis
+Every analyzer result is kept in a local SQLite file together with the time it was
+fetched and the smallest TTL among the DNS answers it was built from. A re-check
+only re-runs the record types whose TTL has run out and reuses the rest.
+"""
+import json
+import os
+import threading
+import time
+
+from dns_cache import MAX_POSITIVE_TTL
+
+SCHEMA_VERSION = 1
+# Shared by every worker process that points at the same file, so wait out their writes
+BUSY_TIMEOUT_MS = 5000
+
+RESULT_STORE_FILE = os.environ.get('DNS_RESULT_STORE') or None
+
+
+def store_key(domain):
+    return domain.strip().lower().rstrip('.')
+
+
+class ResultStore:
+    """SQLite table of analyzer results keyed on (domain, record_type), each valid until its TTL expires"""
+
+    def __init__(self, path):
+        # Deferred until a store is configured, most runs never open one
+        import sqlite3
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+        self._conn.execute('PRAGMA journal_mode = WAL')
+        self._conn.execute('PRAGMA synchronous = NORMAL')
+        version = self._conn.execute('PRAGMA user_version').fetchone()[0]
+        if version != SCHEMA_VERSION:
+            # Stored results are only a cache of DNS answers, an old layout is simply dropped
+            self._conn.execute('DROP TABLE IF EXISTS results')
+            self._conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS results ('
+            ' domain TEXT NOT NULL,'
+            ' record_type TEXT NOT NULL,'
+            ' result TEXT NOT NULL,'
+            ' fetched_at REAL NOT NULL,'
+            ' expires_at REAL NOT NULL,'
+            ' PRIMARY KEY (domain, record_type)'
+            ') WITHOUT ROWID'
+        )
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    def load(self, domain, record_types) -> dict:
+        """{record_type: result} for the given record types still within their TTL"""
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT record_type, result FROM results WHERE domain = ? AND expires_at > ?',
+                (store_key(domain), now)
+            ).fetchall()
+        stored = {record_type: json.loads(result) for record_type, result in rows if record_type in record_types}
+        self.hits += len(stored)
+        self.misses += len(record_types) - len(stored)
+        return stored
+
+    def save(self, domain, entries):
+        """Persist {record_type: (result, ttl)}; entries without a positive TTL are skipped"""
+        now = time.time()
+        rows = [
+            (store_key(domain), record_type, json.dumps(result, separators=(',', ':')), now,
+             now + min(ttl, MAX_POSITIVE_TTL))
+            for record_type, (result, ttl) in entries.items()
+            if ttl and ttl > 0
+        ]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO results (domain, record_type, result, fetched_at, expires_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                rows
+            )
+        self.writes += len(rows)
+
+    def prune(self):
+        """Delete expired results, returns how many were removed"""
+        with self._lock:
+            return self._conn.execute('DELETE FROM results WHERE expires_at <= ?', (time.time(),)).rowcount
+
+    def stats(self) -> dict:
+        return {"path": self.path, "hits": self.hits, "misses": self.misses, "writes": self.writes}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_result_store = None
+_result_store_loaded = False
+_result_store_lock = threading.Lock()
+
+
+def result_store():
+    """Process-wide result store from DNS_RESULT_STORE, or None when results are not persisted"""
+    global _result_store, _result_store_loaded
+    with _result_store_lock:
+        if not _result_store_loaded:
+            _result_store_loaded = True
+            if RESULT_STORE_FILE:
+                _result_store = ResultStore(RESULT_STORE_FILE)
+        return _result_store
+
+
+def configure_result_store(path=None):
+    """Persist results to the SQLite file at path, None disables the store"""
+    global _result_store, _result_store_loaded
+    with _result_store_lock:
+        if _result_store is not None:
+            _result_store.close()
+        _result_store = ResultStore(path) if path else None
+        _result_store_loaded = True
+        return _result_store
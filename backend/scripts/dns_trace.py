@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Per-query tracing and metrics for the DNS analyzers
+A Trace records one span per analyzer, one per DNS query an analyzer makes (qname,
+rdtype, answer cache hit or miss, rcode) and one per upstream attempt that query
+needed (upstream, protocol, attempt number, latency, rcode, truncation, TCP fallback).
+Traces are attached to results or written as Chrome trace-event JSON, and every span
+can also be aggregated into process-wide Prometheus histograms for the node_exporter
+textfile collector. With neither enabled a span costs two global lookups.
+"""
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+
+import dns.exception
+import dns.message
+import dns.rcode
+import dns.resolver
+
+# Seconds, from an answer next door to a query retried until its lifetime ran out
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Seconds between textfile rewrites in --serve mode
+METRICS_INTERVAL = 15.0
+
+# '{pid}' in the path gives every worker process its own file and a pid label
+METRICS_FILE = os.environ.get('DNS_METRICS_FILE') or None
+
+_current_trace = contextvars.ContextVar('dns_trace', default=None)
+# Innermost open span: analyzer for queries, query for upstream attempts
+_current_span = contextvars.ContextVar('dns_trace_span', default=None)
+
+
+def outcome(answer=None, error=None) -> str:
+    """rcode-like label of how a query or attempt ended"""
+    if error is None:
+        response = answer if isinstance(answer, dns.message.Message) else getattr(answer, 'response', None)
+        return dns.rcode.to_text(response.rcode()) if response is not None else 'NOERROR'
+    if isinstance(error, dns.resolver.NXDOMAIN):
+        return 'NXDOMAIN'
+    if isinstance(error, dns.resolver.NoAnswer):
+        return 'NODATA'
+    if isinstance(error, dns.exception.Timeout):
+        return 'TIMEOUT'
+    if isinstance(error, dns.resolver.NoNameservers):
+        return 'SERVFAIL'
+    if isinstance(error, dns.message.Truncated):
+        return 'TRUNCATED'
+    return type(error).__name__.upper()
+
+
+class Trace:
+    """Spans of one analysis, timed relative to its start"""
+
+    def __init__(self, domain):
+        self.domain = domain
+        self.started_at = time.time()
+        self.origin = time.perf_counter()
+        self.spans = []
+
+    def add(self, span):
+        span["id"] = len(self.spans) + 1
+        span["start_ms"] = round((span["_started"] - self.origin) * 1000, 3)
+        self.spans.append(span)
+
+    def to_dict(self) -> dict:
+        now = time.perf_counter()
+        spans = []
+        for span in self.spans:
+            exported = {key: value for key, value in span.items() if not key.startswith('_')}
+            if "duration_ms" not in exported:
+                # Still in flight when the analysis returned (past the deadline, abandoned DKIM probes)
+                exported["duration_ms"] = round((now - span["_started"]) * 1000, 3)
+                exported["outcome"] = 'INCOMPLETE'
+            spans.append(exported)
+        return {
+            "domain": self.domain,
+            "started_at": self.started_at,
+            "duration_ms": round((now - self.origin) * 1000, 3),
+            "spans": spans
+        }
+
+
+def start_span(kind, name, **attributes):
+    """
+    Open a span under the current one, or return None when nothing is being traced.
+    kind is 'analyzer', 'query' or 'attempt'; record_type is inherited from the parent.
+    """
+    trace = _current_trace.get()
+    if trace is None and _metrics is None:
+        return None
+    parent = _current_span.get()
+    span = {"kind": kind, "name": name}
+    if parent is not None:
+        span["parent"] = parent.get("id")
+        if "record_type" in parent:
+            span["record_type"] = parent["record_type"]
+    span.update(attributes)
+    span["_started"] = time.perf_counter()
+    if trace is not None:
+        trace.add(span)
+    return span
+
+
+def finish_span(span, answer=None, error=None, **attributes):
+    """Close span with its duration and outcome and feed it to the metrics"""
+    if span is None:
+        return
+    span["duration_ms"] = round((time.perf_counter() - span["_started"]) * 1000, 3)
+    span["outcome"] = attributes.pop("outcome", None) or outcome(answer, error)
+    if error is not None and span["outcome"] not in ('NXDOMAIN', 'NODATA'):
+        span["error"] = str(error) or type(error).__name__
+    span.update(attributes)
+    if _metrics is not None:
+        _metrics.observe(span)
+
+
+@contextlib.contextmanager
+def active_span(span):
+    """Make span the parent of spans opened inside the block (and in tasks created there)"""
+    if span is None:
+        yield span
+        return
+    token = _current_span.set(span)
+    try:
+        yield span
+    finally:
+        _current_span.reset(token)
+
+
+def current_span():
+    return _current_span.get()
+
+
+@contextlib.contextmanager
+def tracing(domain, enabled=True):
+    """Collect a Trace of everything awaited inside the block"""
+    if not enabled:
+        yield None
+        return
+    trace = Trace(domain)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+class ChromeTraceWriter:
+    """
+    Streams traces to a file in Chrome's trace-event JSON array format, loadable in
+    chrome://tracing or Perfetto. Each analysis is a process named after its domain and
+    each record type a thread in it, so a bulk run is written as it goes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'w', encoding='utf-8')
+        self._file.write('[\n')
+        self._first = True
+        self._origin = None
+        self._pid = 0
+
+    def _emit(self, event):
+        self._file.write(('' if self._first else ',\n') + json.dumps(event, separators=(',', ':')))
+        self._first = False
+
+    def write(self, trace):
+        """Append one trace, a Trace or the dict attached to a result"""
+        if isinstance(trace, Trace):
+            trace = trace.to_dict()
+        if self._origin is None:
+            self._origin = trace["started_at"]
+        self._pid += 1
+        offset_us = (trace["started_at"] - self._origin) * 1e6
+        self._emit({"name": "process_name", "ph": "M", "pid": self._pid, "args": {"name": trace["domain"]}})
+        threads = {}
+        for span in trace["spans"]:
+            lane = span.get("record_type") or span["kind"]
+            if lane not in threads:
+                threads[lane] = len(threads) + 1
+                self._emit({"name": "thread_name", "ph": "M", "pid": self._pid, "tid": threads[lane],
+                            "args": {"name": lane}})
+            args = {key: value for key, value in span.items()
+                    if key not in ("name", "kind", "start_ms", "duration_ms")}
+            self._emit({
+                "name": span["name"],
+                "cat": span["kind"],
+                "ph": "X",
+                "ts": round(offset_us + span["start_ms"] * 1000, 1),
+                "dur": round((span.get("duration_ms") or 0) * 1000, 1),
+                "pid": self._pid,
+                "tid": threads[lane],
+                "args": args
+            })
+        self._file.flush()
+
+    def close(self):
+        self._file.write('\n]\n')
+        self._file.close()
+
+
+class Histogram:
+    """Prometheus histogram with one series per label tuple"""
+
+    def __init__(self, name, documentation, labels, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, values, seconds):
+        series = self.series.get(values)
+        if series is None:
+            series = self.series[values] = [[0] * len(self.buckets), 0, 0.0]
+        counts = series[0]
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                counts[i] += 1
+        series[1] += 1
+        series[2] += seconds
+
+    def render(self, constant_labels=()):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for values, (counts, count, total) in sorted(self.series.items()):
+            labels = [f'{key}="{escape_label(value)}"' for key, value in (*constant_labels, *zip(self.labels, values))]
+            for bound, bucket_count in zip((*self.buckets, '+Inf'), (*counts, count)):
+                bucket_labels = ','.join(labels + [f'le="{bound}"'])
+                lines.append(f"{self.name}_bucket{{{bucket_labels}}} {bucket_count}")
+            suffix = '{' + ','.join(labels) + '}' if labels else ''
+            lines.append(f"{self.name}_sum{suffix} {total:.6f}")
+            lines.append(f"{self.name}_count{suffix} {count}")
+        return lines
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class TraceMetrics:
+    """Latency histograms aggregated from every finished span in the process"""
+
+    def __init__(self, path=None):
+        self.path = path.replace('{pid}', str(os.getpid())) if path else None
+        self.constant_labels = (("pid", str(os.getpid())),) if path and '{pid}' in path else ()
+        self._lock = threading.Lock()
+        self._written = 0.0
+        self.histograms = {
+            "analyzer": Histogram('dns_analyzer_duration_seconds',
+                                  'Time to analyze one record type of a domain', ('record_type', 'outcome')),
+            "query": Histogram('dns_query_duration_seconds',
+                               'Time until an analyzer had its DNS answer', ('rdtype', 'cache', 'outcome')),
+            "attempt": Histogram('dns_upstream_attempt_duration_seconds',
+                                 'Round trip of one query attempt to an upstream nameserver',
+                                 ('upstream', 'protocol', 'outcome')),
+        }
+
+    def observe(self, span):
+        seconds = span["duration_ms"] / 1000
+        with self._lock:
+            if span["kind"] == 'analyzer':
+                self.histograms["analyzer"].observe((span["name"], span["outcome"]), seconds)
+            elif span["kind"] == 'query':
+                self.histograms["query"].observe((span["rdtype"], span["cache"], span["outcome"]), seconds)
+            elif span["kind"] == 'attempt':
+                self.histograms["attempt"].observe((span["upstream"], span["protocol"], span["outcome"]), seconds)
+
+    def render(self) -> str:
+        with self._lock:
+            lines = []
+            for histogram in self.histograms.values():
+                lines.extend(histogram.render(self.constant_labels))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, force=True):
+        """
+        Rewrite the textfile atomically; without force at most once per METRICS_INTERVAL.
+        Returns whether it was written.
+        """
+        if self.path is None:
+            return False
+        now = time.monotonic()
+        if not force and now - self._written < METRICS_INTERVAL:
+            return False
+        self._written = now
+        temporary = f"{self.path}.{os.getpid()}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as f:
+            f.write(self.render())
+        os.replace(temporary, self.path)
+        return True
+
+
+_metrics = TraceMetrics(METRICS_FILE) if METRICS_FILE else None
+
+
+def metrics():
+    """Process-wide TraceMetrics, or None when spans are not aggregated"""
+    return _metrics
+
+
+def configure_metrics(path=None, enabled=None):
+    """Aggregate spans into histograms written to the textfile at path; enabled=True without path keeps them in memory"""
+    global _metrics
+    _metrics = TraceMetrics(path) if path or enabled else None
+    return _metrics
@@ -0,0 +1,948 @@
+#!/usr/bin/env python3
+"""
+Upstream transport layer under dns.asyncresolver
+Every configured nameserver becomes an Upstream that reuses a few long-lived UDP
+sockets and keeps persistent, pooled TCP (or DNS-over-TLS) connections. Queries are
+pipelined over those connections and responses are matched back to their query by
+message id, in whatever order they arrive (RFC 7766). dnspython keeps doing retries,
+truncation fallback and answer handling; only the wire exchange is replaced.
+
+Each Upstream also keeps an RFC 6298 style SRTT/RTTVAR estimate. A query is
+retransmitted after that upstream's retransmission timeout (RTO) instead of waiting
+out the whole resolver timeout, and once the upstream's p95 RTT has passed without an
+answer a hedged copy goes to the fastest other upstream (or again to the same one over
+UDP); the first usable response of any copy wins.
+
+Every Upstream has a circuit breaker: after CIRCUIT_THRESHOLD consecutive failed
+resolutions (one per resolution, however many copies it sent) spanning at least
+CIRCUIT_DISTINCT_NAMES query names, it opens and queries to it fail at once, so dnspython
+moves straight on to the next nameserver instead of waiting out the timeout on a server
+that is down. The last healthy upstream is never cut off, there is nowhere else to go. Once
+the open period has passed a single query is let through as a probe; an answer closes the
+circuit, another failure reopens it for twice as long. Retries of failed attempts (the
+resolver's next attempt, retransmitted copies) draw on a process-wide retry budget earned
+as a fraction of first attempts, so an outage cannot multiply the load sent upstream.
+"""
+import asyncio
+import collections
+import copy
+import socket
+import ssl
+import struct
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+import dns.entropy
+import dns.exception
+import dns.inet
+import dns.message
+import dns.nameserver
+import dns.rcode
+
+from dns_trace import current_span, finish_span, start_span
+
+PROTOCOLS = ('udp', 'tcp', 'tls')
+DOT_PORT = 853
+# UDP sockets shared per upstream; a few rather than one keeps some source-port entropy
+UDP_SOCKETS = 4
+# Upstreams kept at once; authoritative-direct mode meets a new server per DNS provider,
+# so idle ones beyond this are closed least recently used first
+MAX_UPSTREAMS = 512
+# Persistent stream connections per upstream and queries pipelined on each before another is opened
+MAX_CONNECTIONS = 2
+MAX_PIPELINE = 64
+# Shared UDP sockets see bursts of responses, give them room so the kernel doesn't drop any
+UDP_RECEIVE_BUFFER = 1024 * 1024
+LENGTH = struct.Struct('!H')
+
+# RFC 6298 retransmission timer, bounded for DNS: a LAN resolver answers in well under 100ms
+INITIAL_RTO = 1.0
+MIN_RTO = 0.1
+MAX_RTO = 10.0
+CLOCK_GRANULARITY = 0.01
+# Recent RTTs kept per upstream for the hedging percentile, and how many before hedging starts
+RTT_SAMPLES = 256
+MIN_HEDGE_SAMPLES = 20
+HEDGE_PERCENTILE = 0.95
+# Recompute the percentile after this many new samples rather than on every query
+PERCENTILE_REFRESH = 16
+# Hedged copies per primary query, so a saturated resolver or client isn't flooded with duplicates
+HEDGE_BUDGET = 0.05
+HEDGE_BURST = 10
+# Answers worth returning from a hedge race; SERVFAIL/REFUSED wait for the other attempt
+USABLE_RCODES = (dns.rcode.NOERROR, dns.rcode.NXDOMAIN, dns.rcode.YXDOMAIN)
+# Consecutive failed attempts that open an upstream's circuit, and how long it then stays open
+# (doubled by every failed probe up to the maximum)
+CIRCUIT_THRESHOLD = 5
+# Distinct query names those failures must span: one lame name must not take the upstream down
+CIRCUIT_DISTINCT_NAMES = 3
+CIRCUIT_OPEN_SECONDS = 5.0
+CIRCUIT_MAX_OPEN_SECONDS = 60.0
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+# Retries allowed per first attempt across all upstreams, with a burst for short analyses
+RETRY_BUDGET = 0.1
+RETRY_BURST = 100
+
+
+class ConnectionClosed(EOFError):
+    """The stream connection closed before the response arrived"""
+
+
+class ClosedLocally(ConnectionClosed):
+    """We closed the socket or connection (close_transport), no fault of the upstream"""
+
+
+class CircuitOpen(OSError):
+    """The upstream's circuit is open; an OSError, so dnspython drops it for this resolution"""
+
+
+class RetryBudgetExhausted(OSError):
+    """A failed attempt was not retried because the process-wide retry budget is spent"""
+
+
+class CircuitBreaker:
+    """
+    Health of one upstream: closed, open after consecutive failed resolutions spanning several
+    query names, half-open while one probe runs
+    """
+
+    def __init__(self, threshold=CIRCUIT_THRESHOLD, open_seconds=CIRCUIT_OPEN_SECONDS,
+                 max_open_seconds=CIRCUIT_MAX_OPEN_SECONDS):
+        self.threshold = threshold
+        self.base_open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.failed_names = set()
+        self.open_seconds = open_seconds
+        self.open_until = 0.0
+        self.probing = False
+        self.opens = 0
+        self.probes = 0
+        self.short_circuited = 0
+
+    def available(self) -> bool:
+        """Whether the upstream takes queries right now, without claiming the probe"""
+        return self.state == CLOSED
+
+    def allow(self) -> bool:
+        """Whether one query may go out now; in half-open state only the first caller (the probe) may"""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            if time.monotonic() < self.open_until:
+                self.short_circuited += 1
+                return False
+            self.state = HALF_OPEN
+            self.probing = False
+        if self.probing:
+            self.short_circuited += 1
+            return False
+        self.probing = True
+        self.probes += 1
+        return True
+
+    def success(self):
+        self.failures = 0
+        self.failed_names.clear()
+        if self.state != CLOSED:
+            self.state = CLOSED
+            self.probing = False
+            self.open_seconds = self.base_open_seconds
+
+    def failure(self, qname, may_open=True):
+        """
+        One resolution failed on this upstream. may_open=False when no other upstream is healthy:
+        the circuit then stays closed (or half-open), there is nowhere else to send the query
+        """
+        self.failures += 1
+        if len(self.failed_names) < CIRCUIT_DISTINCT_NAMES:
+            self.failed_names.add(qname)
+        if self.state == HALF_OPEN:
+            if may_open:
+                # The probe failed: stay away twice as long
+                self.open_seconds = min(self.open_seconds * 2, self.max_open_seconds)
+                self._open()
+            else:
+                self.probing = False
+        elif (self.state == CLOSED and may_open and self.failures >= self.threshold
+              and len(self.failed_names) >= min(self.threshold, CIRCUIT_DISTINCT_NAMES)):
+            self._open()
+
+    def abandoned(self):
+        """A query ended without a verdict (cancelled); a probe slot it held is free again"""
+        if self.state == HALF_OPEN:
+            self.probing = False
+
+    def _open(self):
+        self.state = OPEN
+        self.probing = False
+        self.opens += 1
+        self.open_until = time.monotonic() + self.open_seconds
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "failed_names": len(self.failed_names),
+            "opens": self.opens,
+            "probes": self.probes,
+            "short_circuited": self.short_circuited,
+            "open_for_s": round(max(0.0, self.open_until - time.monotonic()), 1) if self.state == OPEN else None
+        }
+
+
+class RetryBudget:
+    """Token bucket shared by every upstream: first attempts earn ratio of a retry, each retry spends one"""
+
+    def __init__(self, ratio=RETRY_BUDGET, burst=RETRY_BURST):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = float(burst)
+        self.first_attempts = 0
+        self.retries = 0
+        self.denied = 0
+        self._lock = threading.Lock()
+
+    def attempt(self):
+        with self._lock:
+            self.first_attempts += 1
+            self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def retry(self) -> bool:
+        with self._lock:
+            if self.tokens < 1:
+                self.denied += 1
+                return False
+            self.tokens -= 1
+            self.retries += 1
+            return True
+
+    def stats(self) -> dict:
+        return {
+            "ratio": self.ratio,
+            "tokens": round(self.tokens, 1),
+            "first_attempts": self.first_attempts,
+            "retries": self.retries,
+            "denied": self.denied
+        }
+
+
+def parse_response(wire, request, options):
+    """Parse wire as a response to request, None when it belongs to some other query"""
+    try:
+        response = dns.message.from_wire(
+            wire,
+            keyring=request.keyring,
+            request_mac=request.mac,
+            one_rr_per_rrset=options.get('one_rr_per_rrset', False),
+            ignore_trailing=options.get('ignore_trailing', False),
+            raise_on_truncation=options.get('raise_on_truncation', False)
+        )
+    except dns.message.Truncated as e:
+        if request.is_response(e.message()):
+            raise
+        return None
+    return response if request.is_response(response) else None
+
+
+def claim_id(pending, request):
+    """Give request a message id not already in flight on this socket or connection"""
+    while request.id in pending:
+        request.id = dns.entropy.random_16()
+    return request.id
+
+
+class UDPChannel(asyncio.DatagramProtocol):
+    """One connected UDP socket carrying many outstanding queries, matched by message id"""
+
+    def __init__(self):
+        self.transport = None
+        self.pending = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+        try:
+            transport.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, UDP_RECEIVE_BUFFER)
+        except OSError:
+            pass
+
+    def datagram_received(self, data, addr):
+        entry = self.pending.get(int.from_bytes(data[:2], 'big')) if len(data) >= 2 else None
+        if entry is None:
+            return
+        request, future, options = entry
+        if future.done():
+            return
+        try:
+            response = parse_response(data, request, options)
+        except dns.message.Truncated as e:
+            future.set_exception(e)
+            return
+        except Exception:
+            # Malformed datagrams are ignored like dnspython's ignore_errors, the query may still be answered
+            return
+        if response is not None:
+            future.set_result(response)
+
+    def error_received(self, exc):
+        # ICMP errors (port unreachable) on a connected socket concern every query on it
+        self._fail(exc)
+
+    def connection_lost(self, exc):
+        self._fail(exc or ClosedLocally("UDP socket closed"))
+
+    def _fail(self, exc):
+        for _request, future, _options in self.pending.values():
+            if not future.done():
+                future.set_exception(exc)
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+
+class StreamConnection:
+    """Persistent TCP or TLS connection with pipelined queries and out-of-order response matching"""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.pending = {}
+        self.closed = False
+        self.queries = 0
+        self._reader_task = asyncio.ensure_future(self._read_responses())
+
+    async def _read_responses(self):
+        error = ConnectionClosed("connection closed by upstream")
+        try:
+            while True:
+                length = LENGTH.unpack(await self.reader.readexactly(LENGTH.size))[0]
+                wire = await self.reader.readexactly(length)
+                entry = self.pending.get(int.from_bytes(wire[:2], 'big')) if length >= 2 else None
+                if entry is None:
+                    continue
+                request, future, options = entry
+                if future.done():
+                    continue
+                try:
+                    response = parse_response(wire, request, options)
+                except Exception as e:
+                    future.set_exception(e)
+                    continue
+                if response is not None:
+                    future.set_result(response)
+        except (asyncio.IncompleteReadError, OSError) as e:
+            if isinstance(e, OSError):
+                error = ConnectionClosed(str(e))
+        except asyncio.CancelledError:
+            error = ClosedLocally("connection closed")
+            raise
+        finally:
+            self.close(error)
+
+    async def query(self, request, timeout, options):
+        if self.closed:
+            raise ConnectionClosed("connection closed")
+        query_id = claim_id(self.pending, request)
+        wire = request.to_wire()
+        future = asyncio.get_running_loop().create_future()
+        self.pending[query_id] = (request, future, options)
+        self.queries += 1
+        try:
+            self.writer.write(LENGTH.pack(len(wire)) + wire)
+            await self.writer.drain()
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise dns.exception.Timeout(timeout=timeout)
+        except OSError as e:
+            self.close(ConnectionClosed(str(e)))
+            raise ConnectionClosed(str(e))
+        finally:
+            self.pending.pop(query_id, None)
+
+    def close(self, error=None):
+        if self.closed:
+            return
+        self.closed = True
+        self.writer.close()
+        if not self._reader_task.done() and self._reader_task is not asyncio.current_task():
+            self._reader_task.cancel()
+        for _request, future, _options in self.pending.values():
+            if not future.done():
+                future.set_exception(error or ClosedLocally("connection closed"))
+
+
+class RTTEstimator:
+    """Smoothed RTT and variance (RFC 6298) of one upstream, plus a window of samples for its p95"""
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.backoff = 1
+        self.samples = collections.deque(maxlen=RTT_SAMPLES)
+        self._percentile = None
+        self._new_samples = 0
+
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        # A fresh measurement ends the exponential backoff (RFC 6298 section 5.7)
+        self.backoff = 1
+        self.samples.append(rtt)
+        self._new_samples += 1
+
+    def timed_out(self):
+        self.backoff = min(self.backoff * 2, 64)
+
+    def rto(self) -> float:
+        """Seconds to wait for an answer before giving the attempt up"""
+        if self.srtt is None:
+            base = INITIAL_RTO
+        else:
+            base = self.srtt + max(CLOCK_GRANULARITY, 4 * self.rttvar)
+        return min(MAX_RTO, max(MIN_RTO, base) * self.backoff)
+
+    def hedge_delay(self):
+        """p95 RTT once enough samples are in, None before that"""
+        if len(self.samples) < MIN_HEDGE_SAMPLES:
+            return None
+        if self._percentile is None or self._new_samples >= PERCENTILE_REFRESH:
+            ordered = sorted(self.samples)
+            self._percentile = ordered[min(len(ordered) - 1, int(HEDGE_PERCENTILE * len(ordered)))]
+            self._new_samples = 0
+        return self._percentile
+
+
+class LoopState:
+    """Sockets and connections of one Upstream in one event loop"""
+
+    def __init__(self):
+        self.udp = []
+        self.streams = []
+        self.udp_lock = asyncio.Lock()
+        self.connect_lock = asyncio.Lock()
+
+
+class Upstream:
+    """
+    One upstream nameserver: shared UDP sockets and a pool of persistent stream connections.
+    Sockets belong to an event loop, so each loop gets its own set; stats span all of them.
+    """
+
+    def __init__(self, address, port=53, protocol='udp', server_name=None, udp_sockets=UDP_SOCKETS):
+        self.address = address
+        self.port = port
+        self.protocol = protocol
+        self.server_name = server_name
+        self.udp_sockets = udp_sockets
+        self._states = weakref.WeakKeyDictionary()
+        self._ssl = self._ssl_context() if protocol == 'tls' else None
+        self.queries = 0
+        self.udp_queries = 0
+        self.stream_queries = 0
+        self.truncated = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.connections_opened = 0
+        self.connection_reuses = 0
+        self.connect_seconds = 0.0
+        self.query_seconds = 0.0
+        self.max_in_flight = 0
+        self.in_flight = 0
+        self.last_error = None
+        self.rtt = RTTEstimator()
+        self.hedges = 0
+        self.hedges_won = 0
+        self.retransmits = 0
+        self.hedge_tokens = float(HEDGE_BURST)
+        self.breaker = CircuitBreaker(*_circuit) if _circuit else None
+
+    def _ssl_context(self):
+        context = ssl.create_default_context()
+        if not self.server_name:
+            # RFC 8310 opportunistic privacy: encrypt without authenticating the server
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        return context
+
+    def _state(self):
+        loop = asyncio.get_running_loop()
+        state = self._states.get(loop)
+        if state is None:
+            state = self._states[loop] = LoopState()
+        return state
+
+    async def query(self, request, timeout, max_size, options, duplicate=None):
+        """Send request and return the matching response, over UDP unless max_size or a stream protocol"""
+        self.queries += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        started = time.monotonic()
+        span = self._attempt_span(request, max_size, duplicate)
+        try:
+            if max_size or self.protocol != 'udp':
+                self.stream_queries += 1
+                response = await self._stream_query(request, timeout, options)
+            else:
+                self.udp_queries += 1
+                response = await self._udp_query(request, timeout, {**options, 'raise_on_truncation': True})
+            self.rtt.sample(time.monotonic() - started)
+            if self.breaker is not None:
+                self.breaker.success()
+            finish_span(span, response)
+            return response
+        except dns.message.Truncated as e:
+            self.truncated += 1
+            self.rtt.sample(time.monotonic() - started)
+            if self.breaker is not None:
+                self.breaker.success()
+            finish_span(span, error=e, truncated=True)
+            raise
+        except dns.exception.Timeout as e:
+            self.timeouts += 1
+            self.rtt.timed_out()
+            finish_span(span, error=e)
+            raise
+        except (asyncio.CancelledError, ClosedLocally):
+            finish_span(span, outcome='CANCELLED')
+            raise
+        except Exception as e:
+            self.errors += 1
+            self.last_error = repr(e)
+            finish_span(span, error=e)
+            raise
+        finally:
+            self.in_flight -= 1
+            self.query_seconds += time.monotonic() - started
+
+    def take_hedge_token(self) -> bool:
+        """Spend one unit of the hedge budget earned by this upstream's primary queries"""
+        if self.hedge_tokens < 1:
+            return False
+        self.hedge_tokens -= 1
+        return True
+
+    def _attempt_span(self, request, max_size, duplicate=None):
+        """Span for one attempt, numbered within the query span it belongs to"""
+        query = current_span()
+        attempt = 1
+        if query is not None and query["kind"] == 'query':
+            attempt = query["attempts"] = query.get("attempts", 0) + 1
+            query["upstream"] = f"{self.address}@{self.port}"
+        protocol = self.protocol if self.protocol != 'udp' else ('tcp' if max_size else 'udp')
+        return start_span(
+            'attempt', f"{protocol} {self.address}@{self.port}",
+            upstream=f"{self.address}@{self.port}", protocol=protocol, attempt=attempt,
+            # dnspython retries over TCP with max_size set after a truncated UDP answer
+            tcp_fallback=bool(max_size) and self.protocol == 'udp',
+            duplicate=duplicate,
+            qname=request.question[0].name.to_text() if request.question else None
+        )
+
+    async def _udp_query(self, request, timeout, options):
+        channel = await self._udp_channel()
+        query_id = claim_id(channel.pending, request)
+        future = asyncio.get_running_loop().create_future()
+        channel.pending[query_id] = (request, future, options)
+        try:
+            channel.transport.sendto(request.to_wire())
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise dns.exception.Timeout(timeout=timeout)
+        finally:
+            channel.pending.pop(query_id, None)
+
+    async def _udp_channel(self):
+        state = self._state()
+        state.udp = [channel for channel in state.udp if not channel.transport.is_closing()]
+        if len(state.udp) < self.udp_sockets:
+            async with state.udp_lock:
+                if len(state.udp) < self.udp_sockets:
+                    _transport, channel = await asyncio.get_running_loop().create_datagram_endpoint(
+                        UDPChannel, remote_addr=(self.address, self.port)
+                    )
+                    state.udp.append(channel)
+                    return channel
+        # Least loaded socket keeps message ids sparse on each one
+        return min(state.udp, key=lambda channel: len(channel.pending))
+
+    async def _stream_query(self, request, timeout, options):
+        deadline = time.monotonic() + timeout
+        connection, reused = await self._stream_connection(timeout)
+        try:
+            return await connection.query(request, timeout, options)
+        except ConnectionClosed:
+            if not reused:
+                raise
+            # The upstream closed an idle pooled connection under us: retry once on a fresh one
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise dns.exception.Timeout(timeout=timeout)
+            connection, _reused = await self._stream_connection(remaining, fresh=True)
+            return await connection.query(request, remaining, options)
+
+    async def _stream_connection(self, timeout, fresh=False):
+        """(connection, reused) with pipeline room, opening one while the pool is below MAX_CONNECTIONS"""
+        state = self._state()
+        state.streams = [connection for connection in state.streams if not connection.closed]
+        if not fresh:
+            connection = self._least_loaded(state)
+            if connection is not None:
+                self.connection_reuses += 1
+                return connection, True
+        async with state.connect_lock:
+            state.streams = [connection for connection in state.streams if not connection.closed]
+            if not fresh:
+                connection = self._least_loaded(state)
+                if connection is not None:
+                    self.connection_reuses += 1
+                    return connection, True
+            started = time.monotonic()
+            try:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(
+                        self.address, self.port, ssl=self._ssl,
+                        server_hostname=(self.server_name or self.address) if self._ssl else None
+                    ),
+                    timeout
+                )
+            except asyncio.TimeoutError:
+                raise dns.exception.Timeout(timeout=timeout)
+            self.connect_seconds += time.monotonic() - started
+            self.connections_opened += 1
+            connection = StreamConnection(reader, writer)
+            state.streams.append(connection)
+            return connection, False
+
+    def _least_loaded(self, state):
+        if not state.streams:
+            return None
+        connection = min(state.streams, key=lambda c: len(c.pending))
+        if len(connection.pending) < MAX_PIPELINE or len(state.streams) >= MAX_CONNECTIONS:
+            return connection
+        return None
+
+    def close(self):
+        """Close the sockets and connections owned by the running event loop"""
+        state = self._states.pop(asyncio.get_running_loop(), None)
+        if state is None:
+            return
+        for channel in state.udp:
+            channel.close()
+        for connection in state.streams:
+            connection.close()
+
+    def stats(self) -> dict:
+        return {
+            "protocol": self.protocol,
+            "queries": self.queries,
+            "udp_queries": self.udp_queries,
+            "stream_queries": self.stream_queries,
+            "truncated": self.truncated,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "connections_opened": self.connections_opened,
+            "connection_reuses": self.connection_reuses,
+            "avg_connect_ms": round(self.connect_seconds / self.connections_opened * 1000, 2)
+            if self.connections_opened else None,
+            "avg_query_ms": round(self.query_seconds / self.queries * 1000, 2) if self.queries else None,
+            "max_in_flight": self.max_in_flight,
+            "srtt_ms": round(self.rtt.srtt * 1000, 2) if self.rtt.srtt is not None else None,
+            "rttvar_ms": round(self.rtt.rttvar * 1000, 2) if self.rtt.rttvar is not None else None,
+            "rto_ms": round(self.rtt.rto() * 1000, 2),
+            "hedge_after_ms": round(self.rtt.hedge_delay() * 1000, 2) if self.rtt.hedge_delay() is not None else None,
+            "hedges": self.hedges,
+            "hedges_won": self.hedges_won,
+            "retransmits": self.retransmits,
+            "circuit": self.breaker.stats() if self.breaker is not None else None,
+            "last_error": self.last_error
+        }
+
+
+def usable(task):
+    """Whether a finished attempt ends a hedge race: a usable response, or truncation to fall back on"""
+    if task.cancelled():
+        return False
+    error = task.exception()
+    if error is not None:
+        return isinstance(error, dns.message.Truncated)
+    return task.result().rcode() in USABLE_RCODES
+
+
+async def hedged_query(primary, partners, request, timeout, max_size, options):
+    """
+    Race copies of request until one gets a usable response or timeout runs out. Earlier
+    copies stay in flight, so a late answer is still taken.
+    - once primary's p95 RTT has passed, a hedged copy goes to the partner with the lowest
+      SRTT (or primary again over UDP), limited to HEDGE_BUDGET per primary query
+    - every time primary's RTO (doubling each time) expires, a retransmitted copy follows
+    """
+    started = time.monotonic()
+    primary.hedge_tokens = min(HEDGE_BURST, primary.hedge_tokens + HEDGE_BUDGET)
+    hedge_at = primary.rtt.hedge_delay() if _hedge else None
+    retransmit_at = primary.rtt.rto() if _adaptive_timeout else None
+    first = asyncio.ensure_future(primary.query(request, timeout, max_size, options))
+    attempts = {first: primary}
+    pending = {first}
+    try:
+        while pending:
+            triggers = [at for at in (hedge_at, retransmit_at) if at is not None and at < timeout]
+            wait = max(0.0, min(triggers) - (time.monotonic() - started)) if triggers else None
+            done, pending = await asyncio.wait(pending, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if usable(task):
+                    if task is not first and attempts[task] is not None:
+                        attempts[task].hedges_won += 1
+                    return task.result()
+            if done or not triggers:
+                continue
+            elapsed = time.monotonic() - started
+            if retransmit_at is not None and elapsed >= retransmit_at:
+                reason = 'retransmit'
+                primary.rtt.timed_out()
+                retransmit_at *= 2
+                if _retry_budget is not None and not _retry_budget.retry():
+                    continue
+            elif hedge_at is not None and elapsed >= hedge_at:
+                reason = 'hedge'
+                hedge_at = None
+                if not primary.take_hedge_token():
+                    continue
+            else:
+                continue
+            partner = hedge_partner(primary, partners, max_size)
+            if partner is None:
+                retransmit_at = hedge_at = None
+                continue
+            if reason == 'hedge':
+                partner.hedges += 1
+            else:
+                partner.retransmits += 1
+            task = asyncio.ensure_future(partner.query(
+                copy.copy(request), timeout - elapsed, max_size, options, duplicate=reason
+            ))
+            # Only hedges that beat the primary count as won
+            attempts[task] = partner if reason == 'hedge' else None
+            pending.add(task)
+        # No usable answer from any copy: report the primary's outcome and let dnspython move on
+        return first.result()
+    finally:
+        for task in pending:
+            task.cancel()
+        for task in attempts:
+            if task.done() and not task.cancelled():
+                task.exception()
+
+
+def hedge_partner(primary, partners, max_size):
+    """
+    Upstream for a hedged copy: the fastest other one with a closed circuit, else primary itself
+    when that is a UDP retransmit
+    """
+    candidates = [found for found in partners
+                  if found is not primary and (found.breaker is None or found.breaker.available())]
+    if candidates:
+        return min(candidates, key=lambda found: found.rtt.srtt if found.rtt.srtt is not None else INITIAL_RTO)
+    if not max_size and primary.protocol == 'udp' and (primary.breaker is None or primary.breaker.available()):
+        return primary
+    return None
+
+
+class PooledNameserver(dns.nameserver.AddressAndPortNameserver):
+    """dnspython nameserver whose wire exchange goes through the shared Upstream for its address"""
+
+    def __init__(self, address, port=53, udp_sockets=UDP_SOCKETS):
+        super().__init__(address, port)
+        self.udp_sockets = udp_sockets
+        # Pooled nameservers configured alongside this one, the candidates for hedged copies
+        self.peers = []
+
+    def kind(self):
+        return {'udp': 'Do53', 'tcp': 'Do53-TCP', 'tls': 'DoT'}[_protocol]
+
+    def is_always_max_size(self):
+        return _protocol != 'udp'
+
+    async def async_query(self, request, timeout, source, source_port, max_size, backend,
+                          one_rr_per_rrset=False, ignore_trailing=False):
+        options = {'one_rr_per_rrset': one_rr_per_rrset, 'ignore_trailing': ignore_trailing}
+        primary = upstream(self.address, self.port, self.udp_sockets)
+        peers = [upstream(peer.address, peer.port, peer.udp_sockets) for peer in self.peers]
+        breaker = primary.breaker
+        # With no other healthy upstream there is nowhere better to go: query this one regardless
+        elsewhere = any(found.breaker is None or found.breaker.available() for found in peers if found is not primary)
+        probe = False
+        if breaker is not None and elsewhere:
+            if not breaker.allow():
+                raise CircuitOpen(f"circuit open for {self.address}@{self.port}")
+            # In half-open state only the probe is allowed through
+            probe = breaker.state == HALF_OPEN
+        # dnspython sends every attempt of one resolution with the same request message
+        failed_attempts = getattr(request, 'failed_attempts', 0)
+        if _retry_budget is not None:
+            if not failed_attempts:
+                _retry_budget.attempt()
+            elif not _retry_budget.retry():
+                if probe:
+                    breaker.abandoned()
+                raise RetryBudgetExhausted(f"retry budget spent, not retrying {self.address}")
+        try:
+            if not _adaptive_timeout and not _hedge:
+                return await primary.query(request, timeout, max_size, options)
+            return await hedged_query(primary, peers, request, timeout, max_size, options)
+        except (dns.exception.Timeout, OSError, EOFError) as e:
+            request.failed_attempts = failed_attempts + 1
+            if breaker is not None:
+                self._charge(request, primary, e, probe, elsewhere)
+            raise
+        except asyncio.CancelledError:
+            if probe:
+                breaker.abandoned()
+            raise
+
+    @staticmethod
+    def _charge(request, primary, error, probe, elsewhere):
+        """
+        Count a failed attempt against primary's breaker: at most once per resolution, however many
+        retransmitted or hedged copies it took, and never for a socket we closed ourselves
+        """
+        charged = getattr(request, 'charged_upstreams', None)
+        if charged is None:
+            charged = request.charged_upstreams = set()
+        if isinstance(error, ClosedLocally) or primary in charged:
+            if probe:
+                primary.breaker.abandoned()
+            return
+        charged.add(primary)
+        qname = request.question[0].name if request.question else None
+        primary.breaker.failure(qname, may_open=elsewhere)
+
+    def query(self, request, timeout, source, source_port, max_size, one_rr_per_rrset=False, ignore_trailing=False):
+        """
+        Blocking exchange for the sync dns.resolver: a plain dnspython nameserver on the same
+        address and transport, without the shared sockets, hedging or circuit breaker
+        """
+        if _protocol == 'tls':
+            nameserver = dns.nameserver.DoTNameserver(self.address, self.port, hostname=_server_name,
+                                                      verify=bool(_server_name))
+        else:
+            nameserver = dns.nameserver.Do53Nameserver(self.address, self.port)
+        return nameserver.query(request, timeout, source, source_port, max_size or _protocol == 'tcp',
+                                one_rr_per_rrset, ignore_trailing)
+
+_protocol = 'udp'
+_server_name = None
+_adaptive_timeout = True
+_hedge = True
+# (threshold, open seconds, max open seconds) of new upstreams' breakers, None without breakers
+_circuit = (CIRCUIT_THRESHOLD, CIRCUIT_OPEN_SECONDS, CIRCUIT_MAX_OPEN_SECONDS)
+_retry_budget = RetryBudget()
+_upstreams = OrderedDict()
+_upstreams_lock = threading.Lock()
+
+
+def configure_transport(protocol='udp', server_name=None):
+    """
+    Select how queries reach the upstreams: 'udp' (TCP only after truncation),
+    'tcp' or 'tls' (DNS-over-TLS, port 853 unless a port is configured explicitly).
+    server_name is the TLS name to authenticate, without it DoT is opportunistic.
+    """
+    global _protocol, _server_name
+    if protocol not in PROTOCOLS:
+        raise ValueError(f"Unsupported transport: {protocol}")
+    with _upstreams_lock:
+        _protocol = protocol
+        _server_name = server_name
+        _upstreams.clear()
+
+
+def configure_query_strategy(adaptive_timeout=True, hedge=True):
+    """
+    adaptive_timeout: retransmit after the upstream's RTO rather than wait out the resolver timeout.
+    hedge: send a hedged copy once the upstream's p95 RTT has passed without an answer.
+    """
+    global _adaptive_timeout, _hedge
+    _adaptive_timeout = adaptive_timeout
+    _hedge = hedge
+
+
+def configure_resilience(circuit_threshold=CIRCUIT_THRESHOLD, open_seconds=CIRCUIT_OPEN_SECONDS,
+                         max_open_seconds=CIRCUIT_MAX_OPEN_SECONDS, retry_budget=RETRY_BUDGET, retry_burst=RETRY_BURST):
+    """
+    circuit_threshold: consecutive failures that open an upstream's circuit (0 disables the breakers).
+    retry_budget: retries allowed per first attempt across all upstreams (0 disables the budget).
+    """
+    global _circuit, _retry_budget
+    with _upstreams_lock:
+        _circuit = (circuit_threshold, open_seconds, max_open_seconds) if circuit_threshold else None
+        for found in _upstreams.values():
+            found.breaker = CircuitBreaker(*_circuit) if _circuit else None
+    _retry_budget = RetryBudget(retry_budget, retry_burst) if retry_budget else None
+
+
+def retry_budget_stats():
+    """Counters of the process-wide retry budget, None when it is disabled"""
+    return _retry_budget.stats() if _retry_budget is not None else None
+
+
+def upstream(address, port=53, udp_sockets=UDP_SOCKETS) -> Upstream:
+    """Process-wide Upstream for address/port under the configured transport, udp_sockets applies when created"""
+    key = (address, port)
+    evicted = []
+    with _upstreams_lock:
+        found = _upstreams.get(key)
+        if found is None:
+            found = _upstreams[key] = Upstream(address, port, _protocol, _server_name, udp_sockets)
+            if len(_upstreams) > MAX_UPSTREAMS:
+                idle = [other for other_key, other in _upstreams.items() if other.in_flight == 0 and other_key != key]
+                for other in idle[:len(_upstreams) - MAX_UPSTREAMS]:
+                    del _upstreams[(other.address, other.port)]
+                    evicted.append(other)
+        else:
+            _upstreams.move_to_end(key)
+    for other in evicted:
+        try:
+            other.close()
+        except RuntimeError:
+            pass
+    return found
+
+
+def pooled_nameservers(nameservers, port=53, nameserver_ports=None, udp_sockets=UDP_SOCKETS) -> list:
+    """Replace plain nameserver addresses with PooledNameservers; other entries (DoH URLs) are kept"""
+    if _protocol == 'tls' and port == 53:
+        port = DOT_PORT
+    pooled = []
+    for nameserver in nameservers:
+        if isinstance(nameserver, str) and dns.inet.is_address(nameserver):
+            pooled.append(PooledNameserver(nameserver, (nameserver_ports or {}).get(nameserver, port), udp_sockets))
+        else:
+            pooled.append(nameserver)
+    peers = [nameserver for nameserver in pooled if isinstance(nameserver, PooledNameserver)]
+    for nameserver in peers:
+        nameserver.peers = peers
+    return pooled
+
+
+def close_transport():
+    """Close every upstream's sockets and connections in the running event loop"""
+    with _upstreams_lock:
+        upstreams = list(_upstreams.values())
+    for found in upstreams:
+        found.close()
+
+
+def transport_stats() -> dict:
+    """Per-upstream counters, keyed address@port"""
+    with _upstreams_lock:
+        upstreams = list(_upstreams.values())
+    return {f"{found.address}@{found.port}": found.stats() for found in upstreams}
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Long-running worker mode for dns_individual.py
+Reads JSON-lines requests on stdin (or a local Unix socket) and streams back one
+JSON-lines response per request, handling many requests concurrently on one event loop
+
+Request:  {"id": 1, "domain": "example.com", "test_type": "MX", "timeout": 10}
+Response: {"id": 1, "success": true, "result": {...}}
+          {"id": 1, "success": false, "error": "..."}
+
+A handler may instead return an async iterator of events (streamed requests): every
+event but the last is sent as {"id": 1, "event": {...}} the moment it is produced, and
+the last one becomes the "result" of the closing response.
+"""
+import asyncio
+import inspect
+import json
+import os
+import sys
+
+
+def encode_response(response) -> bytes:
+    """Serialize a response as one compact JSON line"""
+    return (json.dumps(response, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+async def process_line(line, handler, emit=None) -> dict:
+    """
+    Decode one request line and run it through the async handler, never raising.
+    Events of a streaming handler are passed to emit(response) as they arrive.
+    """
+    request_id = None
+    try:
+        request = json.loads(line)
+        if not isinstance(request, dict):
+            raise ValueError("request must be a JSON object")
+        request_id = request.get("id")
+        result = await handler(request)
+        if inspect.isasyncgen(result):
+            events, result = result, None
+            async for event in events:
+                # One behind, so the last event is held back for the closing response
+                if result is not None and emit is not None:
+                    await emit({"id": request_id, "event": result})
+                result = event
+        return {"id": request_id, "success": True, "result": result}
+    except Exception as e:
+        return {"id": request_id, "success": False, "error": str(e)}
+
+
+async def serve_stream(handler, readline, write, limit):
+    """
+    Read request lines with readline(), run each as a task (at most limit in flight)
+    and write each response with write() as soon as it finishes
+    """
+    pending = set()
+
+    async def run(line):
+        try:
+            response = await process_line(line, handler, lambda event: write(encode_response(event)))
+            await write(encode_response(response))
+        finally:
+            limit.release()
+
+    while True:
+        line = await readline()
+        if not line:
+            break
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', errors='replace')
+        if not line.strip():
+            continue
+        await limit.acquire()
+        task = asyncio.ensure_future(run(line))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+
+    # Input closed: finish what is still in flight before returning
+    if pending:
+        await asyncio.wait(pending)
+
+
+async def serve_stdio_async(handler, workers=256):
+    loop = asyncio.get_running_loop()
+    stdin = sys.stdin.buffer
+    stdout = sys.stdout.buffer
+
+    async def readline():
+        # Blocking read in a thread works for pipes, files and terminals alike
+        return await loop.run_in_executor(None, stdin.readline)
+
+    async def write(data):
+        stdout.write(data)
+        stdout.flush()
+
+    await serve_stream(handler, readline, write, asyncio.Semaphore(workers))
+
+
+def serve_stdio(handler, workers=256):
+    """Serve JSON-lines requests from stdin, responses go to stdout"""
+    asyncio.run(serve_stdio_async(handler, workers))
+
+
+async def serve_unix_socket_async(handler, path, workers=256):
+    limit = asyncio.Semaphore(workers)
+
+    async def connection(reader, writer):
+        async def write(data):
+            writer.write(data)
+            await writer.drain()
+        try:
+            await serve_stream(handler, reader.readline, write, limit)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    if os.path.exists(path):
+        os.unlink(path)
+    server = await asyncio.start_unix_server(connection, path)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def serve_unix_socket(handler, path, workers=256):
+    """Serve JSON-lines requests on a Unix socket, one request stream per connection"""
+    try:
+        asyncio.run(serve_unix_socket_async(handler, path, workers))
+    except KeyboardInterrupt:
+        pass
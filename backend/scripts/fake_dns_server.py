@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+Local stand-in DNS server for benchmarking dns_individual.py
+Serves synthetic zones over UDP and TCP on localhost with configurable response
+latency, packet loss, NXDOMAIN names and qnames that never answer (timeouts).
+
+Usage:
+  python3 fake_dns_server.py --port 5353 --domains 1000 --latency 20 --loss 0.01 --list domains.txt
+  python3 dns_individual.py site0.bench.test --nameserver 127.0.0.1 --dns-port 5353
+"""
+import argparse
+import asyncio
+import random
+import socket
+import struct
+import sys
+import threading
+import time
+
+import dns.exception
+import dns.flags
+import dns.message
+import dns.rcode
+import dns.rdatatype
+import dns.rrset
+
+TTL = 300
+NEGATIVE_TTL = 60
+# Synthetic domains live under a reserved TLD so they can never leak to real resolvers
+BENCH_SUFFIX = 'bench.test'
+
+# (NS host, A prefix, AAAA prefix, MX host, SPF include, DKIM selector) per synthetic provider
+PROFILES = [
+    ('ns{n}.cloudflare.com.', '104.16.{a}.{b}', '2606:4700::{a:x}', 'aspmx.l.google.com.', '_spf.google.com', 'google'),
+    ('ns-{n}.awsdns-{a}.com.', '3.5.{a}.{b}', '2600:1f18::{a:x}', 'mx.{domain}', 'amazonses.com', 'selector1'),
+    ('ns{n}.google.com.', '34.120.{a}.{b}', '2600:1901::{a:x}', 'mx1.{domain}', '_spf.google.com', None),
+    ('dns{n}.p01.nsone.net.', '76.76.{a}.{b}', '2606:4700:10::{a:x}', '{domain}.mail.protection.outlook.com.',
+     'spf.protection.outlook.com', 'selector2'),
+]
+
+# Large receive buffer so bursts from a bulk run queue up instead of being dropped by the kernel
+RECEIVE_BUFFER = 4 * 1024 * 1024
+
+# Qnames a comprehensive analysis always asks for, candidates for a never-answering qname
+TIMEOUT_CANDIDATES = [('{domain}', 'TXT'), ('_dmarc.{domain}', 'TXT'), ('{domain}', 'MX'), ('{domain}', 'CAA')]
+
+
+def fqdn(name):
+    return name.lower().rstrip('.') + '.'
+
+
+class FakeZone:
+    """In-memory records keyed on (fqdn, rdtype), plus the qnames that must never be answered"""
+
+    def __init__(self):
+        self.records = {}
+        self.names = set()
+        self.apexes = set()
+        self.timeouts = set()
+
+    def add(self, name, rdtype, *values):
+        name = fqdn(name)
+        self.records.setdefault((name, rdtype.upper()), []).extend(values)
+        self.names.add(name)
+
+    def add_apex(self, name):
+        name = fqdn(name)
+        self.apexes.add(name)
+        self.add(name, 'SOA', f'ns1.{name} hostmaster.{name} 1 7200 3600 1209600 {NEGATIVE_TTL}')
+
+    def add_timeout(self, name, rdtype):
+        self.timeouts.add((fqdn(name), rdtype.upper()))
+
+    def apex_of(self, name):
+        """Closest enclosing zone apex of name, used for the SOA in negative answers"""
+        labels = name.split('.')
+        for i in range(len(labels)):
+            candidate = '.'.join(labels[i:])
+            if candidate in self.apexes:
+                return candidate
+        return None
+
+
+def synthetic_zone(count, nxdomain=0.0, timeouts=0.0, seed=1, ns_addresses=None):
+    """
+    Build a zone of count domains under BENCH_SUFFIX cycling through PROFILES.
+    A nxdomain fraction of the returned domains do not exist at all, and a timeouts
+    fraction has one commonly queried qname that is never answered.
+    With ns_addresses every nameserver host resolves to them in turn, so the
+    fake server can also stand in for the authoritative servers.
+    Returns (zone, domains).
+    """
+    rng = random.Random(seed)
+    zone = FakeZone()
+    zone.add_apex(BENCH_SUFFIX)
+    domains = []
+    for i in range(count):
+        domain = f'site{i}.{BENCH_SUFFIX}'
+        domains.append(domain)
+        if rng.random() < nxdomain:
+            continue
+        ns, a, aaaa, mx, include, selector = PROFILES[i % len(PROFILES)]
+        octets = {'a': (i >> 8) & 0xff, 'b': i & 0xff, 'domain': domain, 'n': 1}
+        zone.add_apex(domain)
+        hosts = [ns.format(**octets), ns.format(**{**octets, 'n': 2})]
+        zone.add(domain, 'NS', *hosts)
+        for n, host in enumerate(hosts):
+            if ns_addresses and (fqdn(host), 'A') not in zone.records:
+                zone.add(host, 'A', ns_addresses[(i + n) % len(ns_addresses)])
+        zone.add(domain, 'A', a.format(**octets))
+        zone.add(domain, 'AAAA', aaaa.format(**octets))
+        zone.add(domain, 'MX', f'10 {fqdn(mx.format(**octets))}')
+        zone.add(domain, 'CAA', '0 issue "letsencrypt.org"')
+        zone.add(domain, 'TXT', f'"v=spf1 include:{include} ~all"', f'"site-verification={i}"')
+        zone.add(f'_dmarc.{domain}', 'TXT', '"v=DMARC1; p=quarantine"')
+        if selector:
+            zone.add(f'{selector}._domainkey.{domain}', 'TXT', '"v=DKIM1; k=rsa; p=MIGfMA0GCSqGSIb3DQEBAQUAA4GNADCBiQKBgQC"')
+        if rng.random() < timeouts:
+            name, rdtype = rng.choice(TIMEOUT_CANDIDATES)
+            zone.add_timeout(name.format(domain=domain), rdtype)
+    return zone, domains
+
+
+class FakeDNSServer:
+    """
+    Answers queries from a FakeZone on localhost. Every response is delayed by
+    latency plus a uniform jitter, and dropped with probability loss.
+    Runs its own event loop in a background thread so client load doesn't skew its timing.
+    """
+
+    def __init__(self, zone, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, loss=0.0, seed=1):
+        self.zone = zone
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self._rng = random.Random(seed)
+        self._loop = None
+        self._thread = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self.queries = 0
+            self.answered = 0
+            self.dropped = 0
+            self.timed_out = 0
+            self.nxdomain = 0
+            self.truncated = 0
+            self.by_type = {}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "queries": self.queries,
+                "answered": self.answered,
+                "dropped": self.dropped,
+                "timed_out": self.timed_out,
+                "nxdomain": self.nxdomain,
+                "truncated": self.truncated,
+                "by_type": dict(sorted(self.by_type.items()))
+            }
+
+    def answer(self, wire, udp=True):
+        """
+        Response wire for a query, or None when it must go unanswered. UDP responses that
+        exceed the client's EDNS payload size (512 without EDNS) are truncated with TC set.
+        """
+        try:
+            query = dns.message.from_wire(wire)
+            question = query.question[0]
+        except Exception:
+            return None
+        name = question.name.to_text().lower()
+        rdtype = dns.rdatatype.to_text(question.rdtype)
+        with self._lock:
+            self.queries += 1
+            self.by_type[rdtype] = self.by_type.get(rdtype, 0) + 1
+            if (name, rdtype) in self.zone.timeouts:
+                self.timed_out += 1
+                return None
+            if self.loss and self._rng.random() < self.loss:
+                self.dropped += 1
+                return None
+            self.answered += 1
+
+        response = dns.message.make_response(query)
+        response.flags |= dns.flags.AA
+        values = self.zone.records.get((name, rdtype))
+        if values:
+            response.answer.append(dns.rrset.from_text_list(name, TTL, 'IN', rdtype, values))
+        else:
+            if name not in self.zone.names:
+                response.set_rcode(dns.rcode.NXDOMAIN)
+                with self._lock:
+                    self.nxdomain += 1
+            apex = self.zone.apex_of(name)
+            if apex:
+                soa = self.zone.records[(apex, 'SOA')]
+                response.authority.append(dns.rrset.from_text_list(apex, NEGATIVE_TTL, 'IN', 'SOA', soa))
+        if not udp:
+            return response.to_wire()
+        try:
+            return response.to_wire(max_size=query.payload if query.edns >= 0 else 512)
+        except dns.exception.TooBig:
+            with self._lock:
+                self.truncated += 1
+            response.answer.clear()
+            response.authority.clear()
+            response.flags |= dns.flags.TC
+            return response.to_wire()
+
+    def delay(self):
+        return self.latency + (self._rng.uniform(0, self.jitter) if self.jitter else 0)
+
+    def start(self):
+        """Start serving in a background thread and return the bound port"""
+        self._thread = threading.Thread(target=self._run, name='fake-dns', daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self.port
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        server = self
+        loop = self._loop
+
+        class UDPProtocol(asyncio.DatagramProtocol):
+            def connection_made(self, transport):
+                self.transport = transport
+
+            def datagram_received(self, data, addr):
+                wire = server.answer(data)
+                if wire is not None:
+                    loop.call_later(server.delay(), self.transport.sendto, wire, addr)
+
+        async def tcp_connection(reader, writer):
+            # Pipelined: every query is answered after its own delay, so responses go out of order
+            def respond(wire):
+                if not writer.is_closing():
+                    writer.write(struct.pack('!H', len(wire)) + wire)
+
+            try:
+                while True:
+                    length = struct.unpack('!H', await reader.readexactly(2))[0]
+                    wire = server.answer(await reader.readexactly(length), udp=False)
+                    if wire is not None:
+                        loop.call_later(server.delay(), respond, wire)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                pass
+            finally:
+                writer.close()
+
+        udp, _protocol = loop.run_until_complete(
+            loop.create_datagram_endpoint(UDPProtocol, local_addr=(self.host, self.port))
+        )
+        try:
+            udp.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER)
+        except OSError:
+            pass
+        self.port = udp.get_extra_info('sockname')[1]
+        tcp = loop.run_until_complete(asyncio.start_server(tcp_connection, self.host, self.port))
+        self._ready.set()
+        try:
+            loop.run_forever()
+        finally:
+            udp.close()
+            tcp.close()
+            pending = asyncio.all_tasks(loop)
+            for task in pending:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            loop.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in DNS server serving synthetic zones')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5353)
+    parser.add_argument('--domains', type=int, default=100, help='Synthetic domains to serve')
+    parser.add_argument('--latency', type=float, default=0.0, help='Base response latency in milliseconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Extra uniform random latency in milliseconds')
+    parser.add_argument('--loss', type=float, default=0.0, help='Fraction of queries dropped at random')
+    parser.add_argument('--nxdomain', type=float, default=0.0, help='Fraction of domains that do not exist')
+    parser.add_argument('--timeouts', type=float, default=0.0, help='Fraction of domains with one never-answered qname')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--list', default=None, metavar='FILE', help='Write the served domain names to FILE')
+    args = parser.parse_args()
+
+    zone, domains = synthetic_zone(args.domains, args.nxdomain, args.timeouts, args.seed)
+    if args.list:
+        with open(args.list, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(domains) + '\n')
+    server = FakeDNSServer(zone, args.host, args.port, args.latency / 1000, args.jitter / 1000, args.loss, args.seed)
+    port = server.start()
+    print(f"Serving {len(domains)} domains on {args.host}:{port}", file=sys.stderr)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
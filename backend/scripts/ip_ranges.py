@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""
+Compiled IP range table for hosting-provider lookup
+Published cloud IP-range files are compiled once into a sorted binary table of
+non-overlapping [start, end] ranges. At runtime the table is memory-mapped and
+searched by binary search, so loading costs nothing and no JSON is parsed.
+
+Usage:
+  python3 ip_ranges.py fetch -o ip_ranges.bin
+  python3 ip_ranges.py compile --aws ip-ranges.json --cidrs Vercel vercel.txt -o ip_ranges.bin
+  python3 ip_ranges.py lookup ip_ranges.bin 104.16.1.1 2606:4700::1
+
+Layout (all integers big-endian so byte order matches numeric order):
+  header   magic "IPRT", u16 version, u16 reserved, u32 v4 count, u32 v6 count, u32 names length
+  names    NUL-separated UTF-8 provider names, index = provider id
+  v4       count x (u32 start, u32 end, u16 provider id)
+  v6       count x (u128 start, u128 end, u16 provider id)
+"""
+import ipaddress
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+
+MAGIC = b'IPRT'
+VERSION = 1
+HEADER = struct.Struct('>4sHHIII')
+ID = struct.Struct('>H')
+KEY_WIDTH = {4: 4, 6: 16}
+
+IP_RANGES_FILE = os.environ.get(
+    'DNS_IP_RANGES_FILE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ip_ranges.bin')
+)
+
+# Published range files with stable URLs; Azure's weekly ServiceTags file must be passed with --azure
+SOURCES = {
+    'aws': ('AWS', 'https://ip-ranges.amazonaws.com/ip-ranges.json'),
+    'gcp': ('Google Cloud', 'https://www.gstatic.com/ipranges/cloud.json'),
+    'cloudflare-v4': ('Cloudflare', 'https://www.cloudflare.com/ips-v4'),
+    'cloudflare-v6': ('Cloudflare', 'https://www.cloudflare.com/ips-v6'),
+    'github': ('GitHub Pages', 'https://api.github.com/meta'),
+    'oracle': ('Oracle Cloud', 'https://docs.oracle.com/en-us/iaas/tools/public_ip_ranges.json'),
+    'digitalocean': ('DigitalOcean', 'https://digitalocean.com/geo/google.csv'),
+}
+
+
+def parse_aws(text):
+    data = json.loads(text)
+    return [p['ip_prefix'] for p in data.get('prefixes', [])] + \
+        [p['ipv6_prefix'] for p in data.get('ipv6_prefixes', [])]
+
+
+def parse_gcp(text):
+    data = json.loads(text)
+    return [p.get('ipv4Prefix') or p.get('ipv6Prefix') for p in data.get('prefixes', [])
+            if p.get('ipv4Prefix') or p.get('ipv6Prefix')]
+
+
+def parse_azure(text):
+    data = json.loads(text)
+    cidrs = []
+    for value in data.get('values', []):
+        cidrs.extend(value.get('properties', {}).get('addressPrefixes', []))
+    return cidrs
+
+
+def parse_github(text):
+    # Only GitHub Pages ranges identify web hosting
+    return json.loads(text).get('pages', [])
+
+
+def parse_oracle(text):
+    data = json.loads(text)
+    return [cidr['cidr'] for region in data.get('regions', []) for cidr in region.get('cidrs', [])]
+
+
+def parse_csv(text):
+    # First column holds the prefix (DigitalOcean geo feed and similar)
+    return [line.split(',', 1)[0].strip() for line in text.splitlines() if line.strip()]
+
+
+def parse_plain(text):
+    """One CIDR per line, # starts a comment"""
+    return [line.split('#', 1)[0].strip() for line in text.splitlines() if line.split('#', 1)[0].strip()]
+
+
+PARSERS = {
+    'aws': parse_aws,
+    'gcp': parse_gcp,
+    'azure': parse_azure,
+    'cloudflare-v4': parse_plain,
+    'cloudflare-v6': parse_plain,
+    'github': parse_github,
+    'oracle': parse_oracle,
+    'digitalocean': parse_csv,
+}
+
+
+def flatten(entries):
+    """
+    Turn (network, provider) pairs into sorted non-overlapping (version, start, end, provider)
+    ranges. CIDR blocks are either nested or disjoint, so a stack sweep suffices: the most
+    specific block wins and, for identical blocks, the entry listed last.
+    """
+    ordered = sorted(
+        ((network.version, int(network.network_address), network.prefixlen, position, provider)
+         for position, (network, provider) in enumerate(entries)),
+        key=lambda e: (e[0], e[1], e[2], -e[3])
+    )
+    ranges = []
+
+    def emit(version, start, end, provider):
+        if start > end:
+            return
+        last = ranges[-1] if ranges else None
+        if last and last[0] == version and last[3] == provider and last[2] + 1 == start:
+            ranges[-1] = (version, last[1], end, provider)
+        else:
+            ranges.append((version, start, end, provider))
+
+    stack = []  # (version, start, end, provider, next uncovered address)
+    previous = None
+    for version, start, prefixlen, _position, provider in ordered:
+        if previous == (version, start, prefixlen):
+            continue  # identical block already placed, the later entry sorted first
+        previous = (version, start, prefixlen)
+        width = 32 if version == 4 else 128
+        end = start + (1 << (width - prefixlen)) - 1
+        while stack and (stack[-1][0] != version or stack[-1][2] < start):
+            top = stack.pop()
+            emit(top[0], top[4], top[2], top[3])
+            if stack:
+                stack[-1] = stack[-1][:4] + (top[2] + 1,)
+        if stack:
+            top = stack[-1]
+            emit(top[0], top[4], start - 1, top[3])
+            stack[-1] = top[:4] + (end + 1,)
+        stack.append((version, start, end, provider, start))
+    while stack:
+        top = stack.pop()
+        emit(top[0], top[4], top[2], top[3])
+        if stack:
+            stack[-1] = stack[-1][:4] + (top[2] + 1,)
+    return ranges
+
+
+def write_table(entries, path):
+    """Compile (cidr, provider) pairs into the binary table at path"""
+    networks = []
+    for cidr, provider in entries:
+        try:
+            networks.append((ipaddress.ip_network(cidr, strict=False), provider))
+        except ValueError:
+            continue
+    ranges = flatten(networks)
+    names = sorted({provider for _v, _s, _e, provider in ranges})
+    ids = {name: i for i, name in enumerate(names)}
+    names_blob = b'\0'.join(name.encode('utf-8') for name in names)
+    v4 = [r for r in ranges if r[0] == 4]
+    v6 = [r for r in ranges if r[0] == 6]
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, len(v4), len(v6), len(names_blob)))
+        f.write(names_blob)
+        for version, records in ((4, v4), (6, v6)):
+            width = KEY_WIDTH[version]
+            for _v, start, end, provider in records:
+                f.write(start.to_bytes(width, 'big') + end.to_bytes(width, 'big') + ID.pack(ids[provider]))
+    os.replace(tmp_path, path)
+    return {"ipv4_ranges": len(v4), "ipv6_ranges": len(v6), "providers": len(names)}
+
+
+class IPRangeTable:
+    """Memory-mapped view of a compiled table; lookup() is a binary search over the mapped bytes"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mm) < HEADER.size:
+            self._mm.close()
+            raise ValueError(f"{path} is too short for an IP range table")
+        magic, version, _reserved, n4, n6, names_len = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self._mm.close()
+            raise ValueError(f"{path} is not a version {VERSION} IP range table")
+        size = HEADER.size + names_len + n4 * (2 * KEY_WIDTH[4] + ID.size) + n6 * (2 * KEY_WIDTH[6] + ID.size)
+        actual = len(self._mm)
+        if actual != size:
+            self._mm.close()
+            # A truncated or padded file would make lookup() read past the records
+            raise ValueError(f"{path} is {actual} bytes, its header describes {size}")
+        offset = HEADER.size
+        self.names = self._mm[offset:offset + names_len].decode('utf-8').split('\0') if names_len else []
+        offset += names_len
+        self._sections = {4: (offset, n4), 6: (offset + n4 * (2 * 4 + ID.size), n6)}
+
+    def __len__(self):
+        return self._sections[4][1] + self._sections[6][1]
+
+    def lookup(self, address):
+        """Provider name for address, None when no published range contains it"""
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            return None
+        width = KEY_WIDTH[ip.version]
+        key = ip.packed
+        offset, count = self._sections[ip.version]
+        record = 2 * width + ID.size
+        mm = self._mm
+        # Last range whose start <= key
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = offset + mid * record
+            if mm[start:start + width] <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0:
+            return None
+        start = offset + (lo - 1) * record
+        if key > mm[start + width:start + 2 * width]:
+            return None
+        return self.names[ID.unpack_from(mm, start + 2 * width)[0]]
+
+    def close(self):
+        self._mm.close()
+
+
+_table = None
+_table_loaded = False
+_table_lock = threading.Lock()
+
+
+def ip_range_table():
+    """Process-wide compiled table from IP_RANGES_FILE, or None when it has not been built"""
+    global _table, _table_loaded
+    with _table_lock:
+        if not _table_loaded:
+            _table_loaded = True
+            if os.path.exists(IP_RANGES_FILE):
+                try:
+                    _table = IPRangeTable(IP_RANGES_FILE)
+                except (OSError, ValueError) as e:
+                    print(f"Ignoring IP range table {IP_RANGES_FILE}: {e}", file=sys.stderr)
+        return _table
+
+
+def private_entries():
+    """
+    Private ranges from providers.json. Its ip_ranges (providers without a published range
+    file) are not compiled in: ProviderIndex falls back to them for addresses the table misses.
+    """
+    from provider_index import PRIVATE, PROVIDERS_FILE
+    with open(PROVIDERS_FILE, encoding='utf-8') as f:
+        data = json.load(f)
+    return [(cidr, PRIVATE) for cidr in data.get("private_ranges", [])]
+
+
+def fetch(url, timeout=30):
+    import urllib.request
+    request = urllib.request.Request(url, headers={'User-Agent': 'dns-individual-ip-ranges'})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return response.read().decode('utf-8')
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Compile and query the hosting-provider IP range table')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    compile_parser = sub.add_parser('compile', help='Compile local range files')
+    fetch_parser = sub.add_parser('fetch', help='Download the published range files and compile them')
+    for p in (compile_parser, fetch_parser):
+        p.add_argument('-o', '--output', default=IP_RANGES_FILE, help='Table file to write')
+        p.add_argument('--cidrs', nargs=2, action='append', default=[], metavar=('PROVIDER', 'FILE'),
+                       help='Extra plain CIDR list for PROVIDER, one range per line')
+        p.add_argument('--azure', default=None, metavar='FILE', help='Azure ServiceTags_Public JSON file')
+    for source in SOURCES:
+        compile_parser.add_argument(f'--{source}', default=None, metavar='FILE', help=f'{SOURCES[source][0]} range file')
+
+    lookup_parser = sub.add_parser('lookup', help='Look up addresses in a compiled table')
+    lookup_parser.add_argument('table')
+    lookup_parser.add_argument('addresses', nargs='+')
+
+    args = parser.parse_args()
+
+    if args.command == 'lookup':
+        table = IPRangeTable(args.table)
+        print(json.dumps({address: table.lookup(address) for address in args.addresses}, indent=2))
+        return
+
+    entries = []
+    if args.command == 'fetch':
+        for source, (provider, url) in SOURCES.items():
+            try:
+                entries += [(cidr, provider) for cidr in PARSERS[source](fetch(url))]
+            except Exception as e:
+                print(f"Skipping {source}: {e}", file=sys.stderr)
+        if not entries:
+            # A table of private ranges only would hide every provider the providers.json prefixes know
+            parser.exit(1, "No range file could be fetched, not writing a table\n")
+    else:
+        for source, (provider, _url) in SOURCES.items():
+            path = getattr(args, source.replace('-', '_'))
+            if path:
+                with open(path, encoding='utf-8') as f:
+                    entries += [(cidr, provider) for cidr in PARSERS[source](f.read())]
+    if args.azure:
+        with open(args.azure, encoding='utf-8') as f:
+            entries += [(cidr, 'Microsoft Azure') for cidr in parse_azure(f.read())]
+    for provider, path in args.cidrs:
+        with open(path, encoding='utf-8') as f:
+            entries += [(cidr, provider) for cidr in parse_plain(f.read())]
+    if not entries:
+        parser.exit(1, "No provider ranges given, not writing a table\n")
+    entries += private_entries()
+
+    print(json.dumps(write_table(entries, args.output)))
+
+
+if __name__ == "__main__":
+    main()
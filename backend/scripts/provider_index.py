@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Compiled provider-detection index
+providers.json is loaded once into Aho-Corasick automatons for NS/TXT/CNAME substrings
+and a CIDR radix tree for IP ranges, so detection costs O(total input length) per call.
+Providers are listed in priority order: when several match, the earliest entry wins.
+"""
+import functools
+import ipaddress
+import json
+import os
+import threading
+from collections import deque
+
+from ip_ranges import ip_range_table
+
+# Per-string memo size; bulk runs see the same nameservers, CNAME targets and IPs over and over
+MEMO_SIZE = 65536
+
+PROVIDERS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'providers.json')
+
+# TXT token carrying an explicit provider name, checked before any provider pattern
+HOSTING_SITE_TOKEN = 'hosting-site='
+
+
+class AhoCorasick:
+    """Multi-pattern substring matcher; find() returns the values of every pattern in the text"""
+
+    def __init__(self, patterns):
+        # Node arrays: goto transitions, failure link, values of patterns ending here
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        for pattern, value in patterns:
+            self._add(pattern, value)
+        self._build()
+
+    def _add(self, pattern, value):
+        node = 0
+        for char in pattern:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+                self._goto[node][char] = next_node
+            node = next_node
+        self._out[node].append(value)
+
+    def _build(self):
+        # Breadth-first from the depth-1 nodes, which already fail to the root.
+        # Failure links are folded into the transition table (a DFA), so find() does
+        # exactly one dict lookup per input character.
+        self._delta = [dict(self._goto[0])] + [None] * (len(self._goto) - 1)
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            fail = self._fail[node]
+            self._delta[node] = {**self._delta[fail], **self._goto[node]}
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                self._fail[child] = self._delta[fail].get(char, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+        self._out = [tuple(values) for values in self._out]
+
+    def find(self, text):
+        """Set of values whose pattern occurs in text"""
+        found = set()
+        node = 0
+        delta, out = self._delta, self._out
+        for char in text:
+            node = delta[node].get(char, 0)
+            if out[node]:
+                found.update(out[node])
+        return frozenset(found)
+
+
+class CIDRTrie:
+    """Binary radix tree over address bits with longest-prefix-match lookup, IPv4 and IPv6"""
+
+    def __init__(self):
+        self._roots = {4: {}, 6: {}}
+
+    def insert(self, cidr, value):
+        network = ipaddress.ip_network(cidr, strict=False)
+        bits = int(network.network_address)
+        width = network.max_prefixlen
+        node = self._roots[network.version]
+        for i in range(network.prefixlen):
+            bit = (bits >> (width - 1 - i)) & 1
+            node = node.setdefault(bit, {})
+        node['value'] = value
+
+    def lookup(self, address):
+        """Value of the longest prefix containing address, None if no range matches"""
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            return None
+        bits = int(ip)
+        width = ip.max_prefixlen
+        node = self._roots[ip.version]
+        best = node.get('value')
+        for i in range(width):
+            node = node.get((bits >> (width - 1 - i)) & 1)
+            if node is None:
+                break
+            if 'value' in node:
+                best = node['value']
+        return best
+
+
+PRIVATE = 'private'
+
+
+class ProviderIndex:
+    """Provider database compiled for fast detection"""
+
+    def __init__(self, data, ip_table=None):
+        self.version = data.get("version")
+        # Compiled published ranges (ip_ranges.py) are consulted first; addresses they miss fall back to
+        # the providers.json ip_ranges, which only list providers that publish no range file
+        self.ip_table = ip_table
+        self.dns_names = [entry["name"] for entry in data["dns_providers"]]
+        self.dns_matcher = AhoCorasick(
+            (pattern.lower(), rank)
+            for rank, entry in enumerate(data["dns_providers"])
+            for pattern in entry["patterns"]
+        )
+        hosting = data["hosting_providers"]
+        self.txt_names = [entry["name"] for entry in hosting["txt"]]
+        # Rank -1 is the hosting-site= token, which outranks every provider pattern
+        self.txt_matcher = AhoCorasick(
+            [(HOSTING_SITE_TOKEN, -1)] + [
+                (pattern.lower(), rank)
+                for rank, entry in enumerate(hosting["txt"])
+                for pattern in entry["patterns"]
+            ]
+        )
+        self.cname_names = [entry["name"] for entry in hosting["cname"]]
+        self.cname_matcher = AhoCorasick(
+            (pattern.lower(), rank)
+            for rank, entry in enumerate(hosting["cname"])
+            for pattern in entry["patterns"]
+        )
+        self.ip_ranges = CIDRTrie()
+        for entry in hosting["ip_ranges"]:
+            for cidr in entry["cidrs"]:
+                self.ip_ranges.insert(cidr, entry["name"])
+        # Private ranges are inserted last so they take precedence on equal prefixes
+        for cidr in data.get("private_ranges", []):
+            self.ip_ranges.insert(cidr, PRIVATE)
+        self._ns_ranks = functools.lru_cache(maxsize=MEMO_SIZE)(self.dns_matcher.find)
+        self.cname_provider = functools.lru_cache(maxsize=MEMO_SIZE)(self.cname_provider)
+        self.ip_provider = functools.lru_cache(maxsize=MEMO_SIZE)(self.ip_provider)
+
+    @classmethod
+    def load(cls, path=PROVIDERS_FILE, ip_table=None):
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f), ip_table)
+
+    def dns_provider(self, ns_records):
+        """Highest-priority DNS provider matched by any NS record, or None"""
+        ranks = set()
+        for ns in ns_records:
+            ranks |= self._ns_ranks(ns.lower())
+        return self.dns_names[min(ranks)] if ranks else None
+
+    def txt_provider(self, txt):
+        """(rank, name) of the best provider matched in one TXT string, rank -1 for hosting-site="""
+        ranks = self.txt_matcher.find(txt.lower())
+        if not ranks:
+            return None
+        rank = min(ranks)
+        return rank, (self.txt_names[rank] if rank >= 0 else None)
+
+    def cname_provider(self, cname):
+        """Best provider matched in one CNAME target, or None"""
+        ranks = self.cname_matcher.find(cname.lower())
+        return self.cname_names[min(ranks)] if ranks else None
+
+    def ip_provider(self, ip):
+        """Provider owning ip, PRIVATE for private ranges, None if unknown"""
+        if self.ip_table is not None:
+            provider = self.ip_table.lookup(ip)
+            if provider is not None:
+                return provider
+        return self.ip_ranges.lookup(ip)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def provider_index():
+    """Process-wide ProviderIndex, compiled on first use"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = ProviderIndex.load(ip_table=ip_range_table())
+        return _index
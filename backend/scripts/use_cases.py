@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Static use-case metadata for dns_individual.py
+The Goal/Purpose/Expected/Notes text of every record type lives in one versioned
+table. Analyzers build their use_cases from it, and compact output formats send
+only the dynamic fields, leaving clients to join the table back in by record type.
+"""
+import copy
+
+# Bump whenever any text below changes so clients holding an old table refetch it
+METADATA_VERSION = 1
+METADATA_FIELDS = ("Goal", "Purpose", "Expected", "Notes")
+
+USE_CASE_METADATA = {
+    "A": {
+        "Goal": "Email deliverability",
+        "Purpose": "Maps domain → IPv4 address",
+        "Expected": "Ensure points to correct web server IP",
+        "Notes": "A record is required for email deliverability"
+    },
+    "AAAA": {
+        "Goal": "IPv6 support",
+        "Purpose": "Maps domain → IPv6 address",
+        "Expected": "IPv6 address for modern connectivity",
+        "Notes": "Optional but recommended for future-proofing"
+    },
+    "CNAME": {
+        "Goal": "Domain aliasing",
+        "Purpose": "Maps domain → another domain",
+        "Expected": "Points to target domain for redirection",
+        "Notes": "Cannot coexist with A record for same domain"
+    },
+    "MX": {
+        "Goal": "Email routing",
+        "Purpose": "Maps domain → mail servers",
+        "Expected": "List of mail servers in priority order",
+        "Notes": "Essential for email delivery"
+    },
+    "NS": {
+        "Goal": "DNS delegation",
+        "Purpose": "Maps domain → authoritative name servers",
+        "Expected": "List of authoritative DNS servers",
+        "Notes": "Required for domain to function"
+    },
+    "SOA": {
+        "Goal": "Zone authority",
+        "Purpose": "Defines zone parameters and authority",
+        "Expected": "Zone start of authority information",
+        "Notes": "Required for DNS zone management"
+    },
+    "CAA": {
+        "Goal": "Certificate authority authorization",
+        "Purpose": "Specifies allowed CAs for SSL certificates",
+        "Expected": "List of authorized certificate authorities",
+        "Notes": "Security measure for SSL certificate issuance"
+    },
+    "TXT": {
+        "Goal": "Text information",
+        "Purpose": "Stores text-based information",
+        "Expected": "Various text records for verification and configuration",
+        "Notes": "Used for SPF, DMARC, verification codes, etc."
+    },
+    "SPF": {
+        "Goal": "Email authentication",
+        "Purpose": "Prevents email spoofing",
+        "Expected": "v=spf1 directive with authorized servers",
+        "Notes": "Essential for email deliverability"
+    },
+    "DMARC": {
+        "Goal": "Email authentication policy",
+        "Purpose": "Defines email authentication policy",
+        "Expected": "v=DMARC1 directive with policy settings",
+        "Notes": "Advanced email security and reporting"
+    },
+    "DKIM": {
+        "Goal": "Email authentication",
+        "Purpose": "Digital signature for email verification",
+        "Expected": "v=DKIM1 directive with public key",
+        "Notes": "Advanced email authentication method"
+    },
+}
+
+
+def use_case(record_type, status="Not present", records=None) -> dict:
+    """New use_case entry for record_type: static metadata followed by Status and records"""
+    case = dict(USE_CASE_METADATA[record_type])
+    case["Status"] = status
+    case["records"] = records if records is not None else []
+    return case
+
+
+def metadata_table() -> dict:
+    """The versioned table, as sent to clients of the compact formats"""
+    return {"version": METADATA_VERSION, "use_cases": copy.deepcopy(USE_CASE_METADATA)}
+
+
+def strip_use_case(record_type, case) -> dict:
+    """Dynamic fields of one use_case entry; metadata is dropped only where it matches the table"""
+    static = USE_CASE_METADATA.get(record_type, {})
+    return {key: value for key, value in case.items() if not (key in METADATA_FIELDS and static.get(key) == value)}
+
+
+def strip_metadata(result) -> dict:
+    """
+    Copy of result whose use_cases carry only dynamic fields. Metadata is dropped only where
+    it matches the table, so anything unexpected still reaches the client.
+    """
+    use_cases = result.get("use_cases")
+    if not isinstance(use_cases, dict):
+        return result
+    compact = dict(result)
+    compact["use_cases"] = {record_type: strip_use_case(record_type, case) for record_type, case in use_cases.items()}
+    compact["metadata_version"] = METADATA_VERSION
+    return compact
+
+
+def strip_event(event) -> dict:
+    """strip_metadata for one streamed {"event": "use_case"}, other events pass through unchanged"""
+    if event.get("event") != "use_case" or not isinstance(event.get("use_case"), dict):
+        return event
+    compact = dict(event)
+    compact["use_case"] = strip_use_case(event["record_type"], event["use_case"])
+    compact["metadata_version"] = METADATA_VERSION
+    return compact
+
+
+def expand_metadata(result, table=None) -> dict:
+    """Inverse of strip_metadata: join the table's metadata back into each use_case"""
+    metadata = (table or metadata_table())["use_cases"]
+    expanded = {key: value for key, value in result.items() if key != "metadata_version"}
+    expanded["use_cases"] = {
+        record_type: {**metadata.get(record_type, {}), **case}
+        for record_type, case in result.get("use_cases", {}).items()
+    }
+    return expanded
@@ -42,6 +42,11 @@ const config = {
   DNS_TIMEOUT: parseInt(process.env.DNS_TIMEOUT) || 10000,
   DNS_RETRIES: parseInt(process.env.DNS_RETRIES) || 3,
   
+  // Python validator worker pool (0 spawns one python3 process per request)
+  PYTHON_WORKER_POOL_SIZE: process.env.PYTHON_WORKER_POOL_SIZE !== undefined ? parseInt(process.env.PYTHON_WORKER_POOL_SIZE) : 2,
+  PYTHON_WORKER_CONCURRENCY: parseInt(process.env.PYTHON_WORKER_CONCURRENCY) || 64,
+  PYTHON_WORKER_REQUEST_TIMEOUT: parseInt(process.env.PYTHON_WORKER_REQUEST_TIMEOUT) || 60000,
+  
   // Logging
   LOG_LEVEL: process.env.LOG_LEVEL || 'info',
   
@@ -196,4 +196,70 @@ export const analyzeIndividualDNSRecord = asyncHandler(async (req, res) => {
     return sendSuccessResponse(res, analysisData);
   }
   return sendSuccessResponse(res, result);
-}); 
\ No newline at end of file
+}); 
+
+// Phân tích toàn bộ dạng stream: NDJSON, mỗi dòng là một use case ngay khi có kết quả,
+// dòng cuối là summary (provider, published flags)
+export const streamIndividualDNSRecord = asyncHandler(async (req, res) => {
+  const userId = req.user.id;
+  const { domain } = req.params;
+  const { no_save } = req.query;
+
+  if (!userId) {
+    throw new AuthenticationError('User not authenticated');
+  }
+
+  if (!domain) {
+    throw new ValidationError('Domain name is required');
+  }
+
+  const now = new Date();
+  const shouldSave = no_save !== 'true';
+  const use_cases = {};
+
+  res.status(200);
+  res.setHeader('Content-Type', 'application/x-ndjson; charset=utf-8');
+  res.setHeader('Cache-Control', 'no-cache');
+  res.setHeader('X-Accel-Buffering', 'no');
+  res.flushHeaders();
+
+  try {
+    const summary = await pythonDomainValidatorService.streamIndividualDNSRecord(domain, (event) => {
+      use_cases[event.record_type] = {
+        ...event.use_case,
+        createdAt: now,
+        updatedAt: now
+      };
+      res.write(JSON.stringify({ ...event, use_case: use_cases[event.record_type] }) + '\n');
+    });
+    use_cases.createdAt = now;
+    use_cases.updatedAt = now;
+    const analysisData = {
+      domain: summary.domain,
+      dns_provider: summary.dns_provider,
+      hosting_provider: summary.hosting_provider,
+      dns_record_published: summary.dns_record_published,
+      dmarc_record_published: summary.dmarc_record_published,
+      spf_record_published: summary.spf_record_published,
+      status: summary.status,
+      createdAt: now,
+      updatedAt: now,
+      use_cases
+    };
+
+    if (shouldSave) {
+      await DNSAnalysis.create({
+        domain_name: summary.domain,
+        user_id: userId,
+        analysis_data: analysisData
+      });
+    }
+
+    const { use_cases: _, ...overview } = analysisData;
+    res.write(JSON.stringify({ event: 'summary', ...overview, success: summary.success }) + '\n');
+  } catch (error) {
+    // Headers are already sent, report the failure in the stream itself
+    res.write(JSON.stringify({ event: 'error', domain, success: false, error: error.message }) + '\n');
+  }
+  res.end();
+});
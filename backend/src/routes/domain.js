@@ -3,13 +3,16 @@ import {
   getUserDomains, 
   addDomain, 
   deleteDomain, 
-  analyzeIndividualDNSRecord
+  analyzeIndividualDNSRecord,
+  streamIndividualDNSRecord
 } from '../controllers/domainController.js';
 import { auth } from '../middleware/auth.js';
 
 const router = express.Router();
 
 router.get('/dns/records/:domain/individual', auth, analyzeIndividualDNSRecord);
+// Same analysis streamed as NDJSON, one line per record type as soon as it completes
+router.get('/dns/records/:domain/individual/stream', auth, streamIndividualDNSRecord);
 // Get user's domains
 router.get('/', auth, getUserDomains);
 // Add new domain
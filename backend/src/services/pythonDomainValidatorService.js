@@ -1,4 +1,12 @@
 import { spawn } from 'child_process';
+import readline from 'readline';
+import config from '../config.js';
+import PythonWorkerPool from './pythonWorkerPool.js';
+
+const PYTHON_SCRIPTS_DIR = 'scripts';
+const PYTHON_MODULE = 'dns_individual';
+// Run as a module: its bytecode is then cached in __pycache__, a script is recompiled on every start
+const PYTHON_ENTRY = ['-m', PYTHON_MODULE];
 
 class PythonDomainValidatorService {
   constructor() {
@@ -6,6 +14,16 @@ class PythonDomainValidatorService {
       return PythonDomainValidatorService.instance;
     }
     PythonDomainValidatorService.instance = this;
+    this.workerPool = new PythonWorkerPool({
+      module: PYTHON_MODULE,
+      cwd: PYTHON_SCRIPTS_DIR,
+      size: config.PYTHON_WORKER_POOL_SIZE,
+      concurrency: config.PYTHON_WORKER_CONCURRENCY,
+      requestTimeout: config.PYTHON_WORKER_REQUEST_TIMEOUT
+    });
+    // Analyses in flight by domain and record type, shared by concurrent callers
+    this.inFlightAnalyses = new Map();
+    this.coalescing = { leaders: 0, coalesced: 0 };
   }
 
   // Domain validation using Python script
@@ -144,7 +162,29 @@ class PythonDomainValidatorService {
     }
   }
 
+  // Concurrent calls for the same domain and record type (a double-clicked refresh, many users
+  // adding a popular domain) share one run whichever pool worker would have taken them; every
+  // caller gets its own copy of the result, the controllers decorate it before saving
   async analyzeIndividualDNSRecord(domain, record_type) {
+    const key = `${domain.toLowerCase()}|${(record_type || '').toUpperCase()}`;
+    let analysis = this.inFlightAnalyses.get(key);
+    if (analysis) {
+      this.coalescing.coalesced += 1;
+    } else {
+      this.coalescing.leaders += 1;
+      analysis = this.runIndividualDNSRecord(domain, record_type).finally(() => {
+        this.inFlightAnalyses.delete(key);
+      });
+      this.inFlightAnalyses.set(key, analysis);
+    }
+    return structuredClone(await analysis);
+  }
+
+  getCoalescingStats() {
+    return { in_flight: this.inFlightAnalyses.size, ...this.coalescing };
+  }
+
+  async runIndividualDNSRecord(domain, record_type) {
     try {
       // If record_type is null, run comprehensive analysis
       if (!record_type) {
@@ -178,13 +218,103 @@ class PythonDomainValidatorService {
     }
   }
 
+  // Comprehensive analysis reported per record type: onEvent receives each use_case event
+  // ({ record_type, use_case, ... }) as soon as its lookup completes, the promise resolves to
+  // the summary event with the providers and published flags
+  async streamIndividualDNSRecord(domain, onEvent) {
+    if (!this.workerPool.enabled) {
+      return this.spawnPythonStream(domain, onEvent);
+    }
+    // Expansion may have to fetch the metadata table, chain it so events stay in order
+    let delivered = Promise.resolve();
+    const summary = await this.workerPool.requestStream({ domain, format: 'compact' }, (event) => {
+      delivered = delivered.then(() => this.expandUseCaseEvent(event)).then(onEvent);
+    });
+    await delivered;
+    return summary;
+  }
+
   async runPythonTest(domain, testType = 'individual', record_type = null, spf_record = null, dmarc_record = null) {
+    if (this.workerPool.enabled) {
+      return this.runPooledTest(domain, testType, record_type);
+    }
+    return this.spawnPythonTest(domain, testType, record_type);
+  }
+
+  // Static use-case metadata the compact worker results refer to, fetched once per service
+  getUseCaseMetadata() {
+    if (!this.useCaseMetadata) {
+      this.useCaseMetadata = this.workerPool.request({ op: 'metadata' }).catch((error) => {
+        this.useCaseMetadata = null;
+        throw error;
+      });
+    }
+    return this.useCaseMetadata;
+  }
+
+  // The metadata table of the given version, refetched when the workers have moved on
+  async metadataFor(version) {
+    let metadata = await this.getUseCaseMetadata();
+    if (metadata.version !== version) {
+      this.useCaseMetadata = null;
+      metadata = await this.getUseCaseMetadata();
+    }
+    return metadata;
+  }
+
+  // Join the metadata table back into a compact result so callers see the full use_cases
+  async expandUseCases(result) {
+    if (!result || result.metadata_version === undefined) {
+      return result;
+    }
+    const metadata = await this.metadataFor(result.metadata_version);
+    const { metadata_version, ...expanded } = result;
+    expanded.use_cases = Object.fromEntries(
+      Object.entries(result.use_cases || {}).map(([recordType, useCase]) => [
+        recordType,
+        { ...(metadata.use_cases[recordType] || {}), ...useCase }
+      ])
+    );
+    return expanded;
+  }
+
+  // Same as expandUseCases for one streamed use_case event
+  async expandUseCaseEvent(event) {
+    if (event.metadata_version === undefined) {
+      return event;
+    }
+    const metadata = await this.metadataFor(event.metadata_version);
+    const { metadata_version, ...expanded } = event;
+    expanded.use_case = { ...(metadata.use_cases[event.record_type] || {}), ...event.use_case };
+    return expanded;
+  }
+
+  // Send the request to a warm worker instead of starting a new interpreter
+  async runPooledTest(domain, testType, record_type) {
+    try {
+      const compact = await this.workerPool.request({ domain, test_type: record_type, format: 'compact' });
+      const result = await this.expandUseCases(compact);
+      return {
+        success: true,
+        test_type: testType,
+        domain: domain,
+        result: result
+      };
+    } catch (error) {
+      throw {
+        success: false,
+        test_type: testType,
+        domain: domain,
+        error: error.message
+      };
+    }
+  }
+
+  async spawnPythonTest(domain, testType, record_type) {
     return new Promise((resolve, reject) => {
       let args;
       
-      // Use dns_individual.py script for all tests
-      const pythonScript = 'scripts/dns_individual.py';
-      
+      // Use dns_individual.py for all tests
       if (record_type) {
         // Individual record type analysis
         args = [domain, '--test-type', record_type];
@@ -193,7 +323,7 @@ class PythonDomainValidatorService {
         args = [domain];
       }
       
-      const pythonProcess = spawn('python3', [pythonScript, ...args]);
+      const pythonProcess = spawn('python3', [...PYTHON_ENTRY, ...args], { cwd: PYTHON_SCRIPTS_DIR });
       
       let output = '';
       let errorOutput = '';
@@ -247,6 +377,43 @@ class PythonDomainValidatorService {
       });
     });
   }
+
+  // Streamed analysis without the worker pool: one process per domain, read line by line
+  spawnPythonStream(domain, onEvent) {
+    return new Promise((resolve, reject) => {
+      const pythonProcess = spawn('python3', [...PYTHON_ENTRY, domain, '--stream'], { cwd: PYTHON_SCRIPTS_DIR });
+      let summary = null;
+      let errorOutput = '';
+
+      readline.createInterface({ input: pythonProcess.stdout }).on('line', (line) => {
+        let event;
+        try {
+          event = JSON.parse(line);
+        } catch (error) {
+          return;
+        }
+        if (event.event === 'summary') {
+          summary = event;
+        } else {
+          onEvent(event);
+        }
+      });
+
+      pythonProcess.stderr.on('data', (data) => {
+        errorOutput += data.toString();
+      });
+
+      pythonProcess.on('close', (code) => {
+        if (code === 0 && summary) {
+          resolve(summary);
+        } else {
+          reject(new Error(errorOutput || 'Python script execution failed'));
+        }
+      });
+
+      pythonProcess.on('error', reject);
+    });
+  }
 }
 
 // Create and export singleton instance
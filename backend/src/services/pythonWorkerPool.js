@@ -0,0 +1,109 @@
+import { spawn } from 'child_process';
+import readline from 'readline';
+
+// Pool of warm `dns_individual.py --serve` processes speaking JSON-lines on stdin/stdout
+class PythonWorkerPool {
+  constructor({ script, module = null, cwd = undefined, size = 2, concurrency = 64, requestTimeout = 60000 }) {
+    this.script = script;
+    this.module = module;
+    this.cwd = cwd;
+    this.size = size;
+    this.concurrency = concurrency;
+    this.requestTimeout = requestTimeout;
+    this.workers = [];
+    this.nextId = 1;
+  }
+
+  get enabled() {
+    return this.size > 0;
+  }
+
+  startWorker() {
+    const entry = this.module ? ['-m', this.module] : [this.script];
+    const proc = spawn('python3', [...entry, '--serve', '--workers', String(this.concurrency)], { cwd: this.cwd });
+    const worker = { proc, pending: new Map(), alive: true, stderr: '' };
+
+    readline.createInterface({ input: proc.stdout }).on('line', (line) => {
+      let response;
+      try {
+        response = JSON.parse(line);
+      } catch (error) {
+        return;
+      }
+      const entry = worker.pending.get(response.id);
+      if (!entry) {
+        return;
+      }
+      // Streamed requests report events before their closing response
+      if (response.event !== undefined) {
+        entry.onEvent?.(response.event);
+        return;
+      }
+      worker.pending.delete(response.id);
+      clearTimeout(entry.timer);
+      if (response.success) {
+        entry.resolve(response.result);
+      } else {
+        entry.reject(new Error(response.error || 'Python worker request failed'));
+      }
+    });
+
+    proc.stderr.on('data', (data) => {
+      // Keep only the tail for error reporting
+      worker.stderr = (worker.stderr + data.toString()).slice(-4096);
+    });
+
+    const fail = (message) => {
+      worker.alive = false;
+      this.workers = this.workers.filter((w) => w !== worker);
+      for (const entry of worker.pending.values()) {
+        clearTimeout(entry.timer);
+        entry.reject(new Error(message));
+      }
+      worker.pending.clear();
+    };
+
+    // Writes to a dead worker surface through the 'exit' handler below
+    proc.stdin.on('error', () => {});
+    proc.on('exit', (code) => fail(worker.stderr || `Python worker exited with code ${code}`));
+    proc.on('error', (error) => fail(error.message));
+
+    this.workers.push(worker);
+    return worker;
+  }
+
+  pickWorker() {
+    // Fill the pool lazily, then route to the least busy live worker
+    if (this.workers.length < this.size) {
+      return this.startWorker();
+    }
+    return this.workers.reduce((best, w) => (w.pending.size < best.pending.size ? w : best));
+  }
+
+  request(payload, onEvent = null) {
+    return new Promise((resolve, reject) => {
+      const worker = this.pickWorker();
+      const id = this.nextId++;
+      const timer = setTimeout(() => {
+        worker.pending.delete(id);
+        reject(new Error('Python worker request timed out'));
+      }, this.requestTimeout);
+      worker.pending.set(id, { resolve, reject, timer, onEvent });
+      worker.proc.stdin.write(JSON.stringify({ id, ...payload }) + '\n');
+    });
+  }
+
+  // Streamed comprehensive analysis: onEvent gets each use_case event, the promise the summary
+  requestStream(payload, onEvent) {
+    return this.request({ ...payload, stream: true }, onEvent);
+  }
+
+  shutdown() {
+    for (const worker of this.workers) {
+      worker.proc.stdin.end();
+    }
+    this.workers = [];
+  }
+}
+
+export default PythonWorkerPool;
@@ -0,0 +1,31 @@
+import asyncio
+import threading
+
+from dns_bulk import read_domains, run_batch
+
+
+def test_read_domains_normalizes_and_skips_comments():
+    lines = ['Example.COM.\n', '\n', '# comment\n', 'b.example  # trailing\n']
+    assert list(read_domains(lines)) == ['example.com', 'b.example']
+
+
+def test_slow_source_does_not_block_analyses_in_flight():
+    analyzed = threading.Event()
+    waited = []
+
+    def source():
+        yield 'a.example'
+        # A pipe that has nothing more to give until the first result is out
+        waited.append(analyzed.wait(2))
+        yield 'b.example'
+
+    async def analyze(domain):
+        await asyncio.sleep(0)
+        analyzed.set()
+        return {"domain": domain, "success": True}
+
+    results = []
+    summary = asyncio.run(run_batch(source(), analyze, concurrency=4, write=results.append))
+    assert waited == [True]
+    assert [result["domain"] for result in results] == ['a.example', 'b.example']
+    assert summary["domains"] == 2
@@ -0,0 +1,223 @@
+import ipaddress
+import random
+import sys
+
+import pytest
+
+import ip_ranges
+from ip_ranges import HEADER, IPRangeTable, flatten, write_table
+from provider_index import PRIVATE, ProviderIndex
+
+
+def networks(*entries):
+    return [(ipaddress.ip_network(cidr), provider) for cidr, provider in entries]
+
+
+def ranges(*spans):
+    """flatten() output for (version, first address, last address, provider) with addresses as text"""
+    return [(version, int(ipaddress.ip_address(start)), int(ipaddress.ip_address(end)), provider)
+            for version, start, end, provider in spans]
+
+
+@pytest.fixture
+def table(tmp_path):
+    def build(entries):
+        path = str(tmp_path / 'ip_ranges.bin')
+        write_table(entries, path)
+        compiled = IPRangeTable(path)
+        opened.append(compiled)
+        return compiled
+
+    opened = []
+    yield build
+    for compiled in opened:
+        compiled.close()
+
+
+def scan(entries, address):
+    """Most specific range containing address, the later entry winning identical ranges"""
+    ip = ipaddress.ip_address(address)
+    best, best_prefix = None, -1
+    for cidr, provider in entries:
+        network = ipaddress.ip_network(cidr, strict=False)
+        if network.version == ip.version and ip in network and network.prefixlen >= best_prefix:
+            best, best_prefix = provider, network.prefixlen
+    return best
+
+
+def test_flatten_nested_ranges():
+    flat = flatten(networks(('10.0.0.0/8', 'A'), ('10.1.0.0/16', 'B'), ('10.1.2.0/24', 'C')))
+    assert flat == ranges(
+        (4, '10.0.0.0', '10.0.255.255', 'A'),
+        (4, '10.1.0.0', '10.1.1.255', 'B'),
+        (4, '10.1.2.0', '10.1.2.255', 'C'),
+        (4, '10.1.3.0', '10.1.255.255', 'B'),
+        (4, '10.2.0.0', '10.255.255.255', 'A'),
+    )
+
+
+def test_flatten_nested_at_edges():
+    flat = flatten(networks(('10.0.0.0/8', 'A'), ('10.0.0.0/16', 'B'), ('10.255.0.0/16', 'C')))
+    assert flat == ranges(
+        (4, '10.0.0.0', '10.0.255.255', 'B'),
+        (4, '10.1.0.0', '10.254.255.255', 'A'),
+        (4, '10.255.0.0', '10.255.255.255', 'C'),
+    )
+
+
+def test_flatten_identical_ranges_keep_the_last_entry():
+    flat = flatten(networks(('192.0.2.0/24', 'A'), ('192.0.2.0/24', 'B')))
+    assert flat == ranges((4, '192.0.2.0', '192.0.2.255', 'B'))
+
+
+def test_flatten_merges_adjacent_ranges_of_one_provider():
+    flat = flatten(networks(('192.0.2.0/25', 'A'), ('192.0.2.128/25', 'A'), ('198.51.100.0/24', 'A')))
+    assert flat == ranges((4, '192.0.2.0', '192.0.2.255', 'A'), (4, '198.51.100.0', '198.51.100.255', 'A'))
+
+
+def test_flatten_ipv6_and_mixed_versions():
+    flat = flatten(networks(('2001:db8::/32', 'A'), ('10.0.0.0/8', 'V4'), ('2001:db8:1::/48', 'B')))
+    assert flat == ranges(
+        (4, '10.0.0.0', '10.255.255.255', 'V4'),
+        (6, '2001:db8::', '2001:db8:0:ffff:ffff:ffff:ffff:ffff', 'A'),
+        (6, '2001:db8:1::', '2001:db8:1:ffff:ffff:ffff:ffff:ffff', 'B'),
+        (6, '2001:db8:2::', '2001:db8:ffff:ffff:ffff:ffff:ffff:ffff', 'A'),
+    )
+
+
+def test_lookup_nested_and_ipv6(table):
+    compiled = table([('10.0.0.0/8', 'A'), ('10.1.0.0/16', 'B'), ('2001:db8::/32', 'V6'), ('::1/128', PRIVATE)])
+    assert compiled.lookup('10.0.0.0') == 'A'
+    assert compiled.lookup('10.1.255.255') == 'B'
+    assert compiled.lookup('10.2.0.0') == 'A'
+    assert compiled.lookup('10.255.255.255') == 'A'
+    assert compiled.lookup('9.255.255.255') is None
+    assert compiled.lookup('11.0.0.0') is None
+    assert compiled.lookup('2001:db8:ffff::1') == 'V6'
+    assert compiled.lookup('2001:db9::') is None
+    assert compiled.lookup('::1') == PRIVATE
+    assert compiled.lookup('::2') is None
+    assert compiled.lookup('not an address') is None
+    assert sorted(compiled.names) == ['A', 'B', 'V6', PRIVATE]
+
+
+def test_lookup_skips_invalid_cidrs(table):
+    compiled = table([('192.0.2.0/24', 'A'), ('not a cidr', 'B'), ('300.1.1.0/24', 'C')])
+    assert len(compiled) == 1
+    assert compiled.names == ['A']
+
+
+def test_empty_table(table):
+    compiled = table([])
+    assert len(compiled) == 0
+    assert compiled.lookup('192.0.2.1') is None
+    assert compiled.lookup('2001:db8::1') is None
+
+
+def test_lookup_matches_longest_prefix_scan(table):
+    rng = random.Random(5)
+    entries = []
+    for _ in range(300):
+        version = 4 if rng.random() < 0.7 else 6
+        width = 32 if version == 4 else 128
+        prefix = rng.randint(4, 28) if version == 4 else rng.randint(8, 64)
+        # Crowd a small part of the space so blocks nest several levels deep
+        base = rng.getrandbits(12) << (width - 12)
+        address = base | (rng.getrandbits(width - 12) if rng.random() < 0.8 else 0)
+        network = ipaddress.ip_network((address, prefix), strict=False)
+        entries.append((str(network), rng.choice('ABCDE')))
+    compiled = table(entries)
+    for cidr, _provider in entries:
+        network = ipaddress.ip_network(cidr)
+        for value in (int(network.network_address) - 1, int(network.network_address),
+                      int(network.broadcast_address), int(network.broadcast_address) + 1):
+            if 0 <= value < 2 ** network.max_prefixlen:
+                address = str(ipaddress.ip_address(value) if network.version == 4 else ipaddress.IPv6Address(value))
+                assert compiled.lookup(address) == scan(entries, address), address
+
+
+def write_bytes(tmp_path, data):
+    path = tmp_path / 'ip_ranges.bin'
+    path.write_bytes(data)
+    return str(path)
+
+
+@pytest.mark.parametrize('corrupt', [
+    lambda data: b'',
+    lambda data: data[:HEADER.size - 1],
+    lambda data: b'XXXX' + data[4:],
+    lambda data: data[:-1],
+    lambda data: data + b'\0',
+])
+def test_corrupt_table_is_rejected(tmp_path, corrupt):
+    path = str(tmp_path / 'valid.bin')
+    write_table([('192.0.2.0/24', 'A'), ('2001:db8::/32', 'B')], path)
+    with open(path, 'rb') as f:
+        data = f.read()
+    with pytest.raises(ValueError):
+        IPRangeTable(write_bytes(tmp_path, corrupt(data)))
+
+
+@pytest.fixture
+def table_file(monkeypatch, tmp_path):
+    """Point the process-wide table at a file in tmp_path and reload it"""
+    path = tmp_path / 'ip_ranges.bin'
+    monkeypatch.setattr(ip_ranges, 'IP_RANGES_FILE', str(path))
+    monkeypatch.setattr(ip_ranges, '_table', None)
+    monkeypatch.setattr(ip_ranges, '_table_loaded', False)
+    yield path
+    if ip_ranges._table is not None:
+        ip_ranges._table.close()
+
+
+def test_missing_table_is_none(table_file):
+    assert ip_ranges.ip_range_table() is None
+
+
+def test_corrupt_table_is_ignored(table_file, capsys):
+    table_file.write_bytes(b'IPRT garbage')
+    assert ip_ranges.ip_range_table() is None
+    assert 'Ignoring IP range table' in capsys.readouterr().err
+
+
+def test_provider_index_falls_back_to_providers_json(table):
+    compiled = table([('3.5.0.0/16', 'AWS'), ('104.16.0.0/13', 'Cloudflare')])
+    index = ProviderIndex.load(ip_table=compiled)
+    assert index.ip_provider('3.5.1.1') == 'AWS'
+    assert index.ip_provider('104.16.1.1') == 'Cloudflare'
+    # Providers without a published range file are still known from providers.json
+    assert index.ip_provider('76.76.21.21') == 'Vercel'
+    assert index.ip_provider('75.2.60.5') == 'Netlify'
+    assert index.ip_provider('199.36.158.100') == 'Zoho'
+    assert index.ip_provider('10.0.0.1') == PRIVATE
+    # Missed by the table and not guessed from a coarse prefix either
+    assert index.ip_provider('3.6.1.1') is None
+    assert index.ip_provider('104.0.0.1') is None
+
+
+def test_fetch_without_any_source_writes_no_table(monkeypatch, tmp_path):
+    def unreachable(url, timeout=30):
+        raise OSError('unreachable')
+
+    output = tmp_path / 'ip_ranges.bin'
+    monkeypatch.setattr(ip_ranges, 'fetch', unreachable)
+    monkeypatch.setattr(sys, 'argv', ['ip_ranges.py', 'fetch', '-o', str(output)])
+    with pytest.raises(SystemExit) as exited:
+        ip_ranges.main()
+    assert exited.value.code == 1
+    assert not output.exists()
+
+
+def test_compile_writes_table(monkeypatch, tmp_path, capsys):
+    cidrs = tmp_path / 'vercel.txt'
+    cidrs.write_text('76.76.21.0/24  # edge\n\n2001:db8::/32\n')
+    output = tmp_path / 'ip_ranges.bin'
+    monkeypatch.setattr(sys, 'argv', ['ip_ranges.py', 'compile', '--cidrs', 'Vercel', str(cidrs), '-o', str(output)])
+    ip_ranges.main()
+    compiled = IPRangeTable(str(output))
+    try:
+        assert compiled.lookup('76.76.21.21') == 'Vercel'
+        assert compiled.lookup('2001:db8::1') == 'Vercel'
+        assert compiled.lookup('10.1.1.1') == PRIVATE
+    finally:
+        compiled.close()
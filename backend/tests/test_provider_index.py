@@ -0,0 +1,138 @@
+import ipaddress
+import json
+import random
+
+import pytest
+
+from provider_index import HOSTING_SITE_TOKEN, PRIVATE, PROVIDERS_FILE, AhoCorasick, CIDRTrie, ProviderIndex
+
+
+@pytest.fixture(scope='module')
+def data():
+    with open(PROVIDERS_FILE, encoding='utf-8') as f:
+        return json.load(f)
+
+
+@pytest.fixture(scope='module')
+def index(data):
+    return ProviderIndex(data)
+
+
+def scan(entries, texts):
+    """The linear scan the index replaces: first entry, in priority order, with a pattern in any text"""
+    for entry in entries:
+        if any(pattern.lower() in text.lower() for text in texts for pattern in entry["patterns"]):
+            return entry["name"]
+    return None
+
+
+def scan_ip(data, address):
+    """Longest prefix containing address over every range, private ranges winning equal prefixes"""
+    ip = ipaddress.ip_address(address)
+    ranges = [(cidr, entry["name"]) for entry in data["hosting_providers"]["ip_ranges"] for cidr in entry["cidrs"]]
+    ranges += [(cidr, PRIVATE) for cidr in data["private_ranges"]]
+    best, best_prefix = None, -1
+    for cidr, name in ranges:
+        network = ipaddress.ip_network(cidr, strict=False)
+        if network.version == ip.version and ip in network and network.prefixlen >= best_prefix:
+            best, best_prefix = name, network.prefixlen
+    return best
+
+
+def samples(entries, count=2000, seed=7):
+    """Strings embedding zero, one or several patterns among filler, plus every pattern on its own"""
+    rng = random.Random(seed)
+    patterns = [pattern for entry in entries for pattern in entry["patterns"]]
+    alphabet = sorted(set(''.join(patterns)) | set('.-0123456789'))
+    texts = list(patterns) + [pattern.upper() for pattern in patterns]
+    for _ in range(count):
+        pieces = []
+        for _ in range(rng.randint(1, 4)):
+            if rng.random() < 0.5:
+                pattern = rng.choice(patterns)
+                # Whole patterns, and prefixes/suffixes of them that must not match
+                cut = rng.choice([None, 1, -1])
+                pieces.append(pattern if cut is None else pattern[cut:] if cut > 0 else pattern[:cut])
+            else:
+                pieces.append(''.join(rng.choice(alphabet) for _ in range(rng.randint(1, 8))))
+        texts.append(''.join(pieces))
+    return texts
+
+
+def test_aho_corasick_finds_every_occurrence():
+    matcher = AhoCorasick([('he', 1), ('she', 2), ('his', 3), ('hers', 4), ('e', 5)])
+    assert matcher.find('ushers') == {1, 2, 4, 5}
+    assert matcher.find('this') == {3}
+    assert matcher.find('xyz') == frozenset()
+
+
+def test_dns_provider_matches_linear_scan(data, index):
+    entries = data["dns_providers"]
+    texts = samples(entries)
+    for text in texts:
+        assert index.dns_provider([text]) == scan(entries, [text]), text
+    rng = random.Random(11)
+    for _ in range(500):
+        ns_records = rng.sample(texts, rng.randint(1, 4))
+        assert index.dns_provider(ns_records) == scan(entries, ns_records), ns_records
+
+
+def test_cname_provider_matches_linear_scan(data, index):
+    entries = data["hosting_providers"]["cname"]
+    for text in samples(entries):
+        assert index.cname_provider(text) == scan(entries, [text]), text
+
+
+def test_txt_provider_matches_linear_scan(data, index):
+    entries = data["hosting_providers"]["txt"]
+    for text in samples(entries):
+        expected = -1 if HOSTING_SITE_TOKEN in text.lower() else scan(entries, [text])
+        match = index.txt_provider(text)
+        assert (match[0] if match and match[0] < 0 else match and match[1]) == expected, text
+
+
+def test_hosting_site_token_outranks_patterns(index):
+    assert index.txt_provider('vercel hosting-site=my-host') == (-1, None)
+
+
+def test_ip_provider_matches_range_scan(data, index):
+    networks = [ipaddress.ip_network(cidr, strict=False)
+                for entry in data["hosting_providers"]["ip_ranges"] for cidr in entry["cidrs"]]
+    networks += [ipaddress.ip_network(cidr, strict=False) for cidr in data["private_ranges"]]
+    addresses = []
+    for network in networks:
+        first, last = int(network.network_address), int(network.broadcast_address)
+        cls = ipaddress.IPv4Address if network.version == 4 else ipaddress.IPv6Address
+        for value in (first - 1, first, (first + last) // 2, last, last + 1):
+            if 0 <= value < 2 ** network.max_prefixlen:
+                addresses.append(str(cls(value)))
+    rng = random.Random(3)
+    addresses += [str(ipaddress.IPv4Address(rng.getrandbits(32))) for _ in range(3000)]
+    addresses += [str(ipaddress.IPv6Address(rng.getrandbits(128))) for _ in range(200)]
+    for address in addresses:
+        assert index.ip_provider(address) == scan_ip(data, address), address
+
+
+def test_ip_provider_known_addresses(index):
+    assert index.ip_provider('76.76.21.21') == 'Vercel'
+    assert index.ip_provider('185.199.108.153') == 'GitHub Pages'
+    assert index.ip_provider('172.20.0.1') == PRIVATE
+
+
+def test_no_guesses_for_providers_with_published_ranges(index):
+    # AWS, Google Cloud, Azure and Cloudflare are only known from the compiled range table
+    for address in ('3.5.1.1', '34.120.0.1', '13.1.1.1', '104.0.0.1', '172.64.1.1'):
+        assert index.ip_provider(address) is None, address
+    assert index.ip_provider('not an address') is None
+
+
+def test_cidr_trie_longest_prefix():
+    trie = CIDRTrie()
+    trie.insert('10.0.0.0/8', 'wide')
+    trie.insert('10.1.0.0/16', 'narrow')
+    trie.insert('2001:db8::/32', 'v6')
+    assert trie.lookup('10.1.2.3') == 'narrow'
+    assert trie.lookup('10.2.0.1') == 'wide'
+    assert trie.lookup('11.0.0.1') is None
+    assert trie.lookup('2001:db8::1') == 'v6'
+    assert trie.lookup('2001:db9::1') is None
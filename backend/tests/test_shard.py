@@ -0,0 +1,46 @@
+import json
+import os
+
+from dns_shard import run_sharded_batch
+
+
+def encode(result):
+    data = json.dumps(result).encode('utf-8')
+    return data, len(data)
+
+
+def echo_setup(_args):
+    async def analyze(domain):
+        return {"domain": domain, "success": True}
+
+    return analyze, encode, lambda: {"pid": os.getpid()}
+
+
+def dying_setup(_args):
+    async def analyze(domain):
+        os._exit(1)
+
+    return analyze, encode, dict
+
+
+def run(setup, domains, **kwargs):
+    written = []
+    summary = run_sharded_batch(domains, setup, None, 2, concurrency=4, write=lambda data, _size: written.append(data),
+                                encode=encode, chunk_size=2, **kwargs)
+    return summary, [json.loads(data) for data in written]
+
+
+def test_results_in_input_order():
+    domains = [f'd{n}.example' for n in range(50)]
+    summary, results = run(echo_setup, domains, ordered=True)
+    assert [result["domain"] for result in results] == domains
+    assert summary["domains"] == 50 and summary["processes"] == 2
+    assert len(summary["shards"]) == 2
+
+
+def test_input_left_when_every_worker_died_is_reported():
+    domains = [f'd{n}.example' for n in range(100)]
+    summary, results = run(dying_setup, domains)
+    assert sorted(result["domain"] for result in results) == sorted(domains)
+    assert all(result["error"] == 'analysis process exited' for result in results)
+    assert summary["domains"] == 100
@@ -0,0 +1,229 @@
+import asyncio
+import time
+
+import dns.name
+import dns.rdata
+import dns.resolver
+import pytest
+
+import dns_spf
+from dns_spf import (MAX_LOOKUPS, PERMERROR, SPFIncludeCache, SPFNode, evaluate_record, evaluate_spf,
+                     parse_record, split_cidr, target_domain)
+
+
+class FakeAnswer:
+    def __init__(self, rdtype, values, ttl):
+        self.rrset = [dns.rdata.from_text('IN', rdtype, value) for value in values]
+        self.expiration = time.time() + ttl
+
+    def __iter__(self):
+        return iter(self.rrset)
+
+
+class FakeSession:
+    """resolve() from a {(qname, rdtype): ([values], ttl)} table, NXDOMAIN for anything else"""
+
+    def __init__(self, records, delay=0.0):
+        self.records = records
+        self.delay = delay
+        self.queries = []
+
+    async def resolve(self, qname, rdtype):
+        self.queries.append((qname, rdtype))
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        found = self.records.get((qname, rdtype))
+        if found is None:
+            name = dns.name.from_text(qname)
+            raise dns.resolver.NXDOMAIN(qnames=[name], responses={name: None})
+        values, ttl = found
+        return FakeAnswer(rdtype, values, ttl)
+
+
+def spf(record, ttl=300):
+    # Long records are split into 255-byte strings, which evaluation joins back together
+    return [' '.join(f'"{record[start:start + 255]}"' for start in range(0, len(record), 255))], ttl
+
+
+@pytest.fixture(autouse=True)
+def include_cache():
+    cache = dns_spf.configure_spf_evaluation(cache_entries=100)
+    yield cache
+    dns_spf.configure_spf_evaluation()
+
+
+def test_parse_record_terms_and_modifiers():
+    terms, modifiers = parse_record('v=spf1 ip4:192.0.2.0/24 -a/24//64 ~mx:mail.example.com '
+                                    '?include:_spf.example.net ptr -all redirect=other.example exp=why.example')
+    assert terms == [
+        ('+', 'ip4', '192.0.2.0/24'),
+        ('-', 'a', '/24//64'),
+        ('~', 'mx', 'mail.example.com'),
+        ('?', 'include', '_spf.example.net'),
+        ('+', 'ptr', ''),
+        ('-', 'all', ''),
+    ]
+    assert modifiers == {'redirect': 'other.example', 'exp': 'why.example'}
+
+
+def test_parse_record_rejects_unknown_mechanism():
+    with pytest.raises(ValueError):
+        parse_record('v=spf1 ip5:192.0.2.1 -all')
+
+
+def test_split_cidr_and_target_domain():
+    assert split_cidr('example.com/24//64') == ('example.com', 24, 64)
+    assert split_cidr('/16') == ('', 16, 128)
+    assert split_cidr('') == ('', 32, 128)
+    assert target_domain('', 'example.com') == 'example.com'
+    assert target_domain('_spf.%{d}.', 'example.com') == '_spf.example.com'
+    assert target_domain('%{i}.spf.example.com', 'example.com') is None
+
+
+def test_evaluate_flattens_pass_ranges():
+    session = FakeSession({
+        ('example.com', 'TXT'): spf('v=spf1 ip4:192.0.2.0/25 ip4:192.0.2.128/25 -ip4:198.51.100.1 a '
+                                    'include:_spf.example.net -all'),
+        ('example.com', 'A'): (['203.0.113.7'], 300),
+        ('_spf.example.net', 'TXT'): spf('v=spf1 ip6:2001:db8::/32 ~all'),
+    })
+    result = asyncio.run(evaluate_spf(session, 'example.com'))
+    assert result["status"] == 'ok'
+    assert result["lookups"] == 2
+    assert result["ip4"] == ['192.0.2.0/24', '203.0.113.7/32']
+    assert result["ip6"] == ['2001:db8::/32']
+    assert result["includes"] == [{"domain": '_spf.example.net', "lookups": 0, "includes": []}]
+
+
+def test_lookup_limit_counts_includes():
+    records = {('example.com', 'TXT'): spf('v=spf1 ' + ' '.join(f'include:i{n}.example' for n in range(6)) + ' -all')}
+    for n in range(6):
+        records[(f'i{n}.example', 'TXT')] = spf('v=spf1 a -all')
+        records[(f'i{n}.example', 'A')] = (['192.0.2.1'], 300)
+    result = asyncio.run(evaluate_spf(FakeSession(records), 'example.com'))
+    assert result["lookups"] == 12
+    assert result["status"] == PERMERROR
+    assert f"{PERMERROR}: 12 DNS lookups, the limit is {MAX_LOOKUPS}" in result["errors"]
+
+
+def test_lookup_limit_within_one_record_stops_following():
+    record = 'v=spf1 ' + ' '.join(f'include:i{n}.example' for n in range(15)) + ' -all'
+    session = FakeSession({('example.com', 'TXT'): spf(record)})
+    result = asyncio.run(evaluate_spf(session, 'example.com'))
+    assert result["status"] == PERMERROR
+    assert sum(1 for qname, _rdtype in session.queries if qname.startswith('i')) == MAX_LOOKUPS + 1
+
+
+def test_void_lookup_limit():
+    session = FakeSession({('example.com', 'TXT'): spf('v=spf1 a:none1.example a:none2.example mx:none3.example -all')})
+    result = asyncio.run(evaluate_spf(session, 'example.com'))
+    assert result["void_lookups"] == 3
+    assert result["status"] == PERMERROR
+
+
+def test_nesting_depth_limit():
+    records = {(f'd{n}.example', 'TXT'): spf(f'v=spf1 include:d{n + 1}.example') for n in range(20)}
+    result = asyncio.run(evaluate_spf(FakeSession(records), 'd0.example'))
+    assert result["status"] == PERMERROR
+    assert any('nesting deeper than' in error for error in result["errors"])
+
+
+def test_redirect_only_without_all():
+    records = {
+        ('example.com', 'TXT'): spf('v=spf1 redirect=_spf.example.net'),
+        ('_spf.example.net', 'TXT'): spf('v=spf1 ip4:192.0.2.1 -all'),
+        ('other.com', 'TXT'): spf('v=spf1 -all redirect=_spf.example.net'),
+    }
+    assert asyncio.run(evaluate_spf(FakeSession(records), 'example.com'))["ip4"] == ['192.0.2.1/32']
+    ignored = asyncio.run(evaluate_spf(FakeSession(records), 'other.com'))
+    assert ignored["ip4"] == [] and ignored["lookups"] == 0
+
+
+def test_include_loop_is_permerror():
+    records = {
+        ('a.example', 'TXT'): spf('v=spf1 include:b.example -all'),
+        ('b.example', 'TXT'): spf('v=spf1 include:a.example -all'),
+    }
+    result = asyncio.run(evaluate_spf(FakeSession(records), 'a.example'))
+    assert result["status"] == PERMERROR
+    assert any('include loop' in error for error in result["errors"])
+
+
+def test_include_loop_started_from_both_ends_does_not_wait(include_cache):
+    records = {
+        ('a.example', 'TXT'): spf('v=spf1 include:b.example -all'),
+        ('b.example', 'TXT'): spf('v=spf1 include:a.example -all'),
+    }
+    session = FakeSession(records, delay=0.01)
+
+    async def both():
+        return await asyncio.wait_for(
+            asyncio.gather(evaluate_spf(session, 'a.example'), evaluate_spf(session, 'b.example')), 1
+        )
+
+    for result in asyncio.run(both()):
+        assert result["status"] == PERMERROR
+        assert any('include loop' in error for error in result["errors"])
+    # Loops are never cached
+    assert include_cache.stats()["entries"] == 0
+
+
+def test_shared_include_is_evaluated_once(include_cache):
+    records = {
+        ('a.example', 'TXT'): spf('v=spf1 include:_spf.shared.example -all'),
+        ('b.example', 'TXT'): spf('v=spf1 include:_spf.shared.example -all'),
+        ('_spf.shared.example', 'TXT'): spf('v=spf1 ip4:192.0.2.0/24 -all'),
+    }
+    session = FakeSession(records, delay=0.01)
+
+    async def both():
+        return await asyncio.gather(evaluate_spf(session, 'a.example'), evaluate_spf(session, 'b.example'))
+
+    first, second = asyncio.run(both())
+    assert first["ip4"] == second["ip4"] == ['192.0.2.0/24']
+    assert session.queries.count(('_spf.shared.example', 'TXT')) == 1
+
+
+def test_merge_uses_remaining_ttl_of_cached_child():
+    child = SPFNode('child.example')
+    child.ttl = 300
+    child.expires = time.time() + 40
+    parent = SPFNode('parent.example')
+    parent.observe(300)
+    parent.merge(child, True)
+    assert parent.ttl <= 40
+
+
+def test_cached_include_bounds_parent_cache_lifetime(include_cache):
+    records = {
+        ('parent.example', 'TXT'): spf('v=spf1 include:child.example -all', ttl=300),
+        ('child.example', 'TXT'): spf('v=spf1 ip4:192.0.2.1 -all', ttl=300),
+    }
+    session = FakeSession(records)
+    asyncio.run(evaluate_spf(session, 'child.example'))
+    # The cached child has 30s left of its 300s
+    include_cache.get('child.example').expires = time.time() + 30
+    asyncio.run(evaluate_spf(session, 'parent.example'))
+    parent = include_cache.get('parent.example')
+    assert parent.ttl <= 30
+    assert parent.expires <= time.time() + 30
+
+
+def test_failed_lookup_is_not_cached(include_cache):
+    class FailingSession(FakeSession):
+        async def resolve(self, qname, rdtype):
+            if qname == 'broken.example':
+                raise dns.resolver.LifetimeTimeout(timeout=1.0, errors=[])
+            return await super().resolve(qname, rdtype)
+
+    session = FailingSession({('example.com', 'TXT'): spf('v=spf1 include:broken.example -all')})
+    result = asyncio.run(evaluate_spf(session, 'example.com'))
+    assert result["status"] == 'temperror'
+    assert include_cache.stats()["entries"] == 0
+
+
+def test_evaluate_record_without_cache():
+    records = {('example.com', 'TXT'): spf('v=spf1 ip4:192.0.2.1 -all')}
+    node = asyncio.run(evaluate_record(FakeSession(records), 'example.com'))
+    assert node.record == 'v=spf1 ip4:192.0.2.1 -all'
+    assert node.ttl <= 300
@@ -0,0 +1,122 @@
+import time
+
+import dns.exception
+import dns.message
+import pytest
+
+import dns_transport
+from dns_transport import (CLOSED, HALF_OPEN, OPEN, CircuitBreaker, ClosedLocally, PooledNameserver, RetryBudget,
+                           Upstream)
+
+
+def fail(breaker, names, may_open=True):
+    for name in names:
+        breaker.failure(name, may_open)
+
+
+def test_one_name_never_opens_the_circuit():
+    breaker = CircuitBreaker(threshold=3)
+    fail(breaker, ['lame.example.'] * 20)
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+
+
+def test_failures_across_names_open_the_circuit():
+    breaker = CircuitBreaker(threshold=3)
+    fail(breaker, ['a.example.', 'b.example.'])
+    assert breaker.state == CLOSED
+    fail(breaker, ['c.example.'])
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert breaker.short_circuited == 1
+
+
+def test_success_resets_the_count():
+    breaker = CircuitBreaker(threshold=3)
+    fail(breaker, ['a.example.', 'b.example.'])
+    breaker.success()
+    fail(breaker, ['c.example.', 'd.example.'])
+    assert breaker.state == CLOSED
+
+
+def test_last_healthy_upstream_stays_closed():
+    breaker = CircuitBreaker(threshold=3)
+    fail(breaker, [f'{n}.example.' for n in range(10)], may_open=False)
+    assert breaker.state == CLOSED
+
+
+def test_probe_readmits_and_failed_probe_backs_off():
+    breaker = CircuitBreaker(threshold=3, open_seconds=0.05, max_open_seconds=0.15)
+    fail(breaker, ['a.', 'b.', 'c.'])
+    time.sleep(0.06)
+    assert breaker.allow() and breaker.state == HALF_OPEN
+    # Only one probe at a time
+    assert not breaker.allow()
+    breaker.failure('d.')
+    assert breaker.state == OPEN and breaker.open_seconds == pytest.approx(0.1)
+    time.sleep(0.11)
+    assert breaker.allow()
+    breaker.success()
+    assert breaker.state == CLOSED and breaker.open_seconds == pytest.approx(0.05)
+
+
+def test_abandoned_probe_frees_the_slot():
+    breaker = CircuitBreaker(threshold=3, open_seconds=0.01)
+    fail(breaker, ['a.', 'b.', 'c.'])
+    time.sleep(0.02)
+    assert breaker.allow()
+    breaker.abandoned()
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
+
+
+def test_failed_probe_on_last_healthy_upstream_lets_the_next_query_probe():
+    breaker = CircuitBreaker(threshold=3, open_seconds=0.01)
+    fail(breaker, ['a.', 'b.', 'c.'])
+    time.sleep(0.02)
+    assert breaker.allow()
+    breaker.failure('d.', may_open=False)
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
+
+
+def test_resolution_is_charged_once():
+    primary = Upstream('192.0.2.1')
+    primary.breaker = CircuitBreaker(threshold=3)
+    request = dns.message.make_query('a.example.', 'A')
+    for _copy in range(6):
+        PooledNameserver._charge(request, primary, dns.exception.Timeout(), False, True)
+    assert primary.breaker.failures == 1
+
+
+def test_locally_closed_socket_is_not_charged():
+    primary = Upstream('192.0.2.1')
+    primary.breaker = CircuitBreaker(threshold=3)
+    for name in ('a.example.', 'b.example.', 'c.example.'):
+        request = dns.message.make_query(name, 'A')
+        PooledNameserver._charge(request, primary, ClosedLocally('UDP socket closed'), False, True)
+    assert primary.breaker.failures == 0
+    assert primary.breaker.state == CLOSED
+
+
+def test_retry_budget():
+    budget = RetryBudget(ratio=0.5, burst=2)
+    assert [budget.retry() for _ in range(3)] == [True, True, False]
+    budget.attempt()
+    budget.attempt()
+    assert budget.retry()
+    assert budget.stats()["denied"] == 1
+
+
+def test_sync_query_uses_a_plain_nameserver(monkeypatch):
+    calls = []
+
+    def query(self, request, timeout, source, source_port, max_size, one_rr_per_rrset=False, ignore_trailing=False):
+        calls.append((type(self).__name__, self.address, self.port, max_size))
+        return 'response'
+
+    monkeypatch.setattr(dns_transport.dns.nameserver.Do53Nameserver, 'query', query)
+    nameserver = PooledNameserver('192.0.2.1', 5353)
+    request = dns.message.make_query('example.com.', 'A')
+    assert nameserver.query(request, 1.0, None, 0, False) == 'response'
+    assert calls == [('Do53Nameserver', '192.0.2.1', 5353, False)]